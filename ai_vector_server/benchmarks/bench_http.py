@@ -0,0 +1,192 @@
+import argparse
+import asyncio
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import httpx
+
+from common import (
+    SERVER_DIR, synthetic_texts, synthetic_queries, latency_stats,
+    environment_info, write_results, default_output
+)
+from stub_embedding import StubEmbeddingServer
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def start_server(args, stub, workdir):
+    # 向量服务以子进程运行，工作目录为临时目录，不读取开发环境中的.env
+    port = free_port()
+    env = dict(
+        os.environ,
+        AI_API_URL=stub.base_url,
+        AI_API_KEY='bench',
+        AI_MODEL='bench-embedding',
+        EMBEDDING_DIM=str(args.dim),
+        EMBEDDING_CACHE_SIZE=str(args.cache_size),
+        METRICS_TIMING_HEADERS='false',
+        VECTOR_STORE_DISK_INDEX_PATH=os.path.join(workdir, 'faiss_index.index'),
+        VECTOR_STORE_DISK_IDS_PATH=os.path.join(workdir, 'doc_ids.npy'),
+        VECTOR_STORE_DISK_TEXTS_PATH=os.path.join(workdir, 'doc_texts.bin'),
+        VECTOR_COLLECTIONS_PATH=os.path.join(workdir, 'collections')
+    )
+    env.pop('EMBEDDING_CACHE_PATH', None)
+    command = [
+        sys.executable, os.path.join(SERVER_DIR, 'server.py'),
+        '--port', str(port), '--store-type', args.store_type, '--index-type', args.index_type
+    ]
+    log = open(os.path.join(workdir, 'server.log'), 'w')
+    process = subprocess.Popen(command, cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+
+    deadline = time.time() + args.startup_timeout
+    while time.time() < deadline:
+        if process.poll() is not None:
+            log.close()
+            with open(log.name, 'r', encoding='utf-8', errors='replace') as f:
+                tail = ''.join(f.readlines()[-20:])
+            raise RuntimeError(f"Vector server exited with code {process.returncode}:\n{tail}")
+        try:
+            if httpx.get(base_url + '/cache-stats', timeout=1).status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f"Vector server did not start within {args.startup_timeout} seconds")
+
+async def run_phase(client, name, requests, concurrency):
+    # 固定数量的并发worker依次取出请求，测量每个请求的端到端延迟
+    pending = iter(requests)
+    samples = []
+    errors = 0
+
+    async def worker():
+        nonlocal errors
+        for path, body in pending:
+            start = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                ok = response.status_code == 200 and response.json().get('status', 'ok') == 'ok'
+            except httpx.HTTPError:
+                ok = False
+            samples.append(time.perf_counter() - start)
+            if not ok:
+                errors += 1
+
+    began = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    seconds = time.perf_counter() - began
+    result = dict(latency_stats(samples), concurrency=concurrency, errors=errors, seconds=seconds,
+                  rps=len(samples) / seconds if seconds else None)
+    print(f"  {name}: {result['rps']:.0f} req/s, p50 {result.get('p50_ms', 0):.2f} ms, p99 {result.get('p99_ms', 0):.2f} ms, {errors} errors")
+    return result
+
+def parse_stage_metrics(text):
+    # 从/metrics中取出各阶段的平均耗时，便于区分延迟来自嵌入接口、搜索还是取回文本
+    sums = {}
+    counts = {}
+    for line in text.splitlines():
+        match = re.match(r'vector_server_stage_seconds_(sum|count)\{stage="([^"]+)",backend="([^"]+)"\} (\S+)', line)
+        if match:
+            target = sums if match.group(1) == 'sum' else counts
+            target[f"{match.group(2)}/{match.group(3)}"] = float(match.group(4))
+    return {
+        key: {"count": int(counts[key]), "mean_ms": sums[key] / counts[key] * 1000}
+        for key in sums if counts.get(key)
+    }
+
+async def run_benchmark(args, base_url):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        results = {}
+        texts = synthetic_texts(0, args.docs, seed=args.seed)
+        print(f"Loading {args.docs} documents via /add-doc...")
+        results["add-doc"] = await run_phase(
+            client, 'add-doc',
+            (('/add-doc', {"doc_id": i, "text": text}) for i, text in enumerate(texts)),
+            args.concurrency
+        )
+
+        if args.bulk_docs:
+            bulk_texts = synthetic_texts(args.docs, args.bulk_docs, seed=args.seed)
+            batches = [
+                ('/add-docs', {"docs": [
+                    {"doc_id": args.docs + start + i, "text": text}
+                    for i, text in enumerate(bulk_texts[start:start + args.bulk_batch])
+                ]})
+                for start in range(0, len(bulk_texts), args.bulk_batch)
+            ]
+            results["add-docs"] = await run_phase(client, 'add-docs', batches, args.concurrency)
+            results["add-docs"]["docs_per_second"] = args.bulk_docs / results["add-docs"]["seconds"]
+
+        queries = synthetic_queries(args.queries, seed=args.seed)
+        for mode in args.modes.split(','):
+            results[f"search-{mode}"] = await run_phase(
+                client, f'search ({mode})',
+                (('/search', {"text": query, "top_k": args.top_k, "mode": mode}) for query in queries),
+                args.concurrency
+            )
+
+        results["stages"] = parse_stage_metrics((await client.get('/metrics')).text)
+        results["index"] = (await client.get('/index-info')).json()
+        results["cache"] = (await client.get('/cache-stats')).json()
+        return results
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP load test for /add-doc and /search with a stubbed embedding API')
+    parser.add_argument('--docs', type=int, default=2000, help='Documents added one by one via /add-doc')
+    parser.add_argument('--bulk-docs', type=int, default=10000, help='Documents added via /add-docs (0 to skip)')
+    parser.add_argument('--bulk-batch', type=int, default=100, help='Documents per /add-docs request')
+    parser.add_argument('--queries', type=int, default=2000, help='Queries per search mode')
+    parser.add_argument('--modes', type=str, default='vector,hybrid', help='Comma-separated search modes')
+    parser.add_argument('--top-k', type=int, default=5, help='Results per query')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent client connections')
+    parser.add_argument('--dim', type=int, default=1536, help='Stub embedding dimension')
+    parser.add_argument('--embed-latency-ms', type=float, default=20.0, help='Artificial latency of the stub embedding API')
+    parser.add_argument('--cache-size', type=int, default=10000, help='EMBEDDING_CACHE_SIZE for the server')
+    parser.add_argument('--store-type', type=str, choices=['memory', 'disk'], default='memory', help='Vector store type')
+    parser.add_argument('--index-type', type=str, choices=['flat', 'ivf_flat', 'hnsw', 'ivf_pq'], default='flat', help='FAISS index type')
+    parser.add_argument('--url', type=str, default=None, help='Benchmark an already running server instead of starting one')
+    parser.add_argument('--startup-timeout', type=float, default=60, help='Seconds to wait for the server to start')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic corpus')
+    parser.add_argument('--output', type=str, default=None, help='Path of the JSON results file')
+    args = parser.parse_args()
+
+    stub = None
+    process = None
+    workdir = tempfile.mkdtemp(prefix='bench-http-')
+    try:
+        if args.url:
+            base_url = args.url.rstrip('/')
+        else:
+            stub = StubEmbeddingServer(dim=args.dim, latency_ms=args.embed_latency_ms).start()
+            process, base_url = start_server(args, stub, workdir)
+        results = asyncio.run(run_benchmark(args, base_url))
+        if stub is not None:
+            results["stub_embedding"] = stub.stats()
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if stub is not None:
+            stub.stop()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    parameters = {key: value for key, value in vars(args).items() if key not in ('output', 'url', 'startup_timeout')}
+    write_results(args.output or default_output('http'), {
+        "benchmark": "http",
+        "environment": environment_info(),
+        "parameters": parameters,
+        "results": results
+    })
+
+if __name__ == "__main__":
+    main()
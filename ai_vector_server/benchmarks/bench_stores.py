@@ -0,0 +1,293 @@
+import argparse
+import gc
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import multiprocessing
+
+from common import (
+    synthetic_vectors, synthetic_texts, synthetic_queries, latency_stats, rss_mb,
+    environment_info, write_results, default_output
+)
+from vector_store import create_vector_store
+
+# 查询向量取自语料之外的批次起点，不与库中向量重合
+QUERY_OFFSET = 1 << 40
+
+def make_store(config, workdir, mmap=False):
+    options = {
+        'index_type': config['index_type'],
+        'nlist': config['nlist'],
+        'nprobe': config['nprobe'],
+        'ef_search': config['ef_search'],
+        'hnsw_m': config['hnsw_m'],
+        'pq_m': config['pq_m'],
+        'train_threshold': config['train_threshold'],
+        'lexical': config['lexical'],
+        'encoding': config['encoding'],
+        'pca_dim': config['pca_dim'],
+        'shards': config['shards']
+    }
+    if config['store'] == 'disk':
+        return create_vector_store(
+            store_type='disk',
+            index_path=os.path.join(workdir, 'faiss_index.index'),
+            ids_path=os.path.join(workdir, 'doc_ids.npy'),
+            texts_path=os.path.join(workdir, 'doc_texts.bin'),
+            # 基准测试只在结束时保存一次快照
+            snapshot_interval=0,
+            snapshot_wal_bytes=1 << 62,
+            mmap=mmap,
+            **options
+        )
+    if config['store'] == 'milvus':
+        return create_vector_store(
+            store_type='milvus',
+            host=config['milvus_host'],
+            port=config['milvus_port'],
+            uri=config['milvus_uri'],
+            insert_batch=config['milvus_insert_batch'],
+            collection_name=f"bench_{config['index_type']}_{config['size']}"
+        )
+    return create_vector_store(store_type='memory', **options)
+
+def measure_add(store, config):
+    size, dim, batch_size = config['size'], config['dim'], config['batch_size']
+    batch_seconds = []
+    for start in range(0, size, batch_size):
+        count = min(batch_size, size - start)
+        # 数据生成不计入写入耗时
+        vectors = synthetic_vectors(start, count, dim, seed=config['seed'])
+        texts = synthetic_texts(start, count, seed=config['seed'])
+        began = time.perf_counter()
+        if not store.add_vectors(vectors, list(range(start, start + count)), texts):
+            raise RuntimeError(f"add_vectors failed at offset {start}")
+        batch_seconds.append(time.perf_counter() - began)
+    # 写入耗时包括写出Milvus缓冲区中剩余的行
+    if hasattr(store, 'flush'):
+        began = time.perf_counter()
+        if not store.flush():
+            raise RuntimeError("flush failed")
+        batch_seconds.append(time.perf_counter() - began)
+    total = sum(batch_seconds)
+    return {
+        "seconds": total,
+        "vectors_per_second": size / total if total else None,
+        "batch_size": batch_size,
+        "batch_latency": latency_stats(batch_seconds)
+    }
+
+def measure_search(store, config):
+    queries = synthetic_vectors(QUERY_OFFSET, config['queries'], config['dim'], seed=config['seed'])
+    top_k = config['top_k']
+    # 预热：首次搜索会分配缓冲区，HNSW/IVF参数也在首次搜索时生效
+    store.search_batch(queries[:10], top_k)
+
+    # 单条查询的串行延迟
+    samples = []
+    began = time.perf_counter()
+    for query in queries:
+        start = time.perf_counter()
+        store.search_batch([query], top_k)
+        samples.append(time.perf_counter() - start)
+    serial_seconds = time.perf_counter() - began
+
+    # 全部查询合并为一次批量搜索（/search-batch的路径）
+    began = time.perf_counter()
+    store.search_batch(queries, top_k)
+    batch_seconds = time.perf_counter() - began
+
+    # 多线程并发的单条查询（/search在线程池中的路径），读锁下可以并行
+    def search_one(query):
+        start = time.perf_counter()
+        store.search_batch([query], top_k)
+        return time.perf_counter() - start
+    with ThreadPoolExecutor(max_workers=config['threads']) as executor:
+        began = time.perf_counter()
+        concurrent_samples = list(executor.map(search_one, queries))
+        concurrent_seconds = time.perf_counter() - began
+
+    return {
+        "top_k": top_k,
+        "serial": dict(latency_stats(samples), qps=len(queries) / serial_seconds),
+        "batch": {"queries": len(queries), "seconds": batch_seconds, "qps": len(queries) / batch_seconds},
+        "concurrent": dict(
+            latency_stats(concurrent_samples),
+            threads=config['threads'],
+            qps=len(queries) / concurrent_seconds
+        )
+    }
+
+def measure_lexical(store, config):
+    if not hasattr(store, 'search_lexical') or not config['lexical']:
+        return None
+    samples = []
+    for query in synthetic_queries(min(config['queries'], 200), seed=config['seed']):
+        start = time.perf_counter()
+        store.search_lexical(query, config['top_k'])
+        samples.append(time.perf_counter() - start)
+    return latency_stats(samples)
+
+def file_sizes(workdir):
+    return {name: os.path.getsize(os.path.join(workdir, name)) for name in sorted(os.listdir(workdir))}
+
+def run_config(config):
+    # 每个配置在独立的子进程中运行，常驻内存从同一起点开始统计；--workdir指定的目录不存在时自动创建
+    os.makedirs(config['workdir'], exist_ok=True)
+    workdir = tempfile.mkdtemp(prefix='bench-', dir=config['workdir'])
+    result = {key: config[key] for key in ('store', 'index_type', 'encoding', 'pca_dim', 'shards', 'size', 'dim')}
+    try:
+        rss_start = rss_mb()
+        store = make_store(config, workdir)
+        result["add"] = measure_add(store, config)
+        result["rss_mb"] = rss_mb()
+        result["rss_delta_mb"] = result["rss_mb"] - rss_start
+        if hasattr(store, 'index_info'):
+            info = store.index_info()
+            result["active_index"] = info["active_index"]
+            # 编码后每个向量占用的字节数，与float32的dim*4字节对比
+            result["bytes_per_vector"] = info["bytes_per_vector"]
+            # 迁移到近似索引时相对flat基线测得的召回率
+            result["migration_recall"] = info["last_recall"]["recall"] if info["last_recall"] else None
+        if config['store'] == 'milvus':
+            # 导入完成后一次性建立索引并加载集合
+            began = time.perf_counter()
+            store.load()
+            result["index_seconds"] = time.perf_counter() - began
+        result["search"] = measure_search(store, config)
+        result["lexical_search"] = measure_lexical(store, config)
+        if hasattr(store, 'evaluate_recall') and config['recall_queries']:
+            result["recall"] = store.evaluate_recall(k=config['top_k'], num_queries=config['recall_queries'])["recall"]
+
+        if config['store'] == 'disk':
+            began = time.perf_counter()
+            store.save()
+            result["save_seconds"] = time.perf_counter() - began
+            result["files"] = file_sizes(workdir)
+            del store
+            gc.collect()
+            # 加载在新的子进程中测量，常驻内存不受写入阶段残留的影响
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                result["load"] = executor.submit(run_load, config, workdir).result()
+                if config['mmap']:
+                    # 以内存映射打开同一份快照，加载耗时和常驻内存应与文档数无关
+                    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context('spawn')) as executor:
+                        result["load_mmap"] = executor.submit(run_load, config, workdir, True).result()
+    except Exception as e:
+        print(f"Error benchmarking {result}: {type(e).__name__} {str(e)}")
+        result["error"] = f"{type(e).__name__}: {str(e)}"
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return result
+
+def run_load(config, workdir, mmap=False):
+    rss_start = rss_mb()
+    store = make_store(config, workdir, mmap)
+    began = time.perf_counter()
+    store.load()
+    seconds = time.perf_counter() - began
+    # 加载后的首次搜索包括文本文件的内存映射缺页
+    query = synthetic_vectors(QUERY_OFFSET, 1, config['dim'], seed=config['seed'])
+    began = time.perf_counter()
+    store.search_batch(query, config['top_k'])
+    first_search = time.perf_counter() - began
+    return {
+        "seconds": seconds,
+        "first_search_ms": first_search * 1000,
+        "rss_mb": rss_mb(),
+        "rss_delta_mb": rss_mb() - rss_start
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark vector stores and FAISS index types on synthetic corpora')
+    parser.add_argument('--sizes', type=str, default='10000,100000,1000000', help='Comma-separated corpus sizes')
+    parser.add_argument('--stores', type=str, default='memory,disk', help='Comma-separated store types: memory, disk, milvus')
+    parser.add_argument('--index-types', type=str, default='flat,ivf_flat,hnsw,ivf_pq', help='Comma-separated FAISS index types')
+    parser.add_argument('--dim', type=int, default=256, help='Vector dimension')
+    parser.add_argument('--batch-size', type=int, default=1000, help='Vectors per add_vectors call')
+    parser.add_argument('--queries', type=int, default=1000, help='Number of search queries')
+    parser.add_argument('--top-k', type=int, default=10, help='Results per query')
+    parser.add_argument('--threads', type=int, default=os.cpu_count() or 4, help='Threads for the concurrent search phase')
+    parser.add_argument('--recall-queries', type=int, default=200, help='Queries for recall@k against flat (0 to skip)')
+    parser.add_argument('--nlist', type=int, default=1024, help='IVF cells')
+    parser.add_argument('--nprobe', type=int, default=16, help='IVF cells probed per search')
+    parser.add_argument('--ef-search', type=int, default=64, help='HNSW efSearch')
+    parser.add_argument('--hnsw-m', type=int, default=32, help='HNSW M')
+    parser.add_argument('--pq-m', type=int, default=16, help='PQ sub-quantizers')
+    parser.add_argument('--encodings', type=str, default='float32', help='Comma-separated vector encodings: float32, float16, sq8')
+    parser.add_argument('--shards', type=str, default='1', help='Comma-separated FAISS shard counts (for memory/disk store)')
+    parser.add_argument('--pca-dim', type=int, default=0, help='Reduce vectors to this dimension with PCA (0 to disable)')
+    parser.add_argument('--train-threshold', type=int, default=10000, help='Document count at which the flat index is migrated')
+    parser.add_argument('--mmap', action='store_true', help='Also measure loading the disk snapshot memory-mapped')
+    parser.add_argument('--no-lexical', action='store_true', help='Disable the BM25 lexical index')
+    parser.add_argument('--milvus-host', type=str, default='localhost', help='Milvus host (for milvus store)')
+    parser.add_argument('--milvus-port', type=int, default=19530, help='Milvus port (for milvus store)')
+    parser.add_argument('--milvus-uri', type=str, default=None, help='Milvus URI instead of host/port, e.g. a Milvus Lite database file')
+    parser.add_argument('--milvus-insert-batch', type=int, default=1000, help='Rows buffered per Milvus insert (0 to insert every call)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed for the synthetic corpus')
+    parser.add_argument('--workdir', type=str, default=None, help='Directory for disk store files')
+    parser.add_argument('--output', type=str, default=None, help='Path of the JSON results file')
+    args = parser.parse_args()
+
+    base = {
+        'dim': args.dim,
+        'batch_size': args.batch_size,
+        'queries': args.queries,
+        'top_k': args.top_k,
+        'threads': args.threads,
+        'recall_queries': args.recall_queries,
+        'nlist': args.nlist,
+        'nprobe': args.nprobe,
+        'ef_search': args.ef_search,
+        'hnsw_m': args.hnsw_m,
+        'pq_m': args.pq_m,
+        'train_threshold': args.train_threshold,
+        'pca_dim': args.pca_dim,
+        'lexical': not args.no_lexical,
+        'mmap': args.mmap,
+        'milvus_host': args.milvus_host,
+        'milvus_port': args.milvus_port,
+        'milvus_uri': args.milvus_uri,
+        'milvus_insert_batch': args.milvus_insert_batch,
+        'seed': args.seed,
+        'workdir': args.workdir or tempfile.gettempdir()
+    }
+    configs = []
+    for size in [int(size) for size in args.sizes.split(',')]:
+        for store in args.stores.split(','):
+            # Milvus自行管理索引，不区分FAISS索引类型
+            index_types = ['milvus'] if store == 'milvus' else args.index_types.split(',')
+            encodings = ['float32'] if store == 'milvus' else args.encodings.split(',')
+            shard_counts = [1] if store == 'milvus' else [int(shards) for shards in args.shards.split(',')]
+            for index_type in index_types:
+                for encoding in encodings:
+                    for shards in shard_counts:
+                        configs.append(dict(base, store=store, index_type=index_type, encoding=encoding, shards=shards, size=size))
+
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for config in configs:
+        shards = f" in {config['shards']} shards" if config['shards'] > 1 else ''
+        print(f"Benchmarking {config['store']}/{config['index_type']}/{config['encoding']} with {config['size']} vectors{shards}...")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            result = executor.submit(run_config, config).result()
+        results.append(result)
+        if 'error' not in result:
+            print(
+                f"  add {result['add']['vectors_per_second']:.0f} vec/s, "
+                f"search p50 {result['search']['serial']['p50_ms']:.2f} ms / p99 {result['search']['serial']['p99_ms']:.2f} ms, "
+                f"concurrent {result['search']['concurrent']['qps']:.0f} QPS, rss {result['rss_mb']:.0f} MB"
+            )
+
+    parameters = {key: value for key, value in base.items() if key not in ('workdir', 'milvus_host', 'milvus_port', 'milvus_uri')}
+    write_results(args.output or default_output('stores'), {
+        "benchmark": "stores",
+        "environment": environment_info(),
+        "parameters": parameters,
+        "results": results
+    })
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import numpy as np
+
+# 基准测试脚本从 ai_vector_server/benchmarks/ 直接运行，与服务使用相同的平铺模块导入方式
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SERVER_DIR not in sys.path:
+    sys.path.insert(0, SERVER_DIR)
+
+from metrics import resident_memory_bytes
+
+# 合成语料的词表：家政服务常见的城市、服务和描述词，使词法索引的规模和分布接近真实数据
+CITIES = ['北京', '上海', '广州', '深圳', '杭州', '成都', '武汉', '南京', '西安', '重庆']
+SERVICES = ['日常保洁', '深度保洁', '家电清洗', '搬家', '月嫂', '育儿嫂', '保姆', '护工', '开荒保洁', '收纳整理']
+PHRASES = ['按小时计费', '需要提前预约', '节假日价格上浮', '提供上门服务', '自带清洁工具',
+           '持证上岗', '不满意免费返工', '支持线上支付', '可开发票', '服务时长可选']
+
+def synthetic_vectors(start, count, dim, seed=0, clusters=256):
+    # 聚簇分布的向量：真实嵌入向量不是均匀分布的，近似索引在聚簇数据上的召回率更有参考意义。
+    # 簇中心只由seed决定，分批生成的向量（start为批次起点）属于同一组簇
+    centers = np.random.default_rng(seed).standard_normal((clusters, dim)).astype('float32')
+    rng = np.random.default_rng([seed, start])
+    vectors = centers[rng.integers(0, clusters, size=count)]
+    vectors += 0.35 * rng.standard_normal((count, dim)).astype('float32')
+    return vectors
+
+def synthetic_texts(start, count, seed=0):
+    rng = np.random.default_rng(seed + start)
+    texts = []
+    for i, (city, service, a, b) in enumerate(zip(
+        rng.integers(0, len(CITIES), count), rng.integers(0, len(SERVICES), count),
+        rng.integers(0, len(PHRASES), count), rng.integers(0, len(PHRASES), count)
+    )):
+        texts.append(f"{CITIES[city]}{SERVICES[service]}服务{start + i}号，{PHRASES[a]}，{PHRASES[b]}。")
+    return texts
+
+def synthetic_queries(count, seed=1):
+    rng = np.random.default_rng(seed)
+    return [
+        f"{CITIES[city]}{SERVICES[service]}多少钱"
+        for city, service in zip(rng.integers(0, len(CITIES), count), rng.integers(0, len(SERVICES), count))
+    ]
+
+def latency_stats(samples):
+    # 延迟统计（毫秒）
+    if not samples:
+        return {"count": 0}
+    values = np.asarray(samples, dtype='float64') * 1000
+    return {
+        "count": len(values),
+        "mean_ms": float(values.mean()),
+        "p50_ms": float(np.percentile(values, 50)),
+        "p90_ms": float(np.percentile(values, 90)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "max_ms": float(values.max())
+    }
+
+def rss_mb():
+    return resident_memory_bytes() / (1024 * 1024)
+
+def environment_info():
+    # 记录运行环境，比较两次结果时可以判断是否在同一台机器上运行
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR,
+            capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    import faiss
+    return {
+        "time": time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "faiss": faiss.__version__,
+        "numpy": np.__version__
+    }
+
+def write_results(path, results):
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {path}")
+
+def default_output(name):
+    return os.path.join(SERVER_DIR, 'benchmarks', 'results', f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.json")
@@ -0,0 +1,96 @@
+import argparse
+import json
+import sys
+
+# 比较两次基准测试的JSON结果：延迟（*_ms、*seconds）越低越好，吞吐（*qps、*rps、*_per_second）和召回率越高越好，
+# 变化超过阈值的指标视为回退，存在回退时以非零状态退出，便于在CI中使用
+LOWER_IS_BETTER = ('_ms', 'seconds', 'rss_mb', 'rss_delta_mb')
+HIGHER_IS_BETTER = ('qps', 'rps', '_per_second', 'recall')
+# 只比较有代表性的指标，计数、参数和文件大小等不参与比较
+SKIP_KEYS = ('bytes_per_vector', 'count', 'errors', 'concurrency', 'threads', 'top_k', 'queries', 'batch_size', 'files', 'index', 'cache', 'stub_embedding')
+
+def flatten(value, prefix=''):
+    metrics = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key in SKIP_KEYS:
+                continue
+            metrics.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        # 存储基准测试的结果按 存储/索引类型[/编码][xN分片]/规模 标识，float32编码、不分片的结果与旧版本结果文件同名
+        for item in value:
+            if isinstance(item, dict) and 'store' in item:
+                variant = '' if item.get('encoding', 'float32') == 'float32' and not item.get('pca_dim') else f"/{item['encoding']}"
+                if item.get('pca_dim'):
+                    variant += f"+pca{item['pca_dim']}"
+                if item.get('shards', 1) > 1:
+                    variant += f"x{item['shards']}"
+                name = f"{item['store']}/{item['index_type']}{variant}/{item['size']}"
+                metrics.update(flatten({k: v for k, v in item.items() if k not in ('store', 'index_type', 'encoding', 'pca_dim', 'shards', 'size', 'dim')}, f"{prefix}.{name}"))
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        metrics[prefix] = float(value)
+    return metrics
+
+def direction(name):
+    leaf = name.rsplit('.', 1)[-1]
+    if leaf.endswith(HIGHER_IS_BETTER):
+        return 1
+    if leaf.endswith(LOWER_IS_BETTER):
+        return -1
+    return 0
+
+def compare(baseline, current, threshold):
+    old = flatten(baseline.get('results'), 'results')
+    new = flatten(current.get('results'), 'results')
+    rows = []
+    for name in sorted(set(old) & set(new)):
+        sign = direction(name)
+        if sign == 0 or old[name] == 0:
+            continue
+        change = (new[name] - old[name]) / abs(old[name])
+        regressed = change * sign < -threshold
+        improved = change * sign > threshold
+        rows.append((name, old[name], new[name], change, regressed, improved))
+    return rows, sorted(set(old) - set(new)), sorted(set(new) - set(old))
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare two benchmark result files')
+    parser.add_argument('baseline', type=str, help='Baseline results JSON')
+    parser.add_argument('current', type=str, help='Current results JSON')
+    parser.add_argument('--threshold', type=float, default=0.1, help='Relative change treated as a regression (0.1 = 10%%)')
+    parser.add_argument('--all', action='store_true', help='Show unchanged metrics too')
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.current, 'r', encoding='utf-8') as f:
+        current = json.load(f)
+    if baseline.get('benchmark') != current.get('benchmark'):
+        print(f"Cannot compare {baseline.get('benchmark')} results with {current.get('benchmark')} results")
+        sys.exit(2)
+    for key in ('commit', 'cpus', 'platform'):
+        if baseline['environment'].get(key) != current['environment'].get(key):
+            print(f"Note: {key} differs ({baseline['environment'].get(key)} -> {current['environment'].get(key)})")
+
+    rows, removed, added = compare(baseline, current, args.threshold)
+    regressions = 0
+    for name, old, new, change, regressed, improved in rows:
+        if regressed:
+            regressions += 1
+            status = 'REGRESSION'
+        elif improved:
+            status = 'improved'
+        elif args.all:
+            status = ''
+        else:
+            continue
+        print(f"{status:>10}  {name}: {old:.4g} -> {new:.4g} ({change:+.1%})")
+    for name in removed:
+        print(f"   missing  {name}")
+    for name in added:
+        print(f"       new  {name}")
+    print(f"{len(rows)} metrics compared, {regressions} regressions beyond {args.threshold:.0%}")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
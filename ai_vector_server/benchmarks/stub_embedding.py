@@ -0,0 +1,90 @@
+import argparse
+import hashlib
+import json
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import numpy as np
+
+# 兼容OpenAI /embeddings 格式的嵌入接口桩：同一文本总是返回相同的随机单位向量，
+# 可选的固定延迟模拟真实接口的网络和推理耗时，压测时排除外部接口的波动
+class StubEmbeddingServer:
+    def __init__(self, host='127.0.0.1', port=0, dim=1536, latency_ms=0.0):
+        self.dim = dim
+        self.latency_ms = latency_ms
+        self.requests = 0
+        self.inputs = 0
+        self.lock = threading.Lock()
+        self.httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self.httpd.daemon_threads = True
+        self.thread = None
+
+    @property
+    def port(self):
+        return self.httpd.server_address[1]
+
+    @property
+    def base_url(self):
+        return f"http://{self.httpd.server_address[0]}:{self.port}/v1"
+
+    def embed(self, text):
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype('float32')
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                texts = payload.get('input', [])
+                if isinstance(texts, str):
+                    texts = [texts]
+                with stub.lock:
+                    stub.requests += 1
+                    stub.inputs += len(texts)
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000)
+                body = json.dumps({
+                    "data": [{"index": i, "embedding": stub.embed(text)} for i, text in enumerate(texts)],
+                    "model": payload.get('model')
+                }).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='stub-embedding', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def stats(self):
+        return {"requests": self.requests, "inputs": self.inputs}
+
+def main():
+    parser = argparse.ArgumentParser(description='Stub OpenAI-compatible embedding API for benchmarks')
+    parser.add_argument('--port', type=int, default=9100, help='Listen port')
+    parser.add_argument('--dim', type=int, default=1536, help='Embedding dimension')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='Artificial latency per request')
+    args = parser.parse_args()
+
+    server = StubEmbeddingServer(port=args.port, dim=args.dim, latency_ms=args.latency_ms)
+    print(f"Stub embedding API listening on {server.base_url}")
+    server.httpd.serve_forever()
+
+if __name__ == "__main__":
+    main()
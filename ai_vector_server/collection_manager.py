@@ -0,0 +1,296 @@
+import copy
+import json
+import os
+import re
+import threading
+import time
+from vector_store import create_vector_store
+
+DEFAULT_COLLECTION = 'default'
+COLLECTION_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+
+# 命名集合：独立的存储配置、向量存储和本地备用索引。
+# active为正在使用该集合的请求数，大于0时不会被淘汰
+class Collection:
+    def __init__(self, name, config):
+        self.name = name
+        self.config = config
+        self.store = None
+        self.fallback_store = None
+        self.active = 0
+        self.last_used = time.time()
+        # 写入在write_gate下进行；后台重建索引期间journal记录所有写入，切换前在新索引上重放。
+        # generation在每次切换存储后递增
+        self.write_gate = threading.Lock()
+        self.journal = None
+        self.generation = 0
+
+    def pin(self):
+        # 请求开始时固定存储的引用：切换索引后，进行中的搜索仍在旧索引上完成
+        return copy.copy(self)
+
+    @property
+    def store_type(self):
+        return self.config['type']
+
+    def dimension(self):
+        # 已有索引的维度优先，其次是集合配置的维度
+        return getattr(self.store, 'vector_dimension', None) or self.config.get('dimension')
+
+    def info(self):
+        info = {
+            "name": self.name,
+            "type": self.store_type,
+            "loaded": self.store is not None,
+            "dimension": self.dimension(),
+            "last_used": self.last_used
+        }
+        if self.store is not None and hasattr(self.store, 'index_info'):
+            info["documents"] = self.store.index_info()["documents"]
+        return info
+
+# 管理一个进程内的多个命名集合：
+# default集合使用服务的默认配置（环境变量和命令行参数），启动时加载且常驻内存；
+# 其他集合的配置和文件保存在 root/<name>/ 下，首次访问时加载，空闲超过idle_timeout秒后保存并释放。
+# 内存存储的集合无法持久化，不会被淘汰
+class CollectionManager:
+    def __init__(self, root='data/collections', idle_timeout=1800, on_load=None):
+        self.root = root
+        self.idle_timeout = idle_timeout
+        # 集合加载完成后的回调，用于构建备用索引等
+        self.on_load = on_load
+        self.default_config = None
+        self.collections = {}
+        # lock保护collections字典和引用计数；每个集合另有一把锁，保证同一集合的加载和淘汰互斥
+        self.lock = threading.Lock()
+        self.name_locks = {}
+        self.evict_thread = None
+        self.stop_event = threading.Event()
+
+    def _config_path(self, name):
+        return os.path.join(self.root, name, 'collection.json')
+
+    def _name_lock(self, name):
+        with self.lock:
+            lock = self.name_locks.get(name)
+            if lock is None:
+                lock = self.name_locks[name] = threading.Lock()
+            return lock
+
+    @staticmethod
+    def validate_name(name):
+        if not COLLECTION_NAME_PATTERN.match(name or ''):
+            raise ValueError(f"Invalid collection name: {name}")
+
+    def set_default(self, config):
+        # 替换default集合的配置，已加载的旧存储先保存再释放
+        with self._name_lock(DEFAULT_COLLECTION):
+            with self.lock:
+                old = self.collections.pop(DEFAULT_COLLECTION, None)
+                self.default_config = dict(config)
+            if old is not None:
+                self._close(old)
+            return self._get_or_load(DEFAULT_COLLECTION) is not None
+
+    def _named_config(self, name, overrides=None):
+        # 以默认配置为模板，文件放到集合自己的目录下，Milvus使用以集合名为后缀的集合
+        config = {
+            key: value for key, value in self.default_config.items()
+            if key not in ('index_path', 'ids_path', 'texts_path', 'wal_path')
+        }
+        directory = os.path.join(self.root, name)
+        config['index_path'] = os.path.join(directory, 'faiss_index.index')
+        config['ids_path'] = os.path.join(directory, 'doc_ids.npy')
+        config['texts_path'] = os.path.join(directory, 'doc_texts.bin')
+        config['collection_name'] = f"{self.default_config.get('collection_name', 'vectors')}_{name.replace('-', '_')}"
+        config.update({key: value for key, value in (overrides or {}).items() if value is not None})
+        return config
+
+    def exists(self, name):
+        if name == DEFAULT_COLLECTION or name in self.collections:
+            return True
+        return os.path.exists(self._config_path(name))
+
+    def create(self, name, overrides=None):
+        self.validate_name(name)
+        with self._name_lock(name):
+            if self.exists(name):
+                raise ValueError(f"Collection already exists: {name}")
+            config = self._named_config(name, overrides)
+            os.makedirs(os.path.dirname(self._config_path(name)), exist_ok=True)
+            with open(self._config_path(name), 'w', encoding='utf-8') as f:
+                json.dump(config, f, ensure_ascii=False, indent=2)
+            print(f"Created collection {name} ({config['type']})")
+            return config
+
+    def acquire(self, name=None, create=False):
+        # 取得集合并增加引用计数，用完后必须调用release；集合不存在且create为False时返回None
+        name = name or DEFAULT_COLLECTION
+        self.validate_name(name)
+        if name != DEFAULT_COLLECTION and create and not self.exists(name):
+            try:
+                self.create(name)
+            except ValueError:
+                # 并发请求已经创建
+                pass
+        with self._name_lock(name):
+            collection = self._get_or_load(name)
+            if collection is None:
+                return None
+            with self.lock:
+                collection.active += 1
+                collection.last_used = time.time()
+            return collection
+
+    def release(self, collection):
+        with self.lock:
+            collection.active -= 1
+            collection.last_used = time.time()
+
+    def _get_or_load(self, name):
+        # 调用方需持有该集合的锁
+        collection = self.collections.get(name)
+        if collection is not None:
+            return collection
+
+        if name == DEFAULT_COLLECTION:
+            config = self.default_config
+        elif os.path.exists(self._config_path(name)):
+            with open(self._config_path(name), 'r', encoding='utf-8') as f:
+                config = json.load(f)
+        else:
+            return None
+
+        collection = Collection(name, config)
+        try:
+            self._load(collection)
+        except Exception as e:
+            print(f"Error loading collection {name}: {str(e)}")
+            return None
+        with self.lock:
+            self.collections[name] = collection
+        if name != DEFAULT_COLLECTION:
+            self._start_evictor()
+        return collection
+
+    @staticmethod
+    def create_store(config, load=True):
+        options = {key: value for key, value in config.items() if key != 'type'}
+        store_type = config['type']
+        if store_type == 'disk':
+            os.makedirs(os.path.dirname(options['index_path']), exist_ok=True)
+        store = create_vector_store(store_type=store_type, **options)
+        if store_type == 'disk' and load:
+            # 加载最近的快照并重放预写日志
+            store.load()
+        return store
+
+    @staticmethod
+    def staging_config(collection):
+        # 后台重建索引使用的配置：磁盘文件放在集合文件旁的.reindex路径下，不写日志，完成后由save()一次写入
+        config = dict(collection.config, mmap=False, read_only=False, wal=False)
+        for key in ('index_path', 'ids_path', 'texts_path'):
+            if key in config:
+                base, extension = os.path.splitext(config[key])
+                config[key] = f"{base}.reindex{extension}"
+        config.pop('wal_path', None)
+        return config
+
+    def swap_store(self, collection, store, fallback_store=None):
+        # 原子替换集合的存储（和备用索引），返回旧存储；固定了旧存储引用的请求在旧存储上完成
+        with self.lock:
+            old = collection.store
+            collection.store = store
+            if fallback_store is not None:
+                collection.fallback_store = fallback_store
+            collection.generation += 1
+        print(f"Swapped store of collection {collection.name} (generation {collection.generation})")
+        return old
+
+    def _load(self, collection):
+        collection.store = self.create_store(collection.config)
+        store_type = collection.store_type
+        if store_type == 'disk':
+            collection.store.start_background_snapshots()
+        if self.on_load is not None:
+            self.on_load(collection)
+        print(f"Loaded collection {collection.name} ({store_type})")
+
+    def _close(self, collection):
+        store = collection.store
+        if store is None:
+            return
+        if hasattr(store, 'stop_background_snapshots'):
+            store.stop_background_snapshots()
+        store.save()
+        collection.store = None
+        collection.fallback_store = None
+
+    def evict_idle(self):
+        now = time.time()
+        with self.lock:
+            candidates = [
+                name for name, collection in self.collections.items()
+                if name != DEFAULT_COLLECTION and collection.store_type != 'memory'
+                and collection.active == 0 and now - collection.last_used >= self.idle_timeout
+            ]
+        evicted = []
+        for name in candidates:
+            lock = self._name_lock(name)
+            # 正在加载或淘汰的集合跳过，下一轮再检查
+            if not lock.acquire(blocking=False):
+                continue
+            try:
+                with self.lock:
+                    collection = self.collections.get(name)
+                    if collection is None or collection.active or time.time() - collection.last_used < self.idle_timeout:
+                        continue
+                    del self.collections[name]
+                self._close(collection)
+                evicted.append(name)
+                print(f"Evicted idle collection {name}")
+            finally:
+                lock.release()
+        return evicted
+
+    def _start_evictor(self):
+        with self.lock:
+            if self.evict_thread is not None or self.idle_timeout <= 0:
+                return
+            self.stop_event.clear()
+            self.evict_thread = threading.Thread(target=self._evict_loop, name='collection-evictor', daemon=True)
+            self.evict_thread.start()
+
+    def _evict_loop(self):
+        while not self.stop_event.wait(min(60, self.idle_timeout)):
+            self.evict_idle()
+
+    def loaded(self):
+        with self.lock:
+            return list(self.collections.values())
+
+    def list(self):
+        names = set(self.collections) | {DEFAULT_COLLECTION}
+        if os.path.isdir(self.root):
+            names.update(name for name in os.listdir(self.root) if os.path.exists(self._config_path(name)))
+        result = []
+        for name in sorted(names):
+            collection = self.collections.get(name)
+            if collection is not None:
+                result.append(collection.info())
+            else:
+                result.append({"name": name, "loaded": False})
+        return result
+
+    def close_all(self):
+        # 停止淘汰线程并保存所有已加载的集合
+        self.stop_event.set()
+        if self.evict_thread is not None:
+            self.evict_thread.join()
+            self.evict_thread = None
+        with self.lock:
+            collections = list(self.collections.values())
+            self.collections = {}
+        for collection in collections:
+            print(f"Saving collection {collection.name}...")
+            self._close(collection)
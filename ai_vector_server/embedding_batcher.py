@@ -0,0 +1,88 @@
+import asyncio
+
+# 嵌入请求微批处理：在window_ms毫秒的窗口内（或攒够max_batch条时）收集并发的嵌入请求，
+# 合并为一次批量请求后把结果分发回各个调用方。
+# 排队中或请求中的相同文本共享同一个future，不会重复请求
+class EmbeddingBatcher:
+    def __init__(self, embed_fn, window_ms=5, max_batch=64):
+        # embed_fn: 接收文本列表、返回同样顺序向量列表的协程函数
+        self.embed_fn = embed_fn
+        self.window_ms = window_ms
+        self.max_batch = max_batch
+
+        self.pending = {}
+        self.queue = []
+        self.timer = None
+        self.loop = None
+
+        # 统计：调用方请求数、去重命中数、实际发出的批次数
+        self.requests = 0
+        self.deduplicated = 0
+        self.batches = 0
+
+    def _ensure_loop(self):
+        # future和定时器绑定事件循环，循环变化时丢弃旧状态
+        loop = asyncio.get_running_loop()
+        if self.loop is not loop:
+            self.pending = {}
+            self.queue = []
+            self.timer = None
+            self.loop = loop
+        return loop
+
+    async def embed(self, text):
+        loop = self._ensure_loop()
+        self.requests += 1
+
+        future = self.pending.get(text)
+        if future is not None:
+            self.deduplicated += 1
+        else:
+            future = loop.create_future()
+            self.pending[text] = future
+            self.queue.append(text)
+            if len(self.queue) >= self.max_batch:
+                self._flush()
+            elif self.timer is None:
+                self.timer = loop.call_later(self.window_ms / 1000.0, self._flush)
+
+        # shield：某个调用方被取消时不影响等待同一文本的其他调用方
+        return await asyncio.shield(future)
+
+    async def embed_many(self, texts):
+        return await asyncio.gather(*(self.embed(text) for text in texts))
+
+    def _flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.queue:
+            return
+
+        texts = self.queue
+        self.queue = []
+        self.batches += 1
+        self.loop.create_task(self._run(texts))
+
+    async def _run(self, texts):
+        try:
+            vectors = await self.embed_fn(texts)
+        except Exception as e:
+            for text in texts:
+                future = self.pending.pop(text, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+
+        for text, vector in zip(texts, vectors):
+            future = self.pending.pop(text, None)
+            if future is not None and not future.done():
+                future.set_result(vector)
+
+    def stats(self):
+        return {
+            "batcher_requests": self.requests,
+            "batcher_deduplicated": self.deduplicated,
+            "batcher_batches": self.batches,
+            "batcher_queued": len(self.queue)
+        }
@@ -0,0 +1,160 @@
+import fcntl
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+# 嵌入向量缓存：内存LRU层 + 可选的磁盘持久化层
+# 缓存键为 (嵌入模型, sha256(文本))，切换模型后旧向量不会被误用
+class EmbeddingCache:
+    def __init__(self, max_entries=10000, disk_path=None):
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.disk = DiskEmbeddingStore(disk_path) if disk_path else None
+        self.lock = threading.Lock()
+
+        # 命中统计
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(model, text):
+        return f"{model}:{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def get(self, model, text):
+        key = self.make_key(model, text)
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+                self.hits += 1
+                return vector
+
+            if self.disk is not None:
+                vector = self.disk.get(key)
+                if vector is not None:
+                    self.disk_hits += 1
+                    self._remember(key, vector)
+                    return vector
+
+            self.misses += 1
+            return None
+
+    def put(self, model, text, vector):
+        key = self.make_key(model, text)
+        vector = np.asarray(vector, dtype='float32')
+        with self.lock:
+            self._remember(key, vector)
+            if self.disk is not None:
+                self.disk.put(key, vector)
+
+    def _remember(self, key, vector):
+        if self.max_entries <= 0:
+            return
+        self.memory[key] = vector
+        self.memory.move_to_end(key)
+        # 超出容量时淘汰最久未使用的条目
+        while len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+                "memory_entries": len(self.memory),
+                "memory_capacity": self.max_entries,
+                "disk_entries": len(self.disk) if self.disk is not None else 0
+            }
+
+    def close(self):
+        if self.disk is not None:
+            self.disk.close()
+
+# 磁盘缓存层：向量追加写入一个float32文件并以内存映射方式读取，
+# 另用一个文本索引文件记录每个键对应的偏移量和维度，重启后可直接复用。
+# --workers启动的多个进程共享同一组文件，追加时持有文件锁
+class DiskEmbeddingStore:
+    def __init__(self, path):
+        self.vectors_path = path + '.f32'
+        self.index_path = path + '.idx'
+        self.offsets = {}
+        self.mmap = None
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._load_index()
+        self.vectors_file = open(self.vectors_path, 'ab')
+        self.index_file = open(self.index_path, 'a', encoding='utf-8')
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+
+        # 只接受向量数据已完整写入的条目，忽略进程崩溃时残留的半行
+        available = os.path.getsize(self.vectors_path) // 4 if os.path.exists(self.vectors_path) else 0
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                if len(parts) != 3:
+                    continue
+                try:
+                    offset, dim = int(parts[1]), int(parts[2])
+                except ValueError:
+                    continue
+                if offset + dim <= available:
+                    self.offsets[parts[0]] = (offset, dim)
+        print(f"Loaded {len(self.offsets)} cached embeddings from {self.vectors_path}")
+
+    def _vector_at(self, offset, dim):
+        # 文件增长后重新映射
+        if self.mmap is None or offset + dim > len(self.mmap):
+            self.vectors_file.flush()
+            size = os.path.getsize(self.vectors_path) // 4
+            if size == 0:
+                return None
+            self.mmap = np.memmap(self.vectors_path, dtype='float32', mode='r', shape=(size,))
+        return np.array(self.mmap[offset:offset + dim])
+
+    def get(self, key):
+        entry = self.offsets.get(key)
+        if entry is None:
+            return None
+        return self._vector_at(*entry)
+
+    def put(self, key, vector):
+        if key in self.offsets:
+            return
+
+        # 先写向量数据，再写索引行，保证索引指向的数据一定完整。
+        # 其他进程可能已追加了数据，偏移量取加锁后文件的实际末尾，而不是本进程文件对象的位置
+        fcntl.flock(self.vectors_file.fileno(), fcntl.LOCK_EX)
+        try:
+            size = os.fstat(self.vectors_file.fileno()).st_size
+            # 崩溃残留的不完整数据可能使文件长度不是4的倍数，先补齐
+            padding = -size % 4
+            if padding:
+                self.vectors_file.write(b'\0' * padding)
+            offset = (size + padding) // 4
+            self.vectors_file.write(vector.tobytes())
+            self.vectors_file.flush()
+            self.index_file.write(f"{key}\t{offset}\t{len(vector)}\n")
+            self.index_file.flush()
+        finally:
+            fcntl.flock(self.vectors_file.fileno(), fcntl.LOCK_UN)
+        self.offsets[key] = (offset, len(vector))
+
+    def close(self):
+        self.vectors_file.close()
+        self.index_file.close()
+        self.mmap = None
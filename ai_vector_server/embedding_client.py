@@ -0,0 +1,180 @@
+import asyncio
+import random
+import time
+import httpx
+import numpy as np
+
+# 熔断器打开期间直接拒绝请求，调用方应立即使用本地备用向量
+class CircuitOpenError(Exception):
+    pass
+
+# 可重试的上游状态码（限流和服务端错误）
+class RetryableStatusError(Exception):
+    pass
+
+# 包括排队和重试在内的总耗时超过deadline，调用方应立即使用本地备用向量
+class DeadlineExceededError(Exception):
+    pass
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+# 简单熔断器：连续失败failure_threshold次后打开，reset_timeout秒后放行一次试探请求，
+# 试探成功则关闭，失败则继续保持打开
+class CircuitBreaker:
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half_open'
+        return 'open'
+
+    def allow(self):
+        state = self.state
+        if state == 'closed':
+            return True
+        if state == 'half_open' and not self.trial_in_flight:
+            self.trial_in_flight = True
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        self.trial_in_flight = False
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def end_trial(self):
+        # 试探请求被取消时既不算成功也不算失败，允许下一个请求继续试探
+        self.trial_in_flight = False
+
+# 兼容OpenAI格式的异步嵌入客户端：
+# 复用keep-alive连接池，按请求设置超时，用信号量限制并发，失败时带抖动的指数退避重试，
+# 排队和全部重试共用deadline秒的总时限（0表示不限制），上游持续故障时由熔断器快速失败
+class AsyncEmbeddingClient:
+    def __init__(self, base_url, api_key='', timeout=10.0, connect_timeout=3.0,
+                 max_connections=20, max_concurrency=8, max_retries=2,
+                 backoff_base=0.2, backoff_max=2.0, failure_threshold=5, reset_timeout=30.0, deadline=10.0):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.timeout = httpx.Timeout(timeout, connect=connect_timeout)
+        self.limits = httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections)
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.breaker = CircuitBreaker(failure_threshold, reset_timeout)
+
+        # httpx连接池和信号量都绑定到事件循环，首次使用时创建
+        self.client = None
+        self.semaphore = None
+        self.loop = None
+
+    def _ensure_client(self):
+        loop = asyncio.get_running_loop()
+        if self.client is None or self.loop is not loop:
+            headers = {"Content-Type": "application/json"}
+            if self.api_key:
+                headers["Authorization"] = f"Bearer {self.api_key}"
+            self.client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                timeout=self.timeout,
+                limits=self.limits
+            )
+            self.semaphore = asyncio.Semaphore(self.max_concurrency)
+            self.loop = loop
+        return self.client
+
+    def configure(self, base_url=None, api_key=None):
+        # 修改地址或密钥后，下次请求时重建连接池
+        if base_url is not None:
+            self.base_url = base_url.rstrip('/')
+        if api_key is not None:
+            self.api_key = api_key
+        self.client = None
+
+    def _backoff(self, attempt):
+        # full jitter：在[0, min(上限, 基数*2^attempt)]之间随机等待
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+    async def embed(self, texts, model):
+        # 半开状态下放行的请求就是试探请求
+        trial = self.breaker.state != 'closed'
+        if not self.breaker.allow():
+            raise CircuitOpenError("Embedding API circuit is open")
+
+        try:
+            if self.deadline > 0:
+                vectors = await asyncio.wait_for(self._embed_with_retries(texts, model), self.deadline)
+            else:
+                vectors = await self._embed_with_retries(texts, model)
+        except asyncio.TimeoutError:
+            self.breaker.record_failure()
+            raise DeadlineExceededError(f"Embedding API did not respond within {self.deadline}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.breaker.record_failure()
+            raise
+        else:
+            self.breaker.record_success()
+            return vectors
+        finally:
+            if trial:
+                self.breaker.end_trial()
+
+    async def _embed_with_retries(self, texts, model):
+        client = self._ensure_client()
+        last_error = None
+        async with self.semaphore:
+            for attempt in range(self.max_retries + 1):
+                try:
+                    response = await client.post('/embeddings', json={"model": model, "input": texts})
+                    if response.status_code in RETRYABLE_STATUS:
+                        raise RetryableStatusError(f"Embedding API returned {response.status_code}")
+                    response.raise_for_status()
+                    return self._parse(response.json(), len(texts))
+                except (httpx.TransportError, RetryableStatusError) as e:
+                    # 超时、连接错误、限流和5xx可重试
+                    last_error = e
+                    if attempt < self.max_retries:
+                        await asyncio.sleep(self._backoff(attempt))
+                except Exception as e:
+                    # 4xx和响应格式错误重试也无济于事
+                    last_error = e
+                    break
+
+        raise last_error
+
+    @staticmethod
+    def _parse(payload, expected):
+        # 接口返回的顺序不一定与输入一致，按index字段排序
+        items = sorted(payload['data'], key=lambda item: item.get('index', 0))
+        if len(items) != expected:
+            raise ValueError(f"Expected {expected} embeddings, got {len(items)}")
+        return [np.array(item['embedding'], dtype='float32') for item in items]
+
+    def stats(self):
+        return {
+            "circuit_state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures
+        }
+
+    async def aclose(self):
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
@@ -0,0 +1,123 @@
+import math
+import re
+import unicodedata
+import numpy as np
+
+# 中日韩字符连续段，以及由字母数字组成的词
+_TOKEN_PATTERN = re.compile(r'[\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff]+|[a-z0-9]+(?:\.[0-9]+)?')
+_CJK_START = '\u3400'
+
+def tokenize(text):
+    # 中文按字符二元组切分（孤立的单字保留为一元组），字母数字按整词切分
+    text = unicodedata.normalize('NFKC', text or '').lower()
+    tokens = []
+    for run in _TOKEN_PATTERN.findall(text):
+        if run[0] < _CJK_START:
+            tokens.append(run[:32])
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+# 基于倒排表的BM25词法索引：token -> {doc_id: 词频}，随文档增删增量维护。
+# 删除时由调用方提供原文本，重新切分后从倒排表中移除，不额外保存每个文档的词表
+class LexicalIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_lengths = {}
+        self.total_length = 0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, doc_id, text):
+        tokens = tokenize(text)
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+        for token in tokens:
+            docs = self.postings.get(token)
+            if docs is None:
+                docs = self.postings[token] = {}
+            docs[doc_id] = docs.get(doc_id, 0) + 1
+
+    def remove(self, doc_id, text):
+        length = self.doc_lengths.pop(doc_id, None)
+        if length is None:
+            return
+        self.total_length -= length
+        for token in set(tokenize(text)):
+            docs = self.postings.get(token)
+            if docs is not None:
+                docs.pop(doc_id, None)
+                if not docs:
+                    del self.postings[token]
+
+    def _idf(self, token):
+        df = len(self.postings.get(token, ()))
+        return math.log(1 + (len(self.doc_lengths) - df + 0.5) / (df + 0.5))
+
+    def search(self, query, top_k, allowed=None):
+        # 返回[(doc_id, 归一化分数, 覆盖率)]：
+        # 归一化分数为BM25分数除以该查询可能达到的上限，覆盖率为命中的查询词按idf加权的比例；
+        # allowed为允许返回的doc_id集合（元数据过滤），不传时不限制
+        query_terms = {}
+        for token in tokenize(query):
+            query_terms[token] = query_terms.get(token, 0) + 1
+        if not query_terms or not self.doc_lengths:
+            return []
+
+        avgdl = self.total_length / len(self.doc_lengths) or 1.0
+        scores = {}
+        matched = {}
+        upper_bound = 0.0
+        total_idf = 0.0
+        for token, query_tf in query_terms.items():
+            idf = self._idf(token)
+            upper_bound += idf * (self.k1 + 1) * query_tf
+            total_idf += idf * query_tf
+            for doc_id, tf in self.postings.get(token, {}).items():
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avgdl)
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * query_tf * tf * (self.k1 + 1) / (tf + norm)
+                matched[doc_id] = matched.get(doc_id, 0.0) + idf * query_tf
+
+        ranked = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            (doc_id, score / upper_bound if upper_bound else 0.0, matched[doc_id] / total_idf if total_idf else 0.0)
+            for doc_id, score in ranked
+        ]
+
+    def to_arrays(self):
+        # 倒排表转换为CSR格式的数组，便于用np.savez保存
+        tokens = list(self.postings)
+        sizes = np.fromiter((len(self.postings[token]) for token in tokens), dtype='int64', count=len(tokens))
+        total = int(sizes.sum())
+        return {
+            "tokens": np.array(tokens, dtype='U32') if tokens else np.zeros(0, dtype='U1'),
+            "offsets": np.concatenate([[0], np.cumsum(sizes)]).astype('int64'),
+            "doc_ids": np.fromiter((doc_id for token in tokens for doc_id in self.postings[token]), dtype='int64', count=total),
+            "tfs": np.fromiter((tf for token in tokens for tf in self.postings[token].values()), dtype='int32', count=total),
+            "length_ids": np.fromiter(self.doc_lengths.keys(), dtype='int64', count=len(self.doc_lengths)),
+            "lengths": np.fromiter(self.doc_lengths.values(), dtype='int64', count=len(self.doc_lengths))
+        }
+
+    @staticmethod
+    def write(path, arrays):
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            offsets = data['offsets']
+            doc_ids = data['doc_ids'].tolist()
+            tfs = data['tfs'].tolist()
+            self.postings = {
+                str(token): dict(zip(doc_ids[offsets[i]:offsets[i + 1]], tfs[offsets[i]:offsets[i + 1]]))
+                for i, token in enumerate(data['tokens'])
+            }
+            self.doc_lengths = dict(zip(data['length_ids'].tolist(), data['lengths'].tolist()))
+        self.total_length = sum(self.doc_lengths.values())
@@ -0,0 +1,65 @@
+import unicodedata
+import numpy as np
+
+# 64位FNV-1a参数及murmur3的混合常数（numpy的uint64数组乘法按2^64自动回绕）
+_FNV_OFFSET = np.uint64(0xcbf29ce484222325)
+_FNV_PRIME = np.uint64(0x100000001b3)
+_MIX = np.uint64(0xff51afd7ed558ccd)
+_SHIFT = np.uint64(33)
+_SIGN_SHIFT = np.uint64(63)
+
+# 本地备用嵌入：字符n-gram特征哈希。
+# 整批文本拼接为一个码点数组，用NumPy一次算出所有n-gram的哈希值，按哈希取模落入dim个桶，
+# 哈希最高位决定正负号以抵消碰撞；计数取次线性缩放（log1p）后做L2归一化。
+# 结果只依赖文本本身，不依赖语料统计，同一文本在任何时候得到的向量都相同
+class LocalEmbedder:
+    def __init__(self, dim=256, ngram_weights=None, max_chars=2048):
+        self.dim = dim
+        # 中文单字本身有意义，给较低权重；二元、三元组合区分度更高
+        self.ngram_weights = ngram_weights or {1: 0.5, 2: 1.0, 3: 1.0}
+        self.max_chars = max_chars
+        self.embedded = 0
+
+    @staticmethod
+    def _normalize(text):
+        # 全角半角统一、大小写统一、连续空白合并
+        text = unicodedata.normalize('NFKC', text or '').lower()
+        return ' '.join(text.split())
+
+    def embed(self, texts, dim=None):
+        dim = dim or self.dim
+        texts = [self._normalize(text)[:self.max_chars] for text in texts]
+        matrix = np.zeros(len(texts) * dim, dtype='float32')
+        self.embedded += len(texts)
+
+        lengths = np.array([len(text) for text in texts], dtype='int64')
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype='<u4').astype('uint64')
+        rows = np.repeat(np.arange(len(texts), dtype='int64'), lengths)
+
+        for n, weight in self.ngram_weights.items():
+            count = len(codes) - n + 1
+            if count <= 0:
+                continue
+            # 只保留不跨越文本边界的n-gram
+            valid = rows[:count] == rows[n - 1:]
+
+            hashes = np.full(count, _FNV_OFFSET ^ np.uint64(n), dtype='uint64')
+            for j in range(n):
+                hashes = (hashes ^ codes[j:j + count]) * _FNV_PRIME
+            hashes ^= hashes >> _SHIFT
+            hashes *= _MIX
+            hashes ^= hashes >> _SHIFT
+            hashes = hashes[valid]
+
+            buckets = rows[:count][valid] * dim + (hashes % np.uint64(dim)).astype('int64')
+            signs = 1.0 - 2.0 * (hashes >> _SIGN_SHIFT).astype('float32')
+            matrix += np.bincount(buckets, weights=signs * weight, minlength=len(matrix)).astype('float32')
+
+        matrix = matrix.reshape(len(texts), dim)
+        matrix = np.sign(matrix) * np.log1p(np.abs(matrix))
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    def stats(self):
+        return {"local_embeddings": self.embedded}
@@ -0,0 +1,238 @@
+import json
+import numpy as np
+
+# 过滤表达式中的比较运算符
+_RANGE_OPS = {
+    '$gt': lambda value, bound: value > bound,
+    '$gte': lambda value, bound: value >= bound,
+    '$lt': lambda value, bound: value < bound,
+    '$lte': lambda value, bound: value <= bound
+}
+
+def _value_key(value):
+    # True与1、False与0在字典中是同一个键，布尔值单独区分
+    return (type(value) is bool, value)
+
+def _check_value(field, value):
+    if isinstance(value, (str, int, float)) or value is None:
+        return value
+    raise ValueError(f"Unsupported value for metadata field {field}: {value!r}")
+
+def parse_filter(expression):
+    # 把JSON过滤表达式转换为可哈希的规范形式，作为缓存过滤结果的键。支持：
+    #   {"category": "保洁"}                                   等于
+    #   {"category": {"$in": ["保洁", "维修"]}}                  $eq $ne $in $nin
+    #   {"price": {"$gte": 100, "$lt": 300}}                    $gt $gte $lt $lte
+    #   {"category": {"$exists": true}}                         是否有该字段
+    #   {"$or": [{...}, {...}]}、{"$and": [...]}、{"$not": {...}}
+    # 同一层的多个条件之间是“且”的关系；表达式不合法时抛出ValueError
+    if not isinstance(expression, dict):
+        raise ValueError("Filter must be an object")
+    clauses = []
+    for key, condition in sorted(expression.items()):
+        if key in ('$and', '$or'):
+            if not isinstance(condition, list) or not condition:
+                raise ValueError(f"{key} requires a non-empty list")
+            clauses.append((key[1:], tuple(parse_filter(item) for item in condition)))
+        elif key == '$not':
+            clauses.append(('not', parse_filter(condition)))
+        elif key.startswith('$'):
+            raise ValueError(f"Unsupported filter operator: {key}")
+        elif isinstance(condition, dict):
+            clauses.extend(_parse_condition(key, condition))
+        else:
+            clauses.append(('in', key, frozenset([_value_key(_check_value(key, condition))])))
+    if not clauses:
+        raise ValueError("Filter is empty")
+    return clauses[0] if len(clauses) == 1 else ('and', tuple(clauses))
+
+def _parse_condition(field, condition):
+    if not condition:
+        raise ValueError(f"Empty condition for metadata field {field}")
+    clauses = []
+    for op, operand in sorted(condition.items()):
+        if op in ('$eq', '$ne'):
+            clause = ('in', field, frozenset([_value_key(_check_value(field, operand))]))
+            clauses.append(clause if op == '$eq' else ('not', clause))
+        elif op in ('$in', '$nin'):
+            if not isinstance(operand, list):
+                raise ValueError(f"{op} requires a list")
+            clause = ('in', field, frozenset(_value_key(_check_value(field, value)) for value in operand))
+            clauses.append(clause if op == '$in' else ('not', clause))
+        elif op in _RANGE_OPS:
+            if isinstance(operand, bool) or not isinstance(operand, (str, int, float)):
+                raise ValueError(f"{op} requires a number or string")
+            clauses.append(('range', field, op, operand))
+        elif op == '$exists':
+            clause = ('exists', field)
+            clauses.append(clause if operand else ('not', clause))
+        else:
+            raise ValueError(f"Unsupported filter operator: {op}")
+    return clauses
+
+# 按列存储的文档元数据：每个父文档占一行，每个字段一列。
+# 列中保存int32的字典编码（-1表示该行没有这个字段），取值只在字典中保存一份，
+# 按条件过滤时先在字典上求出符合条件的编码，再对整列做一次向量化比较
+class MetadataColumn:
+    def __init__(self, capacity=0):
+        self.codes = np.full(capacity, -1, dtype='int32')
+        self.values = []
+        self.lookup = {}
+
+    def encode(self, value):
+        key = _value_key(value)
+        code = self.lookup.get(key)
+        if code is None:
+            code = self.lookup[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def matching_codes(self, predicate):
+        return np.array([code for code, value in enumerate(self.values) if predicate(value)], dtype='int32')
+
+class MetadataTable:
+    def __init__(self):
+        self.columns = {}
+        # 父文档ID -> 行号；行号 -> 父文档ID（-1表示空行，可被复用）
+        self.rows = {}
+        self.row_docs = np.zeros(0, dtype='int64')
+        self.free_rows = []
+
+    def __len__(self):
+        return len(self.rows)
+
+    def fields(self):
+        return {name: len(column.values) for name, column in self.columns.items()}
+
+    def _grow(self, size):
+        if size <= len(self.row_docs):
+            return
+        capacity = max(size, len(self.row_docs) * 2, 64)
+        row_docs = np.full(capacity, -1, dtype='int64')
+        row_docs[:len(self.row_docs)] = self.row_docs
+        self.row_docs = row_docs
+        for column in self.columns.values():
+            codes = np.full(capacity, -1, dtype='int32')
+            codes[:len(column.codes)] = column.codes
+            column.codes = codes
+
+    def set(self, doc_id, metadata):
+        # 整体替换文档的元数据，没有元数据的文档不占行
+        if not metadata:
+            self.remove(doc_id)
+            return
+        row = self.rows.get(doc_id)
+        if row is None:
+            row = self.free_rows.pop() if self.free_rows else len(self.rows)
+            self._grow(row + 1)
+            self.rows[doc_id] = row
+            self.row_docs[row] = doc_id
+        else:
+            for column in self.columns.values():
+                column.codes[row] = -1
+        for field, value in metadata.items():
+            if value is None:
+                continue
+            column = self.columns.get(field)
+            if column is None:
+                column = self.columns[field] = MetadataColumn(len(self.row_docs))
+            column.codes[row] = column.encode(_check_value(field, value))
+
+    def remove(self, doc_id):
+        row = self.rows.pop(doc_id, None)
+        if row is None:
+            return
+        self.row_docs[row] = -1
+        for column in self.columns.values():
+            column.codes[row] = -1
+        self.free_rows.append(row)
+
+    def get(self, doc_id):
+        row = self.rows.get(doc_id)
+        if row is None:
+            return None
+        return {
+            field: column.values[column.codes[row]]
+            for field, column in self.columns.items()
+            if column.codes[row] >= 0
+        }
+
+    def match(self, clause):
+        # 返回满足规范化过滤条件的父文档ID数组
+        size = len(self.row_docs)
+        live = self.row_docs >= 0
+        return self.row_docs[self._mask(clause, size) & live]
+
+    def _mask(self, clause, size):
+        kind = clause[0]
+        if kind == 'and':
+            mask = np.ones(size, dtype=bool)
+            for item in clause[1]:
+                mask &= self._mask(item, size)
+            return mask
+        if kind == 'or':
+            mask = np.zeros(size, dtype=bool)
+            for item in clause[1]:
+                mask |= self._mask(item, size)
+            return mask
+        if kind == 'not':
+            return ~self._mask(clause[1], size)
+        column = self.columns.get(clause[1])
+        if column is None:
+            return np.zeros(size, dtype=bool)
+        if kind == 'exists':
+            return column.codes >= 0
+        if kind == 'in':
+            codes = [column.lookup[key] for key in clause[2] if key in column.lookup]
+        else:
+            compare = _RANGE_OPS[clause[2]]
+            bound = clause[3]
+            # 只比较同类取值：数值与数值、字符串与字符串
+            numeric = not isinstance(bound, str)
+            codes = column.matching_codes(
+                lambda value: isinstance(value, str) != numeric and not isinstance(value, bool) and compare(value, bound)
+            )
+        if len(codes) == 0:
+            return np.zeros(size, dtype=bool)
+        if len(codes) == 1:
+            return column.codes == codes[0]
+        return np.isin(column.codes, codes)
+
+    def to_arrays(self):
+        # 只保存有效行，列按字段名保存编码数组，字典以JSON保存；不再被使用的取值不保存
+        live = np.nonzero(self.row_docs >= 0)[0]
+        arrays = {"doc_ids": self.row_docs[live]}
+        fields = []
+        values = []
+        for field in sorted(self.columns):
+            column = self.columns[field]
+            codes = column.codes[live]
+            used, remapped = np.unique(codes[codes >= 0], return_inverse=True)
+            if len(used) == 0:
+                continue
+            compact = np.full(len(codes), -1, dtype='int32')
+            compact[codes >= 0] = remapped
+            arrays[f"codes_{len(fields)}"] = compact
+            fields.append(field)
+            values.append([column.values[code] for code in used.tolist()])
+        arrays["schema"] = np.array(json.dumps({"fields": fields, "values": values}, ensure_ascii=False))
+        return arrays
+
+    @staticmethod
+    def write(path, arrays):
+        with open(path, 'wb') as f:
+            np.savez(f, **arrays)
+
+    def load(self, path):
+        with np.load(path, allow_pickle=False) as data:
+            schema = json.loads(str(data['schema']))
+            self.row_docs = data['doc_ids'].astype('int64')
+            self.rows = dict(zip(self.row_docs.tolist(), range(len(self.row_docs))))
+            self.free_rows = []
+            self.columns = {}
+            for i, (field, values) in enumerate(zip(schema['fields'], schema['values'])):
+                column = MetadataColumn()
+                column.codes = data[f"codes_{i}"].astype('int32')
+                for value in values:
+                    column.encode(value)
+                self.columns[field] = column
@@ -0,0 +1,210 @@
+import contextvars
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+
+# 延迟直方图的默认分桶（秒），覆盖从亚毫秒的FAISS搜索到数秒的嵌入接口调用和快照保存
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def _format_labels(labelnames, values):
+    if not labelnames:
+        return ''
+    pairs = []
+    for name, value in zip(labelnames, values):
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# Prometheus文本格式的指标，按标签值组合分别计数；不依赖prometheus_client
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + [
+            f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+            for key, value in items
+        ]
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+# 直方图：每个标签组合保存各分桶的计数、总和与总数，输出为累计分桶
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, (list(state[0]), state[1], state[2])) for key, state in self.values.items())
+        lines = self.header()
+        bucket_labels = self.labelnames + ('le',)
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(bucket_labels, key + (_format_value(bound),))} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(bucket_labels, key + ("+Inf",))} {count}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+# 指标注册表：固定的计数器、直方图，以及抓取时才计算的收集函数（索引大小、缓存统计等）
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics = []
+        self.collectors = []
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        # collector()返回[(名称, 类型, 说明, [(标签字典, 值)])]
+        self.collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.extend(metric.render())
+        for collector in self.collectors:
+            try:
+                families = collector()
+            except Exception as e:
+                print(f"Error collecting metrics: {str(e)}")
+                continue
+            for name, kind, documentation, samples in families:
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {kind}')
+                for labels, value in samples:
+                    lines.append(f'{name}{_format_labels(tuple(labels), tuple(labels.values()))} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+def resident_memory_bytes():
+    # 当前常驻内存：Linux读取/proc，其他平台退化为峰值常驻内存
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # macOS以字节为单位，Linux以KB为单位
+        return peak if os.uname().sysname == 'Darwin' else peak * 1024
+
+registry = MetricsRegistry()
+
+# 各阶段耗时：embed（嵌入接口/本地嵌入）、search（FAISS/Milvus搜索）、lexical（词法搜索）、
+# hydrate（按命中结果取回文本）、save/load（快照保存和加载）；backend为嵌入来源或存储类型
+stage_seconds = registry.histogram(
+    'vector_server_stage_seconds', 'Latency of request stages in seconds', ('stage', 'backend')
+)
+request_seconds = registry.histogram(
+    'vector_server_request_seconds', 'HTTP request latency in seconds', ('path',)
+)
+requests_total = registry.counter(
+    'vector_server_requests_total', 'HTTP requests by path and status code', ('path', 'status')
+)
+# 本地备用嵌入的使用次数：index为写入时接口失败改用本地向量的分块数，search为改走备用检索的查询数
+fallback_total = registry.counter(
+    'vector_server_fallback_total', 'Texts handled with the local fallback embedder', ('use',)
+)
+errors_total = registry.counter(
+    'vector_server_errors_total', 'Errors by store type and operation', ('store', 'operation')
+)
+# 查询结果缓存中与查询最相似的一条可用缓存的余弦相似度，据此调整QUERY_CACHE_SIMILARITY
+query_cache_similarity = registry.histogram(
+    'vector_server_query_cache_similarity', 'Cosine similarity of the nearest reusable cached query',
+    buckets=(0.8, 0.85, 0.9, 0.92, 0.94, 0.95, 0.96, 0.97, 0.98, 0.99, 0.995, 0.999, 1.0)
+)
+
+# 当前请求各阶段的累计耗时，由HTTP中间件创建，用于生成Server-Timing响应头。
+# 线程池中执行的操作共享同一个字典，因此在线程内记录的阶段也会计入当前请求
+_request_timings = contextvars.ContextVar('request_timings', default=None)
+
+def start_request_timing():
+    timings = {}
+    _request_timings.set(timings)
+    return timings
+
+@contextmanager
+def stage_timer(stage, backend):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        stage_seconds.observe(elapsed, stage=stage, backend=backend)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def run_timed(function, *args):
+    # 在其他线程中执行请求的一部分：调用方复制当前上下文后在其中调用，
+    # 期间记录的阶段耗时写入单独的字典并随结果返回，由merge_parallel_timings合并
+    timings = {}
+    _request_timings.set(timings)
+    return function(*args), timings
+
+def merge_parallel_timings(timings_list):
+    # 并行执行的各部分按阶段取最长耗时计入当前请求，与实际等待的时间一致
+    timings = _request_timings.get()
+    if timings is None:
+        return
+    for stage in set().union(*timings_list):
+        timings[stage] = timings.get(stage, 0.0) + max(part.get(stage, 0.0) for part in timings_list)
+
+def count_error(store, operation):
+    errors_total.inc(store=store, operation=operation)
+
+def server_timing_header(timings, total):
+    # 标准的Server-Timing格式，单位为毫秒，如 embed;dur=120.5, search;dur=3.2, total;dur=125.0
+    parts = [f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in timings.items()]
+    parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
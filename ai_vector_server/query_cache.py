@@ -0,0 +1,148 @@
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+import faiss
+
+from metrics import query_cache_similarity
+
+# 语义查询结果缓存：保存最近查询的向量和top-k结果，新查询的向量与某条缓存查询的余弦相似度
+# 达到similarity时直接返回缓存的结果，省去FAISS搜索和取回文本。
+# 缓存查询的向量保存在一个小的FAISS内积索引中（向量先归一化），每次查找只搜索最近的neighbours条。
+# 每条缓存带有查询键（集合名、top_k、阈值、过滤条件等，第一个元素必须是集合名）和写入时的存储代数，
+# 键不同的缓存不会被复用；存储有写入后代数变化，旧代数的缓存在查找时失效并删除。
+# 超过ttl秒的缓存过期（0表示不过期），超出容量时淘汰最久未使用的缓存
+class SemanticQueryCache:
+    def __init__(self, max_entries=1000, similarity=0.97, ttl=300, neighbours=16):
+        self.max_entries = max_entries
+        self.similarity = similarity
+        self.ttl = ttl
+        self.neighbours = neighbours
+        # 缓存ID -> (查询键, 存储代数, 结果, 过期时间, 向量维度)，按最近使用排序
+        self.entries = OrderedDict()
+        # 每种向量维度一个索引，不同维度的集合共用一个缓存
+        self.indexes = {}
+        self.next_id = 0
+        self.lock = threading.Lock()
+
+        # 命中统计
+        self.hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.expired = 0
+        self.evictions = 0
+        self.hit_similarity = 0.0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    @staticmethod
+    def _normalize(vectors):
+        matrix = np.array(vectors, dtype='float32', ndmin=2)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+    def lookup(self, key, generation, vectors):
+        # 返回每条查询缓存的结果，未命中为None
+        results = [None] * len(vectors)
+        if not self.enabled or not len(vectors):
+            return results
+        matrix = self._normalize(vectors)
+        with self.lock:
+            index = self.indexes.get(matrix.shape[1])
+            if index is None or index.ntotal == 0:
+                self.misses += len(vectors)
+                return results
+            similarities, labels = index.search(matrix, min(self.neighbours, index.ntotal))
+            now = time.time()
+            stale = set()
+            for row in range(len(matrix)):
+                for similarity, entry_id in zip(similarities[row].tolist(), labels[row].tolist()):
+                    entry = self.entries.get(entry_id)
+                    if entry is None or entry_id in stale or entry[0] != key:
+                        continue
+                    if entry[1] != generation:
+                        # 存储已有写入，旧代数的缓存失效；切换索引期间仍在旧存储上的搜索不删除新代数的缓存
+                        if entry[1] < generation:
+                            stale.add(entry_id)
+                            self.invalidated += 1
+                        continue
+                    if entry[3] <= now:
+                        stale.add(entry_id)
+                        self.expired += 1
+                        continue
+                    # 只看最相似的一条可用缓存，其相似度分布用于调整similarity
+                    query_cache_similarity.observe(min(similarity, 1.0))
+                    if similarity >= self.similarity:
+                        self.entries.move_to_end(entry_id)
+                        self.hit_similarity += similarity
+                        results[row] = [dict(hit) for hit in entry[2]]
+                    break
+                if results[row] is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+            self._remove(stale)
+        return results
+
+    def put(self, key, generation, vectors, results):
+        if not self.enabled or not len(vectors):
+            return
+        matrix = self._normalize(vectors)
+        dimension = matrix.shape[1]
+        expires = time.time() + self.ttl if self.ttl > 0 else float('inf')
+        with self.lock:
+            index = self.indexes.get(dimension)
+            if index is None:
+                index = self.indexes[dimension] = faiss.IndexIDMap2(faiss.IndexFlatIP(dimension))
+            entry_ids = np.arange(self.next_id, self.next_id + len(matrix), dtype='int64')
+            self.next_id += len(matrix)
+            index.add_with_ids(matrix, entry_ids)
+            for entry_id, hits in zip(entry_ids.tolist(), results):
+                self.entries[entry_id] = (key, generation, [dict(hit) for hit in hits], expires, dimension)
+
+            # 先清理已过期的最久未使用缓存，再按容量淘汰
+            stale = []
+            now = time.time()
+            for entry_id, entry in self.entries.items():
+                if len(self.entries) - len(stale) <= self.max_entries and entry[3] > now:
+                    break
+                stale.append(entry_id)
+                if entry[3] <= now:
+                    self.expired += 1
+                else:
+                    self.evictions += 1
+            self._remove(stale)
+
+    def invalidate(self, collection):
+        # 删除集合的全部缓存，用于集合重新加载后代数从头计数的情况
+        with self.lock:
+            self._remove([entry_id for entry_id, entry in self.entries.items() if entry[0][0] == collection])
+
+    def _remove(self, entry_ids):
+        removed = {}
+        for entry_id in entry_ids:
+            entry = self.entries.pop(entry_id, None)
+            if entry is not None:
+                removed.setdefault(entry[4], []).append(entry_id)
+        for dimension, ids in removed.items():
+            self.indexes[dimension].remove_ids(np.array(ids, dtype='int64'))
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "query_cache_hits": self.hits,
+                "query_cache_misses": self.misses,
+                "query_cache_hit_rate": self.hits / lookups if lookups else 0.0,
+                "query_cache_mean_hit_similarity": self.hit_similarity / self.hits if self.hits else None,
+                "query_cache_invalidated": self.invalidated,
+                "query_cache_expired": self.expired,
+                "query_cache_evictions": self.evictions,
+                "query_cache_entries": len(self.entries),
+                "query_cache_capacity": self.max_entries,
+                "query_cache_similarity": self.similarity,
+                "query_cache_ttl": self.ttl
+            }
@@ -0,0 +1,53 @@
+import threading
+from contextlib import contextmanager
+
+# 读写锁：多个读者可以并发持有，写者独占；有写者等待时新读者排队，避免写者饥饿。
+# 写锁对同一线程可重入，持有写锁的线程也可以直接进入读锁。
+# 读锁不可嵌套获取（有写者排队时会死锁），调用链中只在最外层加读锁
+class RWLock:
+    def __init__(self):
+        self.cond = threading.Condition(threading.Lock())
+        self.readers = 0
+        self.writer = None
+        self.write_depth = 0
+        self.waiting_writers = 0
+
+    @contextmanager
+    def read_lock(self):
+        # 已持有写锁的线程无需再加读锁
+        if self.writer == threading.get_ident():
+            yield
+            return
+        with self.cond:
+            while self.writer is not None or self.waiting_writers:
+                self.cond.wait()
+            self.readers += 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.readers -= 1
+                if self.readers == 0:
+                    self.cond.notify_all()
+
+    @contextmanager
+    def write_lock(self):
+        me = threading.get_ident()
+        with self.cond:
+            if self.writer == me:
+                self.write_depth += 1
+            else:
+                self.waiting_writers += 1
+                while self.writer is not None or self.readers:
+                    self.cond.wait()
+                self.waiting_writers -= 1
+                self.writer = me
+                self.write_depth = 1
+        try:
+            yield
+        finally:
+            with self.cond:
+                self.write_depth -= 1
+                if self.write_depth == 0:
+                    self.writer = None
+                    self.cond.notify_all()
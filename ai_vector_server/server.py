@@ -2,16 +2,30 @@ import sys
 import os
 import argparse
 from dotenv import load_dotenv
-from fastapi import FastAPI
-from pydantic import BaseModel
-import numpy as np
-import openai
-import requests
+from fastapi import FastAPI, Request
+from fastapi.responses import PlainTextResponse
+from starlette.concurrency import run_in_threadpool
+from pydantic import BaseModel, Field, StrictBool, StrictFloat, StrictInt, StrictStr
+from typing import Any, Dict, List, Literal, Optional, Union
 from pathlib import Path
+from contextlib import asynccontextmanager
 import atexit
+import threading
+import time
+import asyncio
+import anyio
 
 # 导入向量存储模块
 from vector_store import create_vector_store
+from embedding_cache import EmbeddingCache
+from query_cache import SemanticQueryCache
+from embedding_client import AsyncEmbeddingClient
+from embedding_batcher import EmbeddingBatcher
+from local_embedder import LocalEmbedder
+from text_chunker import TextChunker, chunk_vector_id, split_vector_id, MAX_DOC_ID
+from collection_manager import CollectionManager
+from metadata_store import parse_filter
+import metrics
 
 # 加载.env文件
 # 首先检查当前目录下的.env文件
@@ -24,19 +38,107 @@ else:
     if parent_env_path.exists():
         load_dotenv(dotenv_path=parent_env_path)
 
-# 配置OpenAI客户端（默认配置，可通过参数或环境变量覆盖）
-openai.api_key = os.getenv('AI_API_KEY', '')
-api_base = os.getenv('AI_API_URL', 'https://api.openai.com/v1')
-if api_base != 'https://api.openai.com/v1':
-    openai.api_base = api_base
-
 # 获取模型配置
 embedding_model = os.getenv('AI_MODEL', 'text-embedding-ada-002')
 
+# 已知嵌入模型的向量维度；其他模型通过EMBEDDING_DIM指定，本地备用向量按该维度生成以匹配索引
+MODEL_DIMENSIONS = {
+    'text-embedding-ada-002': 1536,
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072
+}
+embedding_dim = int(os.getenv('EMBEDDING_DIM', 0)) or None
+
+# 嵌入接口不可用时使用的本地备用嵌入，以及是否维护独立的备用索引
+local_embedder = LocalEmbedder(dim=int(os.getenv('EMBEDDING_FALLBACK_DIM', 256)))
+fallback_index_enabled = os.getenv('EMBEDDING_FALLBACK_INDEX', 'true').lower() in ('1', 'true', 'yes')
+
+# 长文档分块：每块的字符数上限和相邻块的重叠字符数，TEXT_CHUNK_SIZE为0表示不分块
+text_chunker = TextChunker(
+    chunk_size=int(os.getenv('TEXT_CHUNK_SIZE', 500)),
+    overlap=int(os.getenv('TEXT_CHUNK_OVERLAP', 50))
+)
+
+# 默认搜索模式：vector（向量）、lexical（BM25词法）、hybrid（两者按倒数排名融合）
+search_mode = os.getenv('SEARCH_MODE', 'vector')
+# 混合搜索时最相关的词法结果覆盖了该比例的查询词（按idf加权）就直接返回，不调用嵌入接口；大于1表示关闭
+search_lexical_shortcut = float(os.getenv('SEARCH_LEXICAL_SHORTCUT', 1.0))
+# 倒数排名融合的平滑常数
+search_rrf_k = int(os.getenv('SEARCH_RRF_K', 60))
+
+# 兼容OpenAI格式的异步嵌入客户端（默认配置，可通过参数或环境变量覆盖）
+embedding_client = AsyncEmbeddingClient(
+    base_url=os.getenv('AI_API_URL', 'https://api.openai.com/v1'),
+    api_key=os.getenv('AI_API_KEY', ''),
+    timeout=float(os.getenv('EMBEDDING_TIMEOUT', 10)),
+    connect_timeout=float(os.getenv('EMBEDDING_CONNECT_TIMEOUT', 3)),
+    max_connections=int(os.getenv('EMBEDDING_MAX_CONNECTIONS', 20)),
+    max_concurrency=int(os.getenv('EMBEDDING_MAX_CONCURRENCY', 8)),
+    max_retries=int(os.getenv('EMBEDDING_MAX_RETRIES', 2)),
+    failure_threshold=int(os.getenv('EMBEDDING_CIRCUIT_THRESHOLD', 5)),
+    reset_timeout=float(os.getenv('EMBEDDING_CIRCUIT_RESET', 30)),
+    deadline=float(os.getenv('EMBEDDING_DEADLINE', 10))
+)
+
+# 批量请求嵌入接口时每次发送的文本数量
+embedding_batch_size = int(os.getenv('EMBEDDING_BATCH_SIZE', 64))
+
+# 合并并发嵌入请求的微批处理器：收集窗口（毫秒）内的请求，或攒够一批后立即发送
+embedding_batcher = EmbeddingBatcher(
+    lambda texts: request_embeddings(texts),
+    window_ms=float(os.getenv('EMBEDDING_BATCH_WINDOW_MS', 5)),
+    max_batch=embedding_batch_size
+)
+
+# 嵌入向量缓存：内存LRU容量和可选的磁盘缓存路径
+embedding_cache = EmbeddingCache(
+    max_entries=int(os.getenv('EMBEDDING_CACHE_SIZE', 10000)),
+    disk_path=os.getenv('EMBEDDING_CACHE_PATH') or None
+)
+
+# 语义查询结果缓存：容量（0表示关闭）、复用缓存结果的余弦相似度下限、过期秒数（0表示不过期）
+query_cache = SemanticQueryCache(
+    max_entries=int(os.getenv('QUERY_CACHE_SIZE', 1000)),
+    similarity=float(os.getenv('QUERY_CACHE_SIMILARITY', 0.97)),
+    ttl=float(os.getenv('QUERY_CACHE_TTL', 300))
+)
+
 app = FastAPI()
 
-# 初始化向量存储
-vector_store = None
+# 同步的FAISS操作在线程池中执行，搜索之间只持有读锁、可以并行，线程数决定并发搜索的上限
+server_threads = int(os.getenv('VECTOR_SERVER_THREADS', 40))
+
+@app.on_event("startup")
+async def configure_threadpool():
+    anyio.to_thread.current_default_thread_limiter().total_tokens = server_threads
+
+@app.on_event("startup")
+async def start_snapshot_watch():
+    if snapshot_watch_interval > 0:
+        background_tasks.add(asyncio.create_task(watch_snapshots()))
+
+@app.on_event("shutdown")
+async def close_embedding_client():
+    await embedding_client.aclose()
+
+# 是否在响应中附带Server-Timing头（各阶段耗时，单位毫秒），便于后端与问答日志一并记录
+metrics_timing_headers = os.getenv('METRICS_TIMING_HEADERS', 'false').lower() in ('1', 'true', 'yes')
+
+# 记录每个请求的耗时和状态码，并收集请求内各阶段的耗时
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    timings = metrics.start_request_timing()
+    start = time.perf_counter()
+    response = await call_next(request)
+    elapsed = time.perf_counter() - start
+    # 按路由模板统计，未匹配的路径合并为一类，避免标签数量无限增长
+    route = request.scope.get('route')
+    path = getattr(route, 'path', 'unmatched')
+    metrics.request_seconds.observe(elapsed, path=path)
+    metrics.requests_total.inc(path=path, status=response.status_code)
+    if metrics_timing_headers:
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings, elapsed)
+    return response
 
 # 定义默认存储配置
 DEFAULT_STORE_CONFIG = {
@@ -44,7 +146,7 @@ DEFAULT_STORE_CONFIG = {
     'disk': {
         'index_path': 'data/faiss_index.index',
         'ids_path': 'data/doc_ids.npy',
-        'texts_path': 'data/doc_texts.txt'
+        'texts_path': 'data/doc_texts.bin'
     },
     'milvus': {
         'host': 'localhost',
@@ -53,195 +155,874 @@ DEFAULT_STORE_CONFIG = {
     }
 }
 
+# 命名集合（多租户）：default集合使用上面的默认配置，其他集合的配置和文件保存在VECTOR_COLLECTIONS_PATH下，
+# 首次访问时加载，空闲超过VECTOR_COLLECTION_IDLE_TIMEOUT秒后保存并释放内存
+collections = CollectionManager(
+    root=os.getenv('VECTOR_COLLECTIONS_PATH', 'data/collections'),
+    idle_timeout=float(os.getenv('VECTOR_COLLECTION_IDLE_TIMEOUT', 1800)),
+    on_load=lambda coll: prepare_collection(coll)
+)
+# 并发的首次请求只初始化一次default集合
+vector_store_init_lock = threading.Lock()
+
+# 后台索引任务（重建索引、重新加载快照），每个集合同时只运行一个，保留最近一次任务的状态
+index_jobs = {}
+background_tasks = set()
+# 切换前的校验：自检索命中率下限，重新加载时新快照文档数相对旧索引的比例下限
+swap_min_hit_rate = float(os.getenv('VECTOR_SWAP_MIN_HIT_RATE', 0.9))
+swap_min_ratio = float(os.getenv('VECTOR_SWAP_MIN_RATIO', 0.5))
+# 只读实例检查快照文件变化的间隔（秒），发现写入进程保存了新快照后在后台加载并切换，0表示关闭
+snapshot_watch_interval = float(os.getenv('VECTOR_STORE_WATCH_INTERVAL', 0))
+# 重建索引时每批读取和嵌入的分块数
+REINDEX_BATCH = 1024
+
+class CollectionInput(BaseModel):
+    name: str
+    # 以下参数不传时沿用默认集合的配置
+    type: Optional[Literal['memory', 'disk', 'milvus']] = None
+    index_type: Optional[Literal['flat', 'ivf_flat', 'hnsw', 'ivf_pq']] = None
+    nlist: Optional[int] = None
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    hnsw_m: Optional[int] = None
+    pq_m: Optional[int] = None
+    train_threshold: Optional[int] = None
+    encoding: Optional[Literal['float32', 'float16', 'sq8']] = None
+    pca_dim: Optional[int] = Field(default=None, ge=0)
+    # FAISS存储的分片数，文档按ID取模分到各分片并行搜索
+    shards: Optional[int] = Field(default=None, ge=1)
+    # 集合使用的嵌入向量维度，不传时由第一批写入的向量决定
+    dimension: Optional[int] = None
+
+class ReindexInput(BaseModel):
+    # 重建使用的嵌入模型，不传时为AI_MODEL
+    model: Optional[str] = None
+
 class DocInput(BaseModel):
-    doc_id: int
+    # 文档ID的高位用于编码分块序号
+    doc_id: int = Field(ge=0, lt=MAX_DOC_ID)
     text: str
+    # 可选的文档元数据（如分类），用于搜索时按filter过滤；取值为字符串、数值或布尔值
+    metadata: Optional[Dict[str, Union[StrictBool, StrictInt, StrictFloat, StrictStr, None]]] = None
+
+class DocsInput(BaseModel):
+    docs: List[DocInput]
+
+class DocIdInput(BaseModel):
+    doc_id: int = Field(ge=0, lt=MAX_DOC_ID)
 
 class QueryInput(BaseModel):
     text: str
     top_k: int = 5
+    # 可选的相关性阈值：分数下限(0~1)或L2距离上限
+    min_score: Optional[float] = None
+    max_distance: Optional[float] = None
+    # 搜索模式，不传时使用SEARCH_MODE
+    mode: Optional[Literal['vector', 'lexical', 'hybrid']] = None
+    # 元数据过滤条件，如{"category": "保洁"}，语法见metadata_store.parse_filter
+    filter: Optional[Dict[str, Any]] = None
 
-# 兼容OpenAI格式的接口请求
-def get_embedding(text):
+class BatchQueryInput(BaseModel):
+    texts: List[str]
+    top_k: int = 5
+    min_score: Optional[float] = None
+    max_distance: Optional[float] = None
+    # 对全部查询生效的元数据过滤条件
+    filter: Optional[Dict[str, Any]] = None
+
+# 集合的向量所用的嵌入模型：存储中记录的模型优先（AI_MODEL变更后、重建索引完成前仍是旧模型），否则为AI_MODEL
+def collection_model(coll):
+    return store_model(coll.store)
+
+def store_model(store):
+    return getattr(store, 'embedding_model', None) or embedding_model
+
+# 文档按句子分块后批量嵌入，返回(向量, 向量ID, 分块文本)；第0块的向量ID就是文档ID
+async def embed_documents(coll, docs, model=None):
+    vector_ids = []
+    chunks = []
+    for doc in docs:
+        for chunk_no, chunk in enumerate(text_chunker.iter_chunks(doc.text)):
+            vector_ids.append(chunk_vector_id(doc.doc_id, chunk_no))
+            chunks.append(chunk)
+    vectors = await get_embeddings(coll, chunks, model)
+    return vectors, vector_ids, chunks
+
+# 文档的元数据：{文档ID: 元数据}，值为None的字段不保存
+def document_metadata(docs):
+    metadata = {}
+    for doc in docs:
+        values = {key: value for key, value in (doc.metadata or {}).items() if value is not None}
+        if values:
+            metadata[doc.doc_id] = values
+    return metadata
+
+# 获取用于写入主索引的嵌入向量，接口失败的文本使用与索引同维度的本地备用向量
+async def get_embeddings(coll, texts, model=None):
+    vectors = await fetch_embeddings(texts, model or collection_model(coll))
+    failed = [i for i, vector in enumerate(vectors) if vector is None]
+    if failed:
+        metrics.fallback_total.inc(len(failed), use='index')
+        with metrics.stage_timer('embed', 'local'):
+            local_vectors = local_embedder.embed([texts[i] for i in failed], model_dimension(coll))
+        for i, vector in zip(failed, local_vectors):
+            vectors[i] = vector
+    return vectors
+
+# 批量获取嵌入向量：先查缓存，未命中的文本交给微批处理器，
+# 与其他并发请求合并后按embedding_batch_size分批请求接口；接口失败的文本返回None。
+# 其他模型（尚未重建的集合使用的旧模型、重建索引的目标模型）不经过微批处理器，直接分批请求
+async def fetch_embeddings(texts, model=None):
+    model = model or embedding_model
+    vectors = [embedding_cache.get(model, text) for text in texts]
+    missing = list(dict.fromkeys(text for text, vector in zip(texts, vectors) if vector is None))
+    
+    if model == embedding_model:
+        fetched_vectors = await embedding_batcher.embed_many(missing)
+    else:
+        fetched_vectors = []
+        for start in range(0, len(missing), embedding_batch_size):
+            fetched_vectors.extend(await request_embeddings(missing[start:start + embedding_batch_size], model))
+    fetched = dict(zip(missing, fetched_vectors))
+    return [vector if vector is not None else fetched[text] for text, vector in zip(texts, vectors)]
+
+# 请求嵌入接口，失败（超时、重试耗尽或熔断）时立即返回，由调用方改用本地备用向量
+async def request_embeddings(texts, model=None):
+    model = model or embedding_model
     try:
-        # 尝试使用OpenAI官方SDK方式
-        resp = openai.Embedding.create(model=embedding_model, input=text)
-        return np.array(resp['data'][0]['embedding']).astype('float32')
+        with metrics.stage_timer('embed', 'api'):
+            vectors = await embedding_client.embed(texts, model)
+        for text, vector in zip(texts, vectors):
+            embedding_cache.put(model, text, vector)
+        return vectors
     except Exception as e:
-        # 如果SDK方式失败，尝试使用HTTP请求方式（兼容某些API）
-        try:
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {openai.api_key}"
-            }
-            data = {
-                "model": embedding_model,
-                "input": text
-            }
-            response = requests.post(f"{api_base}/embeddings", headers=headers, json=data)
-            response.raise_for_status()
-            resp_data = response.json()
-            return np.array(resp_data['data'][0]['embedding']).astype('float32')
-        except Exception as inner_e:
-            print(f"Error getting embedding: {str(inner_e)}")
-            # 使用简单的本地向量生成方法作为备用
-            print("Using local fallback embedding generation")
-            # 生成一个简单的向量，基于文本的字符统计和哈希
-            import hashlib
-            # 创建一个固定维度的向量 (128维)
-            dim = 128
-            vector = np.zeros(dim, dtype='float32')
-            
-            # 计算文本的哈希值作为种子
-            text_hash = hashlib.md5(text.encode()).hexdigest()
-            
-            # 基于哈希值填充向量
-            for i in range(min(len(text_hash), dim)):
-                vector[i] = (ord(text_hash[i]) - ord('0')) / 16.0
-            
-            # 基于文本长度和字符分布添加一些变化
-            for char in text[:100]:  # 只处理前100个字符
-                idx = ord(char) % dim
-                vector[idx] += 0.1
-            
-            # 归一化向量
-            norm = np.linalg.norm(vector)
-            if norm > 0:
-                vector = vector / norm
-            
-            return vector
+        print(f"Error getting embeddings for batch of {len(texts)}: {type(e).__name__} {str(e)}")
+        metrics.count_error('embedding_api', 'embed')
+        print("Using local fallback embedding generation")
+        return [None] * len(texts)
 
-@app.post("/add-doc")
-def add_doc(doc: DocInput):
-    global vector_store
-    vector = get_embedding(doc.text)
+# 集合主索引的向量维度：优先与已有索引一致，其次是集合配置、EMBEDDING_DIM或已知的模型维度
+def model_dimension(coll):
+    return coll.dimension() or embedding_dim or MODEL_DIMENSIONS.get(embedding_model, 1536)
+
+# 按集合当前的嵌入模型生成向量并写入；嵌入期间重建索引完成、集合换了模型时按新模型重新生成
+async def write_documents(coll, docs):
+    metadata = document_metadata(docs)
+    while True:
+        model = collection_model(coll)
+        vectors, vector_ids, chunks = await embed_documents(coll, docs, model)
+        success = await run_in_threadpool(add_to_collection, coll, vectors, vector_ids, chunks, model, metadata)
+        if success is not None:
+            return success, len(chunks)
+
+# 写入集合的主存储和备用索引；向量维度与集合不一致时拒绝写入。
+# 写入在集合的write_gate下进行，重建索引期间同时记入journal；向量的模型已不是集合当前的模型时返回None
+def add_to_collection(coll, vectors, vector_ids, chunks, model=None, metadata=None):
+    with coll.write_gate:
+        if model is not None and model != collection_model(coll):
+            return None
+        dimension = coll.dimension()
+        if dimension and len(vectors) and len(vectors[0]) != dimension:
+            print(f"Error: embedding dimension {len(vectors[0])} does not match collection {coll.name} ({dimension})")
+            return False
+        if not coll.store.add_vectors(vectors, vector_ids, chunks, metadata):
+            metrics.count_error(coll.store_type, 'add')
+            return False
+        if getattr(coll.store, 'embedding_model', False) is None:
+            coll.store.embedding_model = model or embedding_model
+        if coll.journal is not None:
+            coll.journal.append(('add', vector_ids, chunks, metadata))
+    index_fallback(coll, vector_ids, chunks, metadata)
+    return True
+
+def delete_from_collection(coll, doc_id):
+    with coll.write_gate:
+        deleted = coll.store.delete_vector(doc_id)
+        if coll.journal is not None:
+            coll.journal.append(('delete', doc_id))
+    unindex_fallback(coll, doc_id)
+    return deleted
+
+# 备用索引与主存储同步写入本地备用向量和元数据；文本只保存在主存储中
+def index_fallback(coll, doc_ids, texts, metadata=None):
+    if coll.fallback_store is not None:
+        coll.fallback_store.add_vectors(local_embedder.embed(texts), doc_ids, [''] * len(doc_ids), metadata)
+
+def unindex_fallback(coll, doc_id):
+    if coll.fallback_store is not None:
+        coll.fallback_store.delete_vector(doc_id)
+
+# 集合加载时重建备用索引并清除查询结果缓存（代数从头计数）；索引的嵌入模型与AI_MODEL不同时提示重建索引
+def prepare_collection(coll):
+    rebuild_fallback_store(coll)
+    query_cache.invalidate(coll.name)
+    model = getattr(coll.store, 'embedding_model', None)
+    if model and model != embedding_model:
+        print(f"Warning: collection {coll.name} was indexed with {model}, which is used for its queries until it is reindexed with {embedding_model} (POST /admin/reindex)")
+
+# 集合加载时用主存储中的全部文本重建备用索引
+def rebuild_fallback_store(coll):
+    coll.fallback_store = build_fallback_store(coll.name, coll.store)
+
+def build_fallback_store(name, store):
+    if not fallback_index_enabled:
+        return None
     
-    # 确保向量存储已初始化
-    if vector_store is None:
-        # 使用默认配置初始化
-        init_vector_store()
+    fallback_store = create_vector_store(store_type='memory', lexical=False)
+    # 指标中与主存储区分
+    fallback_store.store_label = 'fallback'
+    if not hasattr(store, 'doc_ids'):
+        # Milvus无法遍历全部文档，备用索引只包含本次启动后写入的文档
+        return fallback_store
+    doc_ids = store.doc_ids()
+    for start in range(0, len(doc_ids), 1024):
+        texts = store.get_texts(doc_ids[start:start + 1024])
+        metadata = store.get_metadata({split_vector_id(vector_id)[0] for vector_id in texts})
+        fallback_store.add_vectors(local_embedder.embed(list(texts.values())), list(texts), [''] * len(texts), metadata)
+    print(f"Built local fallback index for collection {name} with {fallback_store.count()} documents")
+    return fallback_store
+
+# 搜索：嵌入成功的查询先查语义查询结果缓存，未命中的在主索引中搜索；接口失败的查询用本地备用向量在备用索引中搜索，
+# 未启用备用索引时退化为在主索引中搜索同维度的本地备用向量
+def search_stores(coll, texts, vectors, top_k, max_distance=None, min_score=None, filters=None):
+    results = [[] for _ in texts]
+    embedded = [i for i, vector in enumerate(vectors) if vector is not None]
+    if embedded:
+        # 搜索前读取代数：搜索期间有写入时，结果以旧代数缓存，下次查找即失效
+        key = (coll.name, top_k, max_distance, min_score, filters)
+        generation = (coll.generation, coll.store.generation)
+        cached = query_cache.lookup(key, generation, [vectors[i] for i in embedded])
+        for i, query_hits in zip(embedded, cached):
+            if query_hits is not None:
+                results[i] = query_hits
+        missing = [i for i, query_hits in zip(embedded, cached) if query_hits is None]
+        if missing:
+            hits = coll.store.search_batch([vectors[i] for i in missing], top_k, max_distance, min_score, filters)
+            for i, query_hits in zip(missing, hits):
+                results[i] = query_hits
+            query_cache.put(key, generation, [vectors[i] for i in missing], hits)
     
-    # 添加向量
-    success = vector_store.add_vector(vector, doc.doc_id, doc.text)
-    if success:
-        return {"status": "ok"}
-    else:
-        return {"status": "error", "message": "Failed to add document"}
+    failed = [i for i, vector in enumerate(vectors) if vector is None]
+    if failed:
+        metrics.fallback_total.inc(len(failed), use='search')
+        failed_texts = [texts[i] for i in failed]
+        if coll.fallback_store is not None:
+            hits = search_fallback(coll, failed_texts, top_k, max_distance, min_score, filters)
+        else:
+            with metrics.stage_timer('embed', 'local'):
+                local_vectors = local_embedder.embed(failed_texts, model_dimension(coll))
+            hits = coll.store.search_batch(local_vectors, top_k, max_distance, min_score, filters)
+        for i, query_hits in zip(failed, hits):
+            results[i] = query_hits
+    return results
+
+# 倒数排名融合：每个文档按在向量结果和词法结果中的名次累加1/(k+名次)，
+# 不需要把L2距离和BM25分数换算到同一尺度
+def fuse_results(vector_hits, lexical_hits, top_k):
+    fused = {}
+    for hits, key in ((vector_hits, 'vector_score'), (lexical_hits, 'lexical_score')):
+        for rank, hit in enumerate(hits):
+            entry = fused.get(hit['doc_id'])
+            if entry is None:
+                entry = fused[hit['doc_id']] = {
+                    "doc_id": hit['doc_id'],
+                    "chunk": hit['chunk'],
+                    "text": hit['text'],
+                    "distance": None,
+                    "score": 0.0,
+                    "vector_score": None,
+                    "lexical_score": None
+                }
+            entry['score'] += 1.0 / (search_rrf_k + rank + 1)
+            entry[key] = hit['score']
+            if hit['distance'] is not None:
+                entry['distance'] = hit['distance']
+    return sorted(fused.values(), key=lambda entry: entry['score'], reverse=True)[:top_k]
+
+def search_fallback(coll, texts, top_k, max_distance=None, min_score=None, filters=None):
+    with metrics.stage_timer('embed', 'local'):
+        local_vectors = local_embedder.embed(texts)
+    results = coll.fallback_store.search_batch(local_vectors, top_k, max_distance, min_score, filters)
+    # 按分块的向量ID从主存储取回文本，主存储中已删除的分块不返回
+    vector_ids = [[chunk_vector_id(hit['doc_id'], hit['chunk']) for hit in hits] for hits in results]
+    doc_texts = coll.store.get_texts(list({vector_id for ids in vector_ids for vector_id in ids}))
+    return [
+        [dict(hit, text=doc_texts[vector_id]) for hit, vector_id in zip(hits, ids) if vector_id in doc_texts]
+        for hits, ids in zip(results, vector_ids)
+    ]
+
+# 取得请求指定的集合（不传为default），用完后释放引用；写入时不存在的集合自动创建。
+# 集合名不合法或不存在时返回None。读请求固定(pin)当前的存储，切换索引时仍在旧索引上完成
+@asynccontextmanager
+async def use_collection(name, create=False, pin=False):
+    try:
+        coll = await run_in_threadpool(open_collection, name, create)
+    except ValueError as e:
+        print(f"Error opening collection: {str(e)}")
+        coll = None
+    try:
+        yield coll.pin() if pin and coll is not None else coll
+    finally:
+        if coll is not None:
+            collections.release(coll)
+
+def open_collection(name, create=False):
+    ensure_vector_store()
+    return collections.acquire(name, create=create)
+
+def collection_error(name):
+    return {"status": "error", "message": f"Collection not available: {name or 'default'}"}
+
+# 解析请求的元数据过滤条件，返回(规范化的条件, 错误信息)；Milvus存储不支持元数据过滤
+def query_filter(coll, expression):
+    if expression is None:
+        return None, None
+    if not hasattr(coll.store, 'get_metadata'):
+        return None, f"Metadata filters are not supported by the {coll.store_type} store"
+    try:
+        return parse_filter(expression), None
+    except ValueError as e:
+        return None, f"Invalid filter: {str(e)}"
+
+@app.post("/add-doc")
+async def add_doc(doc: DocInput, collection: Optional[str] = None):
+    async with use_collection(collection, create=True) as coll:
+        if coll is None:
+            return collection_error(collection)
+        # 添加全部分块的向量（FAISS操作在线程池中执行，不阻塞事件循环）
+        success, chunks = await write_documents(coll, [doc])
+        if success:
+            return {"status": "ok", "chunks": chunks}
+        else:
+            return {"status": "error", "message": "Failed to add document"}
+
+@app.post("/add-docs")
+async def add_docs(payload: DocsInput, collection: Optional[str] = None):
+    if not payload.docs:
+        return {"status": "ok", "count": 0}
+    
+    async with use_collection(collection, create=True) as coll:
+        if coll is None:
+            return collection_error(collection)
+        # 批量添加向量
+        success, chunks = await write_documents(coll, payload.docs)
+        if success:
+            return {"status": "ok", "count": len(payload.docs), "chunks": chunks}
+        else:
+            return {"status": "error", "message": "Failed to add documents"}
+
+@app.post("/update-doc")
+async def update_doc(doc: DocInput, collection: Optional[str] = None):
+    async with use_collection(collection, create=True) as coll:
+        if coll is None:
+            return collection_error(collection)
+        # 按文档整体覆盖旧版本的全部分块，避免编辑后残留过期的分块
+        success, chunks = await write_documents(coll, [doc])
+        if success:
+            return {"status": "ok", "chunks": chunks}
+        else:
+            return {"status": "error", "message": "Failed to update document"}
+
+@app.post("/delete-doc")
+async def delete_doc(doc: DocIdInput, collection: Optional[str] = None):
+    async with use_collection(collection) as coll:
+        if coll is None:
+            return collection_error(collection)
+        deleted = await run_in_threadpool(delete_from_collection, coll, doc.doc_id)
+        return {"status": "ok", "deleted": deleted}
 
 @app.post("/search")
-def search(q: QueryInput):
-    global vector_store
-    if vector_store is None:
-        # 尝试初始化和加载向量存储
-        init_vector_store()
-        if vector_store is None:
+async def search(q: QueryInput, collection: Optional[str] = None):
+    async with use_collection(collection, pin=True) as coll:
+        if coll is None:
             return {"results": []}
-    
+        filters, error = query_filter(coll, q.filter)
+        if error:
+            return {"status": "error", "message": error, "results": []}
+        
+        mode = q.mode or search_mode
+        # 混合搜索为融合多取一些候选
+        candidates = max(q.top_k * 4, 20) if mode == 'hybrid' else q.top_k
+        lexical_hits = None
+        if mode != 'vector' and hasattr(coll.store, 'search_lexical'):
+            lexical_hits = await run_in_threadpool(coll.store.search_lexical, q.text, candidates, filters)
+            if mode == 'lexical':
+                return {"results": lexical_hits}
+            # 关键词查询的词法命中足够强时直接返回，省去嵌入接口调用
+            if lexical_hits and lexical_hits[0]['coverage'] >= search_lexical_shortcut:
+                return {"results": fuse_results([], lexical_hits, q.top_k)}
+        
+        try:
+            # 尝试获取嵌入向量，接口失败时为None
+            vectors = await fetch_embeddings([q.text], collection_model(coll))
+            # 尝试搜索向量
+            try:
+                results = (await run_in_threadpool(search_stores, coll, [q.text], vectors, candidates, q.max_distance, q.min_score, filters))[0]
+                if lexical_hits is not None:
+                    results = fuse_results(results, lexical_hits, q.top_k)
+                return {"results": results}
+            except Exception as e:
+                # 如果搜索失败，可能是因为向量存储为空或其他问题
+                print(f"Error searching vectors: {str(e)}")
+                metrics.count_error(coll.store_type, 'search')
+                return {"results": []}
+        except Exception as e:
+            # 如果获取嵌入向量失败
+            print(f"Error getting embedding: {str(e)}")
+            return {"results": []}
+
+@app.get("/index-info")
+async def index_info(collection: Optional[str] = None):
+    async with use_collection(collection, pin=True) as coll:
+        if coll is None or not hasattr(coll.store, 'index_info'):
+            return {"status": "error", "message": "Index info not available"}
+        return await run_in_threadpool(coll.store.index_info)
+
+@app.get("/recall")
+async def recall(k: int = 10, num_queries: int = 100, collection: Optional[str] = None):
+    # 以flat精确搜索为基线评估当前近似索引的recall@k
+    async with use_collection(collection, pin=True) as coll:
+        if coll is None or not hasattr(coll.store, 'evaluate_recall'):
+            return {"status": "error", "message": "Recall evaluation not available"}
+        return await run_in_threadpool(coll.store.evaluate_recall, k=k, num_queries=num_queries)
+
+@app.get("/collections")
+def list_collections():
+    ensure_vector_store()
+    return {"collections": collections.list()}
+
+@app.post("/collections")
+def create_collection(payload: CollectionInput):
+    ensure_vector_store()
+    overrides = payload.dict(exclude={'name'})
     try:
-        # 尝试获取嵌入向量
-        vector = get_embedding(q.text)
-        # 尝试搜索向量
+        config = collections.create(payload.name, overrides)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    return {"status": "ok", "name": payload.name, "type": config['type']}
+
+@app.get("/cache-stats")
+def cache_stats():
+    stats = embedding_cache.stats()
+    stats.update(embedding_client.stats())
+    stats.update(embedding_batcher.stats())
+    stats.update(local_embedder.stats())
+    stats.update(query_cache.stats())
+    return stats
+
+# 抓取时计算的指标：嵌入缓存和客户端状态、各集合的索引大小、进程内存
+def collect_server_metrics():
+    cache = embedding_cache.stats()
+    client = embedding_client.stats()
+    batcher = embedding_batcher.stats()
+    queries = query_cache.stats()
+    families = [
+        ('vector_server_embedding_cache_total', 'counter', 'Embedding cache lookups by result',
+         [({'result': 'hit'}, cache['hits']), ({'result': 'disk_hit'}, cache['disk_hits']), ({'result': 'miss'}, cache['misses'])]),
+        ('vector_server_embedding_cache_entries', 'gauge', 'Embedding cache entries by tier',
+         [({'tier': 'memory'}, cache['memory_entries']), ({'tier': 'disk'}, cache['disk_entries'])]),
+        ('vector_server_embedding_circuit_open', 'gauge', 'Whether the embedding API circuit breaker is open',
+         [({}, 0 if client['circuit_state'] == 'closed' else 1)]),
+        ('vector_server_embedding_batches_total', 'counter', 'Embedding API batches sent by the micro-batcher',
+         [({}, batcher['batcher_batches'])]),
+        ('vector_server_local_embeddings_total', 'counter', 'Texts embedded with the local fallback embedder',
+         [({}, local_embedder.embedded)]),
+        ('vector_server_query_cache_total', 'counter', 'Query result cache lookups by result',
+         [({'result': 'hit'}, queries['query_cache_hits']), ({'result': 'miss'}, queries['query_cache_misses'])]),
+        ('vector_server_query_cache_removed_total', 'counter', 'Query result cache entries removed by reason',
+         [({'reason': 'invalidated'}, queries['query_cache_invalidated']), ({'reason': 'expired'}, queries['query_cache_expired']),
+          ({'reason': 'evicted'}, queries['query_cache_evictions'])]),
+        ('vector_server_query_cache_entries', 'gauge', 'Query result cache entries',
+         [({}, queries['query_cache_entries'])]),
+        ('vector_server_process_resident_memory_bytes', 'gauge', 'Resident memory of the server process',
+         [({}, metrics.resident_memory_bytes())])
+    ]
+    
+    documents = []
+    vectors = []
+    loaded = collections.loaded()
+    for coll in loaded:
+        if coll.store is None or not hasattr(coll.store, 'index_info'):
+            continue
+        info = coll.store.index_info()
+        labels = {'collection': coll.name, 'store': coll.store_type}
+        documents.append((labels, info['documents']))
+        vectors.append((labels, info['vectors']))
+    families.extend([
+        ('vector_server_collections_loaded', 'gauge', 'Collections currently loaded in memory', [({}, len(loaded))]),
+        ('vector_server_index_documents', 'gauge', 'Documents in the index', documents),
+        ('vector_server_index_vectors', 'gauge', 'Vectors in the index including stale rows', vectors)
+    ])
+    return families
+
+metrics.registry.add_collector(collect_server_metrics)
+
+@app.get("/metrics")
+def metrics_endpoint():
+    return PlainTextResponse(metrics.registry.render(), media_type='text/plain; version=0.0.4')
+
+@app.post("/search-batch")
+async def search_batch(q: BatchQueryInput, collection: Optional[str] = None):
+    if not q.texts:
+        return {"results": []}
+    
+    async with use_collection(collection, pin=True) as coll:
+        if coll is None:
+            return {"results": [[] for _ in q.texts]}
+        filters, error = query_filter(coll, q.filter)
+        if error:
+            return {"status": "error", "message": error, "results": [[] for _ in q.texts]}
         try:
-            results = vector_store.search_vectors(vector, q.top_k)
+            # 所有查询文本一次请求嵌入接口，再合并为一次FAISS搜索
+            vectors = await fetch_embeddings(q.texts, collection_model(coll))
+            results = await run_in_threadpool(search_stores, coll, q.texts, vectors, q.top_k, q.max_distance, q.min_score, filters)
             return {"results": results}
         except Exception as e:
-            # 如果搜索失败，可能是因为向量存储为空或其他问题
             print(f"Error searching vectors: {str(e)}")
-            return {"results": []}
+            metrics.count_error(coll.store_type, 'search')
+            return {"results": [[] for _ in q.texts]}
+
+# 后台重建索引：用目标模型重新嵌入集合的全部分块，写入新的存储；期间的写入照常进入旧存储并记入journal。
+# 全部写完后关闭写入闸门，重放剩余的journal，校验通过后切换，进行中的搜索在旧存储上完成
+async def reindex_collection(coll, job, model):
+    source = coll.store
+    disk = coll.store_type == 'disk'
+    target = collections.create_store(collections.staging_config(coll) if disk else coll.config, load=False)
+    target.embedding_model = model
+    job['model'] = model
+    coll.journal = []
+    gated = False
+    try:
+        vector_ids = sorted(await run_in_threadpool(source.doc_ids), key=split_vector_id)
+        job['total'] = len(vector_ids)
+        for start in range(0, len(vector_ids), REINDEX_BATCH):
+            batch = vector_ids[start:start + REINDEX_BATCH]
+            texts = await run_in_threadpool(source.get_texts, batch)
+            metadata = await run_in_threadpool(source.get_metadata, {split_vector_id(vector_id)[0] for vector_id in batch})
+            # 同一文档的分块按序号写入；期间删除的分块不在结果中，之后的修改由journal重放
+            batch = [vector_id for vector_id in batch if vector_id in texts]
+            vectors = await reindex_embeddings([texts[vector_id] for vector_id in batch], model)
+            if batch and not await run_in_threadpool(target.add_vectors, vectors, batch, [texts[vector_id] for vector_id in batch], metadata):
+                raise RuntimeError("Failed to write the new index")
+            job['done'] = min(start + REINDEX_BATCH, len(vector_ids))
+        
+        job['phase'] = 'catching_up'
+        while len(coll.journal) > REINDEX_BATCH:
+            await replay_journal(coll, target, model)
+        job['phase'] = 'swapping'
+        await run_in_threadpool(coll.write_gate.acquire)
+        gated = True
+        await replay_journal(coll, target, model)
+        if target.count() == 0:
+            # 空集合只需记录新模型
+            source.embedding_model = model
+            job['validation'] = {"ok": True, "message": "Collection is empty"}
+            return
+        job['validation'] = await run_in_threadpool(validate_swap, source, target, model, True)
+        if not job['validation']['ok']:
+            raise RuntimeError(job['validation']['message'])
+        await run_in_threadpool(swap_reindexed, coll, source, target)
+    except BaseException:
+        if disk:
+            await run_in_threadpool(target.remove_files)
+        raise
+    finally:
+        coll.journal = None
+        if gated:
+            coll.write_gate.release()
+
+# 重建索引只使用嵌入接口生成的向量，不能混入本地备用向量
+async def reindex_embeddings(texts, model):
+    vectors = await fetch_embeddings(texts, model)
+    failed = sum(vector is None for vector in vectors)
+    if failed:
+        raise RuntimeError(f"Embedding API failed for {failed} of {len(texts)} texts with model {model}")
+    return vectors
+
+# 按顺序在新存储上重放journal中的写入，需要嵌入的文本合并为一次请求
+async def replay_journal(coll, target, model):
+    entries = coll.journal[:]
+    del coll.journal[:len(entries)]
+    vectors = await reindex_embeddings([chunk for entry in entries if entry[0] == 'add' for chunk in entry[2]], model)
+    
+    def apply():
+        position = 0
+        for entry in entries:
+            if entry[0] == 'delete':
+                target.delete_vector(entry[1])
+                continue
+            _, vector_ids, chunks, metadata = entry
+            if not target.add_vectors(vectors[position:position + len(chunks)], vector_ids, chunks, metadata):
+                raise RuntimeError("Failed to write the new index")
+            position += len(chunks)
+    await run_in_threadpool(apply)
+
+# 切换前校验新存储：向量维度与模型一致、文档数符合预期、用文档自身的向量能搜回该文档
+def validate_swap(old, new, model, exact_count):
+    problems = []
+    dimension = new.vector_dimension
+    if model == store_model(old):
+        expected_dimension = old.vector_dimension
+    else:
+        expected_dimension = embedding_dim if model == embedding_model and embedding_dim else MODEL_DIMENSIONS.get(model)
+    if expected_dimension and dimension != expected_dimension:
+        problems.append(f"dimension {dimension} does not match {expected_dimension} for {model}")
+    
+    old_count, new_count = old.count(), new.count()
+    if exact_count and new_count != old_count:
+        problems.append(f"{new_count} vectors, expected {old_count}")
+    elif not exact_count and new_count < old_count * swap_min_ratio:
+        problems.append(f"{new_count} vectors is less than {swap_min_ratio:.0%} of the current {old_count}")
+    
+    retrieval = new.check_self_retrieval()
+    if retrieval['hit_rate'] is not None and retrieval['hit_rate'] < swap_min_hit_rate:
+        problems.append(f"self-retrieval hit rate {retrieval['hit_rate']:.2f} is below {swap_min_hit_rate}")
+    return {
+        "ok": not problems,
+        "message": '; '.join(problems) or 'ok',
+        "dimension": dimension,
+        "vectors": new_count,
+        "previous_vectors": old_count,
+        "self_retrieval": retrieval
+    }
+
+def swap_reindexed(coll, source, target):
+    if coll.store_type == 'disk':
+        # 新快照写入集合自己的路径，之后的日志和快照由新存储继续
+        source.stop_background_snapshots()
+        if not source.save() or not target.save():
+            source.start_background_snapshots()
+            raise RuntimeError("Failed to save the index before swapping")
+        source.replace_snapshot(target)
+        target.start_background_snapshots()
+    # 文档和文本不变，备用索引继续使用
+    collections.swap_store(coll, target)
+
+# 只读实例重新加载写入进程保存的快照，校验后切换
+async def reload_collection(coll, job):
+    old = coll.store
+    new = await run_in_threadpool(collections.create_store, coll.config)
+    job['signature'] = new.loaded_signature
+    if new.loaded_signature is None:
+        raise RuntimeError(f"No snapshot found at {new.index_path}")
+    model = store_model(new)
+    job['model'] = model
+    job['validation'] = await run_in_threadpool(validate_swap, old, new, model, False)
+    if not job['validation']['ok']:
+        raise RuntimeError(job['validation']['message'])
+    fallback_store = await run_in_threadpool(build_fallback_store, coll.name, new)
+    collections.swap_store(coll, new, fallback_store)
+
+def job_running(name):
+    job = index_jobs.get(name)
+    return job is not None and job['state'] == 'running'
+
+# 启动后台索引任务；任务期间持有集合的引用，集合不会被淘汰
+async def start_index_job(name, kind, work, *args):
+    try:
+        coll = await run_in_threadpool(open_collection, name)
+    except ValueError as e:
+        return {"status": "error", "message": str(e)}
+    if coll is None:
+        return collection_error(name)
+    
+    if coll.store_type == 'milvus':
+        error = "Milvus collections are indexed by the Milvus server"
+    elif kind == 'reindex' and getattr(coll.store, 'read_only', False):
+        error = "Read-only collections cannot be reindexed, reindex on the writer and reload"
+    elif kind == 'reload' and not getattr(coll.store, 'read_only', False):
+        error = "Only read-only disk collections can be reloaded"
+    elif job_running(coll.name):
+        error = f"A {index_jobs[coll.name]['kind']} job is already running for collection {coll.name}"
+    else:
+        error = None
+    if error:
+        collections.release(coll)
+        return {"status": "error", "message": error}
+    
+    job = index_jobs[coll.name] = {
+        "collection": coll.name,
+        "kind": kind,
+        "state": 'running',
+        "phase": 'building' if kind == 'reindex' else 'loading',
+        "done": 0,
+        "total": None,
+        "started": time.time(),
+        "finished": None,
+        "error": None,
+        "validation": None
+    }
+    task = asyncio.create_task(run_index_job(coll, job, work, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    return {"status": "ok", "job": public_job(job)}
+
+async def run_index_job(coll, job, work, *args):
+    print(f"Started {job['kind']} of collection {coll.name}")
+    try:
+        await work(coll, job, *args)
+        job['state'] = 'done'
+        print(f"Finished {job['kind']} of collection {coll.name}")
     except Exception as e:
-        # 如果获取嵌入向量失败
-        print(f"Error getting embedding: {str(e)}")
-        return {"results": []}
+        job['state'] = 'failed'
+        job['error'] = str(e)
+        print(f"Error in {job['kind']} of collection {coll.name}: {str(e)}")
+        metrics.count_error(coll.store_type, job['kind'])
+    finally:
+        job['finished'] = time.time()
+        collections.release(coll)
+
+def public_job(job):
+    return {key: value for key, value in job.items() if key != 'signature'}
 
-# 初始化向量存储
+# 只读实例定期检查快照文件，写入进程保存新快照后自动重新加载；同一份快照校验失败后不再重试
+async def watch_snapshots():
+    while True:
+        await asyncio.sleep(snapshot_watch_interval)
+        for coll in collections.loaded():
+            store = coll.store
+            if not getattr(store, 'read_only', False) or not hasattr(store, 'snapshot_signature') or job_running(coll.name):
+                continue
+            try:
+                signature = await run_in_threadpool(store.snapshot_signature)
+            except OSError as e:
+                print(f"Error checking snapshot of collection {coll.name}: {str(e)}")
+                continue
+            last = index_jobs.get(coll.name)
+            if signature is None or signature == store.loaded_signature:
+                continue
+            if last is not None and last['state'] == 'failed' and last.get('signature') == signature:
+                continue
+            await start_index_job(coll.name, 'reload', reload_collection)
+
+@app.post("/admin/reindex")
+async def admin_reindex(payload: Optional[ReindexInput] = None, collection: Optional[str] = None):
+    # 用AI_MODEL（或指定的模型）在后台重建集合的索引，完成后无停机切换
+    model = (payload.model if payload is not None else None) or embedding_model
+    return await start_index_job(collection, 'reindex', reindex_collection, model)
+
+@app.post("/admin/reload")
+async def admin_reload(collection: Optional[str] = None):
+    # 只读实例立即重新加载最新的快照
+    return await start_index_job(collection, 'reload', reload_collection)
+
+@app.get("/admin/jobs")
+def admin_jobs():
+    return {"jobs": [public_job(job) for job in index_jobs.values()]}
+
+# 初始化默认集合的向量存储，配置来自环境变量（命令行参数会先写入环境变量）
 def init_vector_store(store_config=None):
-    global vector_store
-    
     # 使用提供的配置或默认配置
     config = store_config or DEFAULT_STORE_CONFIG
     
     # 从环境变量获取配置
     store_type = os.getenv('VECTOR_STORE_TYPE', config['type'])
     
-    # 根据存储类型创建向量存储
-    try:
-        if store_type == 'disk':
-            # 从配置或环境变量获取磁盘存储参数
-            index_path = os.getenv('VECTOR_STORE_DISK_INDEX_PATH', config['disk']['index_path'])
-            ids_path = os.getenv('VECTOR_STORE_DISK_IDS_PATH', config['disk']['ids_path'])
-            texts_path = os.getenv('VECTOR_STORE_DISK_TEXTS_PATH', config['disk']['texts_path'])
-            
-            # 确保数据目录存在
-            os.makedirs(os.path.dirname(index_path), exist_ok=True)
-            
-            # 创建磁盘存储实例
-            vector_store = create_vector_store(
-                store_type='disk',
-                index_path=index_path,
-                ids_path=ids_path,
-                texts_path=texts_path
-            )
-            
-            # 尝试加载已有的索引
-            vector_store.load()
-        elif store_type == 'milvus':
-            # 从配置或环境变量获取Milvus参数
-            host = os.getenv('VECTOR_STORE_MILVUS_HOST', config['milvus']['host'])
-            port = int(os.getenv('VECTOR_STORE_MILVUS_PORT', config['milvus']['port']))
-            collection_name = os.getenv('VECTOR_STORE_MILVUS_COLLECTION', config['milvus']['collection_name'])
-            
-            # 创建Milvus存储实例
-            vector_store = create_vector_store(
-                store_type='milvus',
-                host=host,
-                port=port,
-                collection_name=collection_name
-            )
-        else:
-            # 默认使用内存存储
-            vector_store = create_vector_store(store_type='memory')
-            
+    # FAISS存储的通用参数：压缩比例、索引类型及近似索引参数
+    store_options = {
+        'type': store_type,
+        'compact_ratio': float(os.getenv('VECTOR_STORE_COMPACT_RATIO', 0.2)),
+        'index_type': os.getenv('VECTOR_STORE_INDEX_TYPE', 'flat'),
+        'nlist': int(os.getenv('VECTOR_STORE_NLIST', 100)),
+        'nprobe': int(os.getenv('VECTOR_STORE_NPROBE', 10)),
+        'ef_search': int(os.getenv('VECTOR_STORE_EF_SEARCH', 64)),
+        'hnsw_m': int(os.getenv('VECTOR_STORE_HNSW_M', 32)),
+        'pq_m': int(os.getenv('VECTOR_STORE_PQ_M', 16)),
+        'train_threshold': int(os.getenv('VECTOR_STORE_TRAIN_THRESHOLD', 10000)),
+        # 向量的存储编码和PCA降维，与索引类型一样在达到train_threshold时生效
+        'encoding': os.getenv('VECTOR_STORE_ENCODING', 'float32'),
+        'pca_dim': int(os.getenv('VECTOR_STORE_PCA_DIM', 0)),
+        # 分片数大于1时按文档ID分片并行搜索；每次搜索使用的线程数和每个线程中FAISS的OpenMP线程数，0为按CPU数自动设置
+        'shards': int(os.getenv('VECTOR_STORE_SHARDS', 1)),
+        'shard_threads': int(os.getenv('VECTOR_STORE_SHARD_THREADS', 0)),
+        'shard_omp_threads': int(os.getenv('VECTOR_STORE_SHARD_OMP_THREADS', 0)),
+        # 从配置或环境变量获取磁盘存储参数，命名集合的文件路径在此基础上改为各自的目录
+        'index_path': os.getenv('VECTOR_STORE_DISK_INDEX_PATH', config['disk']['index_path']),
+        'ids_path': os.getenv('VECTOR_STORE_DISK_IDS_PATH', config['disk']['ids_path']),
+        'texts_path': os.getenv('VECTOR_STORE_DISK_TEXTS_PATH', config['disk']['texts_path']),
+        'wal_path': os.getenv('VECTOR_STORE_WAL_PATH') or None,
+        'wal_fsync': os.getenv('VECTOR_STORE_WAL_FSYNC', 'false').lower() in ('1', 'true', 'yes'),
+        'snapshot_interval': float(os.getenv('VECTOR_STORE_SNAPSHOT_INTERVAL', 300)),
+        'snapshot_wal_bytes': int(os.getenv('VECTOR_STORE_SNAPSHOT_WAL_BYTES', 64 * 1024 * 1024)),
+        # 以内存映射打开快照（启动耗时与文档数无关），只读模式用于多个worker共享同一份快照
+        'mmap': os.getenv('VECTOR_STORE_MMAP', 'false').lower() in ('1', 'true', 'yes'),
+        'read_only': os.getenv('VECTOR_STORE_READ_ONLY', 'false').lower() in ('1', 'true', 'yes'),
+        # 从配置或环境变量获取Milvus参数
+        'host': os.getenv('VECTOR_STORE_MILVUS_HOST', config['milvus']['host']),
+        'port': int(os.getenv('VECTOR_STORE_MILVUS_PORT', config['milvus']['port'])),
+        'collection_name': os.getenv('VECTOR_STORE_MILVUS_COLLECTION', config['milvus']['collection_name']),
+        # 设置后代替host和port，如Milvus Lite的本地文件路径
+        'uri': os.getenv('VECTOR_STORE_MILVUS_URI') or None,
+        # 写入缓冲：攒够该行数或等待该秒数后整批插入，0行表示每次直接写入
+        'insert_batch': int(os.getenv('VECTOR_STORE_MILVUS_INSERT_BATCH', 1000)),
+        'flush_interval': float(os.getenv('VECTOR_STORE_MILVUS_FLUSH_INTERVAL', 1.0))
+    }
+    
+    # 创建并加载default集合，磁盘存储会加载最近的快照并重放预写日志，然后启动后台快照
+    if collections.set_default(store_options):
         print(f"Initialized vector store: {store_type}")
         return True
-    except Exception as e:
-        print(f"Error initializing vector store: {str(e)}")
-        vector_store = None
-        return False
+    print("Error initializing vector store")
+    return False
+
+def ensure_vector_store():
+    with vector_store_init_lock:
+        if collections.default_config is None:
+            init_vector_store()
 
-# 保存向量存储数据
+# 保存所有已加载集合的数据
 def save_vector_store():
-    global vector_store
-    if vector_store is not None:
-        print("Saving vector store data...")
-        vector_store.save()
-        print("Vector store data saved.")
+    print("Saving vector store data...")
+    collections.close_all()
+    print("Vector store data saved.")
 
 # 添加服务器关闭时自动保存
 atexit.register(save_vector_store)
+atexit.register(embedding_cache.close)
 
 # 添加根路由
 def main():
     # 只有当直接运行脚本时才解析命令行参数
     parser = argparse.ArgumentParser(description='AI Vector Server')
     parser.add_argument('--env-path', type=str, default='../backend/.env', help='Path to .env file')
-    parser.add_argument('--api-key', type=str, help='OpenAI API Key')
-    parser.add_argument('--api-url', type=str, help='OpenAI API Base URL')
+    parser.add_argument('--api-key', type=str, help='Embedding API Key')
+    parser.add_argument('--api-url', type=str, help='OpenAI-compatible embedding API Base URL')
     parser.add_argument('--model', type=str, help='Embedding model name')
+    parser.add_argument('--embedding-batch-size', type=int, help='Number of texts per embeddings API request')
+    parser.add_argument('--embedding-batch-window-ms', type=float, help='Window for coalescing concurrent embedding requests')
     parser.add_argument('--port', type=int, default=9000, help='Server port')
     parser.add_argument('--store-type', type=str, choices=['memory', 'disk', 'milvus'], help='Vector store type')
+    parser.add_argument('--index-type', type=str, choices=['flat', 'ivf_flat', 'hnsw', 'ivf_pq'], help='FAISS index type (for memory/disk store)')
+    parser.add_argument('--nlist', type=int, help='Number of IVF cells (for ivf_flat/ivf_pq)')
+    parser.add_argument('--nprobe', type=int, help='Number of IVF cells probed per search (for ivf_flat/ivf_pq)')
+    parser.add_argument('--ef-search', type=int, help='HNSW efSearch (for hnsw)')
+    parser.add_argument('--hnsw-m', type=int, help='HNSW M (for hnsw)')
+    parser.add_argument('--pq-m', type=int, help='Number of PQ sub-quantizers (for ivf_pq)')
+    parser.add_argument('--train-threshold', type=int, help='Document count at which the flat index is migrated to the approximate index')
+    parser.add_argument('--encoding', type=str, choices=['float32', 'float16', 'sq8'], help='Vector encoding (for memory/disk store)')
+    parser.add_argument('--pca-dim', type=int, help='Reduce vectors to this dimension with PCA, 0 to disable (for memory/disk store)')
+    parser.add_argument('--shards', type=int, help='Number of FAISS shards searched in parallel (for memory/disk store)')
     parser.add_argument('--disk-index-path', type=str, help='Path to FAISS index file (for disk store)')
+    parser.add_argument('--mmap', action='store_true', help='Open the persisted index memory-mapped, loading it into memory on first write (for disk store)')
+    parser.add_argument('--read-only', action='store_true', help='Serve the persisted index memory-mapped and reject writes (for disk store)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of uvicorn worker processes (disk store must be read-only)')
     parser.add_argument('--milvus-host', type=str, help='Milvus server host (for Milvus store)')
     parser.add_argument('--milvus-port', type=int, help='Milvus server port (for Milvus store)')
+    parser.add_argument('--milvus-uri', type=str, help='Milvus URI, e.g. a Milvus Lite database file (for Milvus store)')
     args = parser.parse_args()
     
     # 如果提供了命令行参数，则覆盖默认配置
-    if args.api_key:
-        openai.api_key = args.api_key
-    if args.api_url:
-        openai.api_base = args.api_url
+    if args.api_key or args.api_url:
+        embedding_client.configure(base_url=args.api_url, api_key=args.api_key)
     if args.model:
         global embedding_model
         embedding_model = args.model
+    if args.embedding_batch_window_ms is not None:
+        embedding_batcher.window_ms = args.embedding_batch_window_ms
+    if args.embedding_batch_size:
+        global embedding_batch_size
+        embedding_batch_size = args.embedding_batch_size
+        embedding_batcher.max_batch = args.embedding_batch_size
     
     # 重新加载.env文件（如果路径有变化）
     if args.env_path != '../backend/.env':
@@ -252,17 +1033,43 @@ def main():
     # 根据命令行参数覆盖环境变量
     if args.store_type:
         os.environ['VECTOR_STORE_TYPE'] = args.store_type
+    for name in ['index_type', 'nlist', 'nprobe', 'ef_search', 'hnsw_m', 'pq_m', 'train_threshold', 'encoding', 'pca_dim', 'shards']:
+        value = getattr(args, name)
+        if value is not None:
+            os.environ[f'VECTOR_STORE_{name.upper()}'] = str(value)
     if args.disk_index_path:
         os.environ['VECTOR_STORE_DISK_INDEX_PATH'] = args.disk_index_path
+    if args.mmap:
+        os.environ['VECTOR_STORE_MMAP'] = 'true'
+    if args.read_only:
+        os.environ['VECTOR_STORE_READ_ONLY'] = 'true'
     if args.milvus_host:
         os.environ['VECTOR_STORE_MILVUS_HOST'] = args.milvus_host
     if args.milvus_port:
         os.environ['VECTOR_STORE_MILVUS_PORT'] = str(args.milvus_port)
+    if args.milvus_uri:
+        os.environ['VECTOR_STORE_MILVUS_URI'] = args.milvus_uri
+    
+    import uvicorn
+    if args.workers > 1:
+        # 每个worker是独立的进程，各自导入本模块并在第一个请求时初始化向量存储，配置只能通过环境变量传递。
+        # 磁盘存储的日志和快照只能由一个进程写入，多个worker只能以只读方式映射同一份快照，共享页缓存
+        store_type = os.getenv('VECTOR_STORE_TYPE', DEFAULT_STORE_CONFIG['type'])
+        read_only = os.getenv('VECTOR_STORE_READ_ONLY', 'false').lower() in ('1', 'true', 'yes')
+        if store_type == 'memory' or (store_type == 'disk' and not read_only):
+            print(f"Error: --workers requires the milvus store or a read-only disk store (--read-only), got {store_type}")
+            sys.exit(1)
+        for name, value in [('AI_API_URL', args.api_url), ('AI_API_KEY', args.api_key), ('AI_MODEL', args.model),
+                            ('EMBEDDING_BATCH_SIZE', args.embedding_batch_size),
+                            ('EMBEDDING_BATCH_WINDOW_MS', args.embedding_batch_window_ms)]:
+            if value is not None:
+                os.environ[name] = str(value)
+        uvicorn.run('server:app', host='0.0.0.0', port=args.port, workers=args.workers)
+        return
     
     # 初始化向量存储
     init_vector_store()
     
-    import uvicorn
     uvicorn.run(app, host='0.0.0.0', port=args.port)
 
 if __name__ == "__main__":
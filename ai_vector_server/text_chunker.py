@@ -0,0 +1,89 @@
+import re
+
+# 分块的向量ID：低40位为父文档ID，高位为分块序号。第0块的向量ID就是文档ID本身，
+# 未分块的旧数据无需迁移
+CHUNK_ID_SHIFT = 40
+CHUNK_ID_MASK = (1 << CHUNK_ID_SHIFT) - 1
+MAX_DOC_ID = 1 << CHUNK_ID_SHIFT
+
+def chunk_vector_id(doc_id, chunk_no):
+    return int(doc_id) | (int(chunk_no) << CHUNK_ID_SHIFT)
+
+def split_vector_id(vector_id):
+    # 返回(父文档ID, 分块序号)
+    vector_id = int(vector_id)
+    return vector_id & CHUNK_ID_MASK, vector_id >> CHUNK_ID_SHIFT
+
+# 句末标点（含紧随其后的引号、括号）及英文句点，优先在这些位置切分
+_SENTENCE_END = re.compile(r'(?:[。！？!?；;…\n]+|\.(?=\s))[”’」』）)"\']*')
+# 超长句子再按逗号、顿号、冒号切分
+_CLAUSE_END = re.compile(r'[，、,：:]+')
+
+# 中文文本分块：先按句子切分，超长句子再按分句切分，仍然超长的硬切；
+# 然后把相邻片段合并成不超过chunk_size个字符的块，相邻块之间按句子重叠约overlap个字符
+class TextChunker:
+    def __init__(self, chunk_size=500, overlap=50):
+        # chunk_size为0表示不分块
+        self.chunk_size = chunk_size
+        self.overlap = min(overlap, chunk_size // 2)
+
+    def split(self, text):
+        return list(self.iter_chunks(text))
+
+    def iter_chunks(self, text):
+        text = (text or '').strip()
+        if self.chunk_size <= 0 or len(text) <= self.chunk_size:
+            # 短文本（包括空文本）保持为一个块，与未分块时一致
+            yield text
+            return
+
+        current = []
+        length = 0
+        for piece in self._pieces(text):
+            if current and length + len(piece) > self.chunk_size:
+                chunk = ''.join(current).strip()
+                if chunk:
+                    yield chunk
+                current, length = self._overlap_tail(current)
+                if length + len(piece) > self.chunk_size:
+                    current, length = [], 0
+            current.append(piece)
+            length += len(piece)
+
+        chunk = ''.join(current).strip()
+        if chunk:
+            yield chunk
+
+    def _pieces(self, text):
+        for sentence in self._split_keep(_SENTENCE_END, text):
+            if len(sentence) <= self.chunk_size:
+                yield sentence
+                continue
+            for clause in self._split_keep(_CLAUSE_END, sentence):
+                for start in range(0, len(clause), self.chunk_size):
+                    yield clause[start:start + self.chunk_size]
+
+    @staticmethod
+    def _split_keep(pattern, text):
+        # 切分后标点留在前一段的末尾
+        start = 0
+        for match in pattern.finditer(text):
+            if match.end() > start:
+                yield text[start:match.end()]
+                start = match.end()
+        if start < len(text):
+            yield text[start:]
+
+    def _overlap_tail(self, pieces):
+        # 从上一块末尾取不超过overlap个字符的完整句子作为下一块的开头；
+        # 最后一句本身就超过overlap时不重叠，避免产生以半句话开头的碎块
+        if self.overlap <= 0:
+            return [], 0
+        tail = []
+        length = 0
+        for piece in reversed(pieces):
+            if length + len(piece) > self.overlap:
+                break
+            tail.insert(0, piece)
+            length += len(piece)
+        return tail, length
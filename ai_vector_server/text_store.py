@@ -0,0 +1,106 @@
+import mmap
+import os
+from array import array
+from collections.abc import Mapping
+import numpy as np
+
+# 紧凑的文档文本存储：所有文本按UTF-8拼接成一个连续的二进制文件，
+# 另用uint64偏移数组（n+1项）记录每条文本的起止位置，两者都以内存映射方式打开，
+# 只在读取某条文本时才解码，文本不占用Python堆内存。
+# 快照之后新写入的文本暂存在内存中的tail列表，下一次快照时写入文件
+class MmapTextStore:
+    def __init__(self, blob_path=None, offsets_path=None):
+        self.blob = None
+        self.offsets = np.zeros(1, dtype='uint64')
+        self.base_count = 0
+        self.tail = []
+        if blob_path and offsets_path and os.path.exists(blob_path) and os.path.exists(offsets_path):
+            self._open(blob_path, offsets_path)
+
+    def _open(self, blob_path, offsets_path):
+        self.offsets = np.load(offsets_path, mmap_mode='r')
+        self.base_count = len(self.offsets) - 1
+        # 空文件无法映射
+        if os.path.getsize(blob_path) > 0:
+            with open(blob_path, 'rb') as f:
+                self.blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return self.base_count + len(self.tail)
+
+    def __getitem__(self, position):
+        if position < self.base_count:
+            start, end = int(self.offsets[position]), int(self.offsets[position + 1])
+            if start == end:
+                return ''
+            return self.blob[start:end].decode('utf-8')
+        return self.tail[position - self.base_count]
+
+    def __setitem__(self, position, text):
+        # 文件中的文本不可修改，只释放tail中已删除的文本
+        if position >= self.base_count:
+            self.tail[position - self.base_count] = text
+
+    def append(self, text):
+        self.tail.append(text)
+
+    def copy(self):
+        # 共享只读的文件映射，复制可变的tail，供快照在锁外读取写锁下的状态
+        texts = MmapTextStore()
+        texts.blob = self.blob
+        texts.offsets = self.offsets
+        texts.base_count = self.base_count
+        texts.tail = list(self.tail)
+        return texts
+
+    def close(self):
+        if self.blob is not None:
+            self.blob.close()
+            self.blob = None
+
+    @staticmethod
+    def write(blob_path, offsets_path, texts):
+        # 流式写入，不在内存中拼接整个语料
+        offsets = array('Q', [0])
+        with open(blob_path, 'wb') as f:
+            for text in texts:
+                data = (text or '').encode('utf-8')
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+            f.flush()
+            os.fsync(f.fileno())
+        with open(offsets_path, 'wb') as f:
+            np.save(f, np.frombuffer(offsets, dtype='uint64'))
+            f.flush()
+            os.fsync(f.fileno())
+        return len(offsets) - 1
+
+# 快照中的doc_id按升序保存，文本按同样的顺序写入，doc_id在ID数组中的下标就是文本位置。
+# 以内存映射打开ID数组后用二分查找定位，启动时无需为全部文档构建字典；只读，写入前需转换为dict
+class SortedIdPositions(Mapping):
+    def __init__(self, ids):
+        self.ids = ids
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __iter__(self):
+        return iter(self.ids.tolist())
+
+    def get(self, doc_id, default=None):
+        position = int(np.searchsorted(self.ids, doc_id))
+        if position < len(self.ids) and self.ids[position] == doc_id:
+            return position
+        return default
+
+    def __getitem__(self, doc_id):
+        position = self.get(doc_id)
+        if position is None:
+            raise KeyError(doc_id)
+        return position
+
+    def __contains__(self, doc_id):
+        return self.get(doc_id) is not None
+
+    def to_dict(self):
+        return dict(zip(self.ids.tolist(), range(len(self.ids))))
@@ -1,19 +1,60 @@
 import abc
+import contextlib
+import contextvars
+import heapq
+import itertools
+import json
+import math
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 import faiss
 from pathlib import Path
+from wal import WriteAheadLog, OP_ADD, OP_DELETE
+from text_store import MmapTextStore, SortedIdPositions
+from rwlock import RWLock
+from lexical_index import LexicalIndex
+from metadata_store import MetadataTable
+from text_chunker import chunk_vector_id, split_vector_id, CHUNK_ID_SHIFT
+from metrics import stage_timer, count_error, run_timed, merge_parallel_timings
 
 # 向量存储抽象基类
 class VectorStore(abc.ABC):
+    # 写入代数：每次添加或删除后递增，查询结果缓存据此判断缓存的结果是否过期
+    generation = 0
+    
     @abc.abstractmethod
     def add_vector(self, vector, doc_id, text):
         pass
     
+    def add_vectors(self, vectors, doc_ids, texts, metadata=None):
+        # 默认逐条添加，子类可覆盖为批量实现；metadata为{父文档ID: 元数据}，不支持元数据的存储忽略
+        for vector, doc_id, text in zip(vectors, doc_ids, texts):
+            if not self.add_vector(vector, doc_id, text):
+                return False
+        return True
+    
+    def update_vector(self, vector, doc_id, text):
+        # 默认先删除再添加，子类可覆盖为原子的覆盖写入
+        self.delete_vector(doc_id)
+        return self.add_vector(vector, doc_id, text)
+    
+    @abc.abstractmethod
+    def delete_vector(self, doc_id):
+        pass
+    
     @abc.abstractmethod
-    def search_vectors(self, query_vector, top_k):
+    def search_vectors(self, query_vector, top_k, max_distance=None, min_score=None):
         pass
     
+    def search_batch(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
+        # 默认逐条搜索，子类可覆盖为一次批量搜索；filters为parse_filter规范化后的元数据过滤条件
+        if filters is not None:
+            raise ValueError(f"Metadata filters are not supported by the {self.store_label} store")
+        return [self.search_vectors(query_vector, top_k, max_distance, min_score) for query_vector in query_vectors]
+    
     @abc.abstractmethod
     def save(self):
         pass
@@ -22,39 +63,676 @@ class VectorStore(abc.ABC):
     def load(self):
         pass
 
+# L2距离转换为(0, 1]区间的相似度分数，距离越小分数越高
+def distance_to_score(distance):
+    return 1.0 / (1.0 + max(float(distance), 0.0))
+
+# 文档分块后同一文档可能有多个分块命中，搜索时多取候选再按父文档去重
+CHUNK_OVERSAMPLE = 4
+
+def collapse_chunks(hits, top_k):
+    # 命中结果已按相关度排序，每个父文档只保留最相关的分块
+    seen = set()
+    collapsed = []
+    for hit in hits:
+        if hit['doc_id'] in seen:
+            continue
+        seen.add(hit['doc_id'])
+        collapsed.append(hit)
+        if len(collapsed) >= top_k:
+            break
+    return collapsed
+
+def make_hit(distance, vector_id, text):
+    doc_id, chunk_no = split_vector_id(vector_id)
+    return {
+        "doc_id": doc_id,
+        "chunk": chunk_no,
+        "text": text,
+        "distance": float(distance),
+        "score": distance_to_score(distance)
+    }
+
+# 按距离上限和分数下限过滤命中结果
+def passes_cutoff(distance, max_distance=None, min_score=None):
+    if max_distance is not None and distance > max_distance:
+        return False
+    if min_score is not None and distance_to_score(distance) < min_score:
+        return False
+    return True
+
+# 元数据过滤：编译结果按过滤条件缓存，写入后失效。符合条件的向量不超过FILTER_EXACT_VECTORS个时
+# 取回这些向量精确计算距离；否则在近似索引中带过滤器搜索，并按符合比例放大nprobe/efSearch，
+# 避免被排除的候选占满搜索范围、返回的结果不足top_k
+FILTER_CACHE_SIZE = 64
+FILTER_EXACT_VECTORS = 4096
+FILTER_MAX_EF_SEARCH = 4096
+
+class CompiledFilter:
+    def __init__(self, vector_ids):
+        self.vector_ids = vector_ids
+        self.selector = faiss.IDSelectorBatch(vector_ids) if len(vector_ids) else None
+        self.allowed = None
+    
+    def allowed_ids(self):
+        # 词法搜索使用的集合，第一次用到时才生成
+        if self.allowed is None:
+            self.allowed = set(self.vector_ids.tolist())
+        return self.allowed
+
+# 支持的FAISS索引类型
+INDEX_TYPES = ['flat', 'ivf_flat', 'hnsw', 'ivf_pq']
+# 向量的存储编码：float32原样保存，float16半精度（内存减半），sq8每维1字节的标量量化（内存为1/4）
+ENCODINGS = {'float32': 'Flat', 'float16': 'SQfp16', 'sq8': 'SQ8'}
+
 # FAISS内存存储实现
+# 索引使用IndexIDMap2，以doc_id作为向量ID，支持按ID删除和覆盖写入；
+# 文本按写入位置保存在doc_texts中，doc_positions记录doc_id到位置的映射。
+# 非flat索引（IVF/HNSW/PQ）以及降低精度的编码（float16/sq8）、PCA降维先以精确的flat索引起步，
+# 文档数达到train_threshold后自动训练并迁移；PCA矩阵和量化参数保存在索引内部，查询向量按同样的方式变换。
+# 这类索引无法安全地按ID删除，删除和覆盖写入会把旧向量所在的内部行标记为墓碑，
+# 搜索时通过IDSelector排除，压缩时重建索引真正回收
 class FAISSMemoryStore(VectorStore):
-    def __init__(self):
+    store_label = 'memory'
+    
+    def __init__(self, compact_ratio=0.2, index_type='flat', nlist=100, nprobe=10,
+                 ef_search=64, hnsw_m=32, pq_m=16, train_threshold=10000, lexical=True,
+                 encoding='float32', pca_dim=0):
+        if index_type not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type: {index_type}")
+        if encoding not in ENCODINGS:
+            raise ValueError(f"Unsupported vector encoding: {encoding}")
+        if index_type == 'ivf_pq' and encoding != 'float32':
+            # PQ本身就是压缩编码，encoding对它不生效
+            print(f"Warning: encoding={encoding} is ignored for ivf_pq")
+        
         self.index = None
         self.vector_dimension = None
-        self.doc_ids = []
         self.doc_texts = []
+        self.doc_positions = {}
+        # 已删除但尚未回收的文本位置数量，超过compact_ratio比例时触发压缩
+        self.dead_count = 0
+        self.compact_ratio = compact_ratio
+        
+        # 索引类型及参数
+        self.index_type = index_type
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.ef_search = ef_search
+        self.hnsw_m = hnsw_m
+        self.pq_m = pq_m
+        self.train_threshold = train_threshold
+        # 向量编码和PCA降维后的维度（0表示不降维）
+        self.encoding = encoding
+        self.pca_dim = pca_dim
+        
+        # 近似索引中已失效的内部行号及对应的搜索过滤器
+        self.dead_rows = set()
+        self.dead_selector = None
+        # 最近一次迁移到近似索引时相对flat基线测得的召回率
+        self.last_recall = None
+        # 生成索引中向量所用的嵌入模型，由服务在写入时记录；查询必须使用同一模型
+        self.embedding_model = None
+        
+        # 文本的BM25词法索引，随文档增删同步维护
+        self.lexical = LexicalIndex() if lexical else None
+        # 多于一个分块的文档：父文档ID -> 分块数（单块文档不记录）
+        self.chunk_counts = {}
+        # 按列保存的父文档元数据，以及编译后的过滤条件缓存（写入时清空）
+        self.metadata = MetadataTable()
+        self.filter_cache = {}
+        
+        # 搜索持有读锁可以并行执行（FAISS搜索期间释放GIL），写操作持有写锁独占执行，
+        # 搜索不会看到索引行与doc_positions、doc_texts不一致的中间状态
+        self.lock = RWLock()
     
-    def add_vector(self, vector, doc_id, text):
-        # 动态初始化索引
+    def _create_index(self, dimension):
+        self.vector_dimension = dimension
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatL2(dimension))
+        print(f"Initialized FAISS {self.store_label} index with dimension: {dimension}")
+    
+    def _inner_index(self):
+        return faiss.downcast_index(self.index.index)
+    
+    def _core_index(self):
+        # PCA降维的索引外层是IndexPreTransform，IVF/HNSW参数设置在内层索引上
+        inner = self._inner_index()
+        if isinstance(inner, faiss.IndexPreTransform):
+            return faiss.downcast_index(inner.index)
+        return inner
+    
+    def is_approximate(self):
+        return self.index is not None and not isinstance(self._inner_index(), faiss.IndexFlat)
+    
+    def _targets_flat(self):
+        # 配置的目标索引就是精确的float32 flat索引，无需训练和迁移
+        return self.index_type == 'flat' and self.encoding == 'float32' and not self.pca_dim
+    
+    def _check_matrix(self, matrix):
+        # 返回批次矩阵的问题描述，没有问题返回None
+        if matrix.ndim != 2:
+            return f"expected a 2-D matrix, got shape {matrix.shape}"
+        if self.vector_dimension and matrix.shape[1] != self.vector_dimension:
+            return f"vector dimension {matrix.shape[1]} does not match index dimension {self.vector_dimension}"
+        return None
+    
+    def bytes_per_vector(self):
+        # 每个向量编码占用的字节数，不含ID映射和HNSW图等结构
         if self.index is None:
-            self.vector_dimension = len(vector)
-            self.index = faiss.IndexFlatL2(self.vector_dimension)
-            print(f"Initialized FAISS memory index with dimension: {self.vector_dimension}")
+            return None
+        core = self._core_index()
+        if isinstance(core, faiss.IndexHNSW):
+            core = faiss.downcast_index(core.storage)
+        return getattr(core, 'code_size', None)
+    
+    def add_vector(self, vector, doc_id, text):
+        return self.add_vectors(np.array([vector]), [doc_id], [text])
+    
+    def add_vectors(self, vectors, doc_ids, texts, metadata=None):
+        with self.lock.write_lock():
+            if len(vectors) == 0:
+                return True
+            
+            # 整批转换为连续的float32矩阵，一次性写入索引
+            matrix = np.ascontiguousarray(vectors, dtype='float32')
+            # 形状不对的批次在修改任何状态前拒绝，避免删除了旧向量却写不进新向量
+            error = self._check_matrix(matrix)
+            if error:
+                print(f"Error adding vectors: {error}")
+                return False
+            doc_ids = [int(doc_id) for doc_id in doc_ids]
+            texts = list(texts)
+            
+            # 同一批中重复的doc_id只保留最后一条
+            if len(set(doc_ids)) != len(doc_ids):
+                last = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+                keep = sorted(last.values())
+                matrix = matrix[keep]
+                doc_ids = [doc_ids[i] for i in keep]
+                texts = [texts[i] for i in keep]
+            
+            if self.index is None:
+                self._create_index(matrix.shape[1])
+            
+            # 已存在的文档先删除旧向量，实现覆盖写入；按父文档整体替换，旧版本多出的分块一并删除
+            new_counts = {}
+            for doc_id in doc_ids:
+                parent, chunk_no = split_vector_id(doc_id)
+                new_counts[parent] = max(new_counts.get(parent, 0), chunk_no + 1)
+            stale = [
+                chunk_vector_id(parent, chunk_no)
+                for parent, count in new_counts.items()
+                for chunk_no in range(count, self.chunk_counts.get(parent, 1))
+            ]
+            self._remove_docs([doc_id for doc_id in doc_ids + stale if doc_id in self.doc_positions])
+            for parent, count in new_counts.items():
+                if count > 1:
+                    self.chunk_counts[parent] = count
+                else:
+                    self.chunk_counts.pop(parent, None)
+                # 元数据随文档整体替换，没有传入的文档清除旧的元数据
+                self.metadata.set(parent, (metadata or {}).get(parent))
+            self.filter_cache = {}
+            self.generation += 1
+            
+            self.index.add_with_ids(matrix, np.array(doc_ids, dtype='int64'))
+            for doc_id, text in zip(doc_ids, texts):
+                self.doc_positions[doc_id] = len(self.doc_texts)
+                self.doc_texts.append(text)
+                if self.lexical is not None:
+                    self.lexical.add(doc_id, text)
+            
+            self._maybe_compact()
+            self._maybe_train()
+            return True
+    
+    def update_vector(self, vector, doc_id, text):
+        # add_vector本身就是覆盖写入
+        return self.add_vector(vector, doc_id, text)
+    
+    def delete_vector(self, doc_id):
+        with self.lock.write_lock():
+            doc_id = int(doc_id)
+            if doc_id not in self.doc_positions:
+                return False
+            
+            # 删除文档时删除它的全部分块和元数据
+            count = self.chunk_counts.pop(doc_id, 1)
+            self.metadata.remove(doc_id)
+            self.filter_cache = {}
+            self.generation += 1
+            chunk_ids = [chunk_vector_id(doc_id, chunk_no) for chunk_no in range(count)]
+            self._remove_docs([chunk_id for chunk_id in chunk_ids if chunk_id in self.doc_positions])
+            self._maybe_compact()
+            return True
+    
+    def _remove_docs(self, doc_ids):
+        if not doc_ids:
+            return
         
-        self.index.add(np.array([vector]))
-        self.doc_ids.append(doc_id)
-        self.doc_texts.append(text)
-        return True
+        ids = np.array(doc_ids, dtype='int64')
+        if self.is_approximate():
+            # 近似索引只标记墓碑，压缩时重建
+            labels = faiss.vector_to_array(self.index.id_map)
+            self.dead_rows.update(np.nonzero(np.isin(labels, ids))[0].tolist())
+            self._refresh_dead_selector()
+        else:
+            self.index.remove_ids(ids)
+        
+        for doc_id in doc_ids:
+            position = self.doc_positions.pop(doc_id)
+            if self.lexical is not None:
+                self.lexical.remove(doc_id, self.doc_texts[position])
+            self.doc_texts[position] = None
+            self.dead_count += 1
     
-    def search_vectors(self, query_vector, top_k):
+    def _refresh_dead_selector(self):
+        if not self.dead_rows:
+            self.dead_selector = None
+            return
+        rows = np.array(sorted(self.dead_rows), dtype='int64')
+        # IDSelectorNot不持有被包装对象，需要同时保留两者的引用
+        batch = faiss.IDSelectorBatch(rows)
+        self.dead_selector = (faiss.IDSelectorNot(batch), batch)
+    
+    def _maybe_compact(self):
+        if self.dead_count > 0 and self.dead_count >= self.compact_ratio * len(self.doc_texts):
+            self.compact()
+        elif self.dead_rows and len(self.dead_rows) >= self.compact_ratio * self.index.ntotal:
+            self.compact()
+    
+    def compact(self):
+        with self.lock.write_lock():
+            if self.dead_count:
+                self._compact_texts()
+            if self.dead_rows:
+                self._rebuild_index()
+    
+    def _compact_texts(self):
+        # 回收已删除文档占用的文本位置，使存储大小与有效文档数一致
+        live = sorted(self.doc_positions.items(), key=lambda item: item[1])
+        self.doc_texts = [self.doc_texts[position] for _, position in live]
+        self.doc_positions = {doc_id: i for i, (doc_id, _) in enumerate(live)}
+        self.dead_count = 0
+    
+    def _rebuild_index(self):
+        # 复制已训练好的索引结构，只写回仍然有效的行
+        inner = self._inner_index()
+        labels = faiss.vector_to_array(self.index.id_map)
+        live_rows = np.setdiff1d(np.arange(self.index.ntotal), np.array(sorted(self.dead_rows), dtype='int64'))
+        vectors = inner.reconstruct_n(0, inner.ntotal)[live_rows]
+        
+        rebuilt = faiss.clone_index(inner)
+        rebuilt.reset()
+        self.index = faiss.IndexIDMap2(rebuilt)
+        self.index.add_with_ids(vectors, labels[live_rows])
+        self._apply_search_params()
+        
+        print(f"Rebuilt FAISS {self.index_type} index: removed {len(self.dead_rows)} stale vectors")
+        self.dead_rows = set()
+        self.dead_selector = None
+    
+    def _effective_train_threshold(self):
+        # 不需要训练的目标索引（flat索引的float16编码）在第一次写入时直接迁移
+        if self.index_type == 'flat' and self.encoding == 'float16' and not self.pca_dim:
+            return 0
+        # IVF至少需要nlist个训练点，PQ的每个子量化器需要256个，PCA至少需要与输出维度相同的训练点
+        threshold = self.train_threshold
+        if self.index_type in ('ivf_flat', 'ivf_pq'):
+            threshold = max(threshold, self.nlist)
+        if self.index_type == 'ivf_pq':
+            threshold = max(threshold, 256)
+        if self.pca_dim:
+            threshold = max(threshold, self.pca_dim)
+        return threshold
+    
+    def _maybe_train(self):
+        if self._targets_flat() or self.is_approximate():
+            return False
+        if self.index.ntotal >= self._effective_train_threshold():
+            self.migrate_to_ann()
+            return True
+        return False
+    
+    def _factory_string(self, dimension):
+        # PCA降维作为前置变换，之后的索引结构和编码都在降维后的空间中
+        prefix = ''
+        if self.pca_dim and self.pca_dim < dimension:
+            prefix = f"PCA{self.pca_dim},"
+            dimension = self.pca_dim
+        elif self.pca_dim:
+            print(f"Warning: pca_dim={self.pca_dim} is not smaller than dimension {dimension}, PCA disabled")
+        
+        code = ENCODINGS[self.encoding]
+        if self.index_type == 'flat':
+            return prefix + code
+        if self.index_type == 'ivf_flat':
+            return f"{prefix}IVF{self.nlist},{code}"
+        if self.index_type == 'hnsw':
+            return f"{prefix}HNSW{self.hnsw_m}" + ('' if code == 'Flat' else f"_{code}")
+        
+        # PQ子量化器数量必须整除向量维度
+        pq_m = max(m for m in range(1, min(self.pq_m, dimension) + 1) if dimension % m == 0)
+        if pq_m != self.pq_m:
+            print(f"Warning: pq_m={self.pq_m} does not divide dimension {dimension}, using {pq_m}")
+        return f"{prefix}IVF{self.nlist},PQ{pq_m}"
+    
+    def migrate_to_ann(self):
+        with self.lock.write_lock():
+            # flat索引中的向量是精确值，用它们训练近似索引并作为召回率基线
+            flat_index = self.index
+            labels = faiss.vector_to_array(flat_index.id_map).copy()
+            vectors = self._inner_index().reconstruct_n(0, flat_index.ntotal)
+            
+            factory = self._factory_string(self.vector_dimension)
+            ann = faiss.index_factory(self.vector_dimension, factory)
+            if not ann.is_trained:
+                print(f"Training FAISS {self.index_type} index on {len(vectors)} vectors")
+                ann.train(vectors)
+            
+            self.index = faiss.IndexIDMap2(ann)
+            self._apply_search_params()
+            self.index.add_with_ids(vectors, labels)
+            
+            self.last_recall = self._measure_recall(flat_index, vectors, k=10, num_queries=100)
+            # 记录编码前后每个向量占用的字节数，与召回率一起衡量压缩的代价
+            self.last_recall["factory"] = factory
+            self.last_recall["bytes_per_vector"] = {"before": self.vector_dimension * 4, "after": self.bytes_per_vector()}
+            print(
+                f"Migrated FAISS index to {self.index_type} ({factory}), "
+                f"recall@10 vs flat: {self.last_recall['recall']:.4f}, "
+                f"bytes per vector: {self.vector_dimension * 4} -> {self.bytes_per_vector()}"
+            )
+    
+    def _apply_search_params(self):
         if self.index is None:
+            return
+        inner = self._core_index()
+        if isinstance(inner, faiss.IndexIVF):
+            inner.nprobe = self.nprobe
+            # 墓碑重建时需要按内部行号取回向量
+            if inner.direct_map.type == faiss.DirectMap.NoMap:
+                inner.make_direct_map()
+        elif isinstance(inner, faiss.IndexHNSW):
+            inner.hnsw.efSearch = self.ef_search
+    
+    def _search_parameters(self, selector, matched=None):
+        # matched为过滤后符合条件的向量数：搜索范围按符合比例的倒数放大，通过过滤的候选数与不过滤时相当
+        inner = self._core_index()
+        scale = self.index.ntotal / matched if matched else 1.0
+        if isinstance(inner, faiss.IndexIVF):
+            # IVF先检查过滤器再计算距离，多探查的簇只增加被过滤掉的向量的检查开销
+            return faiss.SearchParametersIVF(sel=selector, nprobe=min(inner.nlist, math.ceil(self.nprobe * scale)))
+        if isinstance(inner, faiss.IndexHNSW):
+            return faiss.SearchParametersHNSW(sel=selector, efSearch=min(max(self.ef_search, FILTER_MAX_EF_SEARCH), math.ceil(self.ef_search * scale)))
+        return faiss.SearchParameters(sel=selector)
+    
+    def _compile_filter(self, filters):
+        # 过滤条件 -> 符合条件的全部向量ID（含分块）及FAISS的IDSelector，同一条件在下次写入前复用
+        compiled = self.filter_cache.get(filters)
+        if compiled is not None:
+            return compiled
+        parents = self.metadata.match(filters)
+        vector_ids = [parents]
+        for parent in parents.tolist():
+            count = self.chunk_counts.get(parent, 1)
+            if count > 1:
+                vector_ids.append(np.array([chunk_vector_id(parent, chunk_no) for chunk_no in range(1, count)], dtype='int64'))
+        compiled = CompiledFilter(np.concatenate(vector_ids))
+        if len(self.filter_cache) >= FILTER_CACHE_SIZE:
+            self.filter_cache.pop(next(iter(self.filter_cache)), None)
+        self.filter_cache[filters] = compiled
+        return compiled
+    
+    def _search_index(self, queries, top_k, compiled=None):
+        if compiled is not None:
+            return self._search_filtered(queries, top_k, compiled)
+        if self.dead_selector is None:
+            return self.index.search(queries, top_k)
+        
+        # 存在墓碑时直接搜索内部索引并排除失效行，再把内部行号转换为doc_id
+        selector = self.dead_selector[0]
+        return self._search_rows(queries, top_k, self._search_parameters(selector))
+    
+    def _search_filtered(self, queries, top_k, compiled):
+        matched = len(compiled.vector_ids)
+        if matched <= FILTER_EXACT_VECTORS:
+            # 符合条件的向量很少：直接取回这些向量精确计算距离，比带过滤器遍历整个索引更快也更准确
+            vectors = self.index.reconstruct_batch(compiled.vector_ids)
+            D, positions = faiss.knn(queries, vectors, min(top_k, matched))
+            return D, compiled.vector_ids[positions]
+        if self.dead_selector is None:
+            # IndexIDMap2把过滤器中的向量ID转换为内部行号后交给内部索引
+            return self.index.search(queries, top_k, params=self._search_parameters(compiled.selector, matched))
+        translated = faiss.IDSelectorTranslated(self.index.id_map, compiled.selector)
+        selector = faiss.IDSelectorAnd(self.dead_selector[0], translated)
+        return self._search_rows(queries, top_k, self._search_parameters(selector, matched))
+    
+    def _search_rows(self, queries, top_k, params):
+        D, rows = self._inner_index().search(queries, top_k, params=params)
+        id_map = self.index.id_map
+        labels = np.array([[id_map.at(int(row)) if row >= 0 else -1 for row in row_list] for row_list in rows], dtype='int64')
+        return D, labels
+    
+    def _measure_recall(self, exact_index, vectors, k, num_queries):
+        # 以库中向量作为查询，比较近似索引与精确索引的top-k重合比例
+        rng = np.random.default_rng(0)
+        sample = rng.choice(len(vectors), size=min(num_queries, len(vectors)), replace=False)
+        queries = vectors[sample]
+        _, expected = exact_index.search(queries, k)
+        _, actual = self._search_index(queries, k)
+        
+        hits = 0
+        total = 0
+        for expected_row, actual_row in zip(expected, actual):
+            expected_ids = set(int(i) for i in expected_row if i >= 0)
+            hits += len(expected_ids & set(int(i) for i in actual_row))
+            total += len(expected_ids)
+        return {
+            "index_type": self.index_type,
+            "encoding": self.encoding,
+            "pca_dim": self.pca_dim,
+            "k": k,
+            "num_queries": len(sample),
+            "recall": hits / total if total else 1.0
+        }
+    
+    def _reconstructs_exactly(self):
+        # 只有float32编码、未降维的IVF/HNSW索引能取回原始向量；PQ、sq8、float16编码和PCA降维后
+        # 取回的是近似向量，不能作为召回率的基线
+        if isinstance(self._inner_index(), faiss.IndexPreTransform):
+            return False
+        core = self._core_index()
+        if isinstance(core, faiss.IndexHNSW):
+            return isinstance(faiss.downcast_index(core.storage), faiss.IndexFlat)
+        return isinstance(core, faiss.IndexIVFFlat)
+    
+    def evaluate_recall(self, k=10, num_queries=100):
+        with self.lock.read_lock():
+            if self.index is None or self.count() == 0:
+                return {"index_type": self.index_type, "k": k, "num_queries": 0, "recall": None}
+            if not self.is_approximate():
+                return {"index_type": 'flat', "k": k, "num_queries": 0, "recall": 1.0}
+            if not self._reconstructs_exactly():
+                # 原始向量已不在索引中，无法在线计算基线，返回迁移时相对原始float32向量测得的召回率
+                if self.last_recall is None:
+                    return {"index_type": self.index_type, "k": k, "num_queries": 0, "recall": None, "baseline": None}
+                return dict(self.last_recall, baseline='migration')
+            
+            # 用索引中取回的有效向量建立flat基线
+            labels, vectors = self._export_vectors()
+            exact_index = faiss.IndexIDMap2(faiss.IndexFlatL2(self.vector_dimension))
+            exact_index.add_with_ids(vectors, labels)
+            return dict(self._measure_recall(exact_index, vectors, k, num_queries), baseline='live')
+    
+    def sample_vectors(self, num_queries):
+        # 随机抽取文档，返回(向量ID列表, 从索引中取回的向量)
+        with self.lock.read_lock():
+            if self.index is None or self.count() == 0:
+                return [], None
+            vector_ids = list(self.doc_positions)
+            rng = np.random.default_rng(0)
+            sample = [vector_ids[i] for i in rng.choice(len(vector_ids), size=min(num_queries, len(vector_ids)), replace=False)]
+            return sample, np.vstack([self.index.reconstruct(int(vector_id)) for vector_id in sample])
+    
+    def export_vectors(self):
+        # 全部有效向量及其向量ID（近似索引取回的是编码后的近似向量）
+        with self.lock.read_lock():
+            if self.index is None:
+                return np.zeros(0, dtype='int64'), None
+            return self._export_vectors()
+    
+    def _export_vectors(self):
+        labels = faiss.vector_to_array(self.index.id_map)
+        live_rows = np.setdiff1d(np.arange(self.index.ntotal), np.array(sorted(self.dead_rows), dtype='int64'))
+        return labels[live_rows], self._inner_index().reconstruct_n(0, self.index.ntotal)[live_rows]
+    
+    def check_self_retrieval(self, num_queries=20, k=10):
+        # 用随机抽取的文档自身的向量搜索，检查能否找回该文档；用于切换索引前的完整性检查
+        sample, queries = self.sample_vectors(num_queries)
+        if not sample:
+            return {"num_queries": 0, "hits": 0, "hit_rate": None}
+        
+        hits = 0
+        for vector_id, results in zip(sample, self.search_batch(queries, k)):
+            doc_id, _ = split_vector_id(vector_id)
+            hits += any(hit['doc_id'] == doc_id for hit in results)
+        return {"num_queries": len(sample), "hits": hits, "hit_rate": hits / len(sample)}
+    
+    def index_info(self):
+        with self.lock.read_lock():
+            return {
+                "store": self.store_label,
+                "index_type": self.index_type,
+                "active_index": 'none' if self.index is None else (self.index_type if self.is_approximate() else 'flat'),
+                "dimension": self.vector_dimension,
+                "embedding_model": self.embedding_model,
+                "encoding": self.encoding if self.is_approximate() else 'float32',
+                "pca_dim": self.pca_dim,
+                "bytes_per_vector": self.bytes_per_vector(),
+                "documents": self.count() - sum(count - 1 for count in self.chunk_counts.values()),
+                "chunks": self.count(),
+                "vectors": 0 if self.index is None else self.index.ntotal,
+                "stale_vectors": len(self.dead_rows),
+                "lexical_terms": None if self.lexical is None else len(self.lexical.postings),
+                # 有元数据的文档数，以及各字段的不同取值数
+                "metadata_documents": len(self.metadata),
+                "metadata_fields": self.metadata.fields(),
+                "train_threshold": self._effective_train_threshold(),
+                "params": {
+                    "nlist": self.nlist,
+                    "nprobe": self.nprobe,
+                    "ef_search": self.ef_search,
+                    "hnsw_m": self.hnsw_m,
+                    "pq_m": self.pq_m
+                },
+                "last_recall": self.last_recall
+            }
+    
+    def count(self):
+        return len(self.doc_positions)
+    
+    def doc_ids(self):
+        with self.lock.read_lock():
+            return list(self.doc_positions)
+    
+    def get_metadata(self, doc_ids):
+        # 按父文档ID取回元数据，没有元数据的文档不出现在结果中
+        with self.lock.read_lock():
+            metadata = {}
+            for doc_id in doc_ids:
+                values = self.metadata.get(int(doc_id))
+                if values is not None:
+                    metadata[int(doc_id)] = values
+            return metadata
+    
+    def get_texts(self, doc_ids):
+        # 按doc_id取回文本，不存在的文档不出现在结果中
+        with self.lock.read_lock():
+            texts = {}
+            for doc_id in doc_ids:
+                position = self.doc_positions.get(int(doc_id))
+                if position is not None:
+                    texts[int(doc_id)] = self.doc_texts[position]
+            return texts
+    
+    def search_vectors(self, query_vector, top_k, max_distance=None, min_score=None):
+        return self.search_batch([query_vector], top_k, max_distance, min_score)[0]
+    
+    def search_lexical(self, query, top_k, filters=None):
+        # 词法搜索不需要嵌入向量；score为归一化的BM25分数，coverage为命中查询词的idf加权比例
+        if self.lexical is None:
             return []
+        with self.lock.read_lock(), stage_timer('lexical', self.store_label):
+            fetch_k = top_k * CHUNK_OVERSAMPLE if self.chunk_counts else top_k
+            allowed = None if filters is None else self._compile_filter(filters).allowed_ids()
+            hits = []
+            for vector_id, score, coverage in self.lexical.search(query, fetch_k, allowed):
+                doc_id, chunk_no = split_vector_id(vector_id)
+                hits.append({
+                    "doc_id": doc_id,
+                    "chunk": chunk_no,
+                    "text": self.doc_texts[self.doc_positions[vector_id]],
+                    "distance": None,
+                    "score": score,
+                    "coverage": coverage
+                })
+            return collapse_chunks(hits, top_k)
+    
+    def search_batch(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
+        with self.lock.read_lock():
+            matches = self._search_matches(query_vectors, top_k, max_distance, min_score, filters)
+            # 取回命中文档的文本（磁盘存储从内存映射的文本文件中解码）
+            with stage_timer('hydrate', self.store_label):
+                return [
+                    [make_hit(distance, vector_id, self.doc_texts[self.doc_positions[vector_id]]) for distance, vector_id in query_matches]
+                    for query_matches in matches
+                ]
+    
+    def search_matches(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
+        # 只搜索不取回文本，供分片存储合并各分片的结果后再取回
+        with self.lock.read_lock():
+            return self._search_matches(query_vectors, top_k, max_distance, min_score, filters)
+    
+    def _search_matches(self, query_vectors, top_k, max_distance, min_score, filters=None):
+        # 每条查询返回按距离升序、每个父文档只保留最相关分块的(距离, 向量ID)，最多top_k个
+        if self.index is None:
+            return [[] for _ in query_vectors]
+        compiled = None
+        if filters is not None:
+            with stage_timer('filter', self.store_label):
+                compiled = self._compile_filter(filters)
+            if len(compiled.vector_ids) == 0:
+                return [[] for _ in query_vectors]
+        
+        # 所有查询堆叠成一个矩阵，一次完成搜索
+        queries = np.ascontiguousarray(query_vectors, dtype='float32')
         
         # 确保查询向量维度与索引一致
-        if len(query_vector) != self.vector_dimension:
-            print(f"Warning: Query vector dimension ({len(query_vector)}) does not match index dimension ({self.vector_dimension})")
+        if queries.shape[1] != self.vector_dimension:
+            print(f"Warning: Query vector dimension ({queries.shape[1]}) does not match index dimension ({self.vector_dimension})")
         
-        D, I = self.index.search(np.array([query_vector]), top_k)
+        # 存在多块文档时多取候选，按父文档去重后再截取top_k
+        fetch_k = top_k * CHUNK_OVERSAMPLE if self.chunk_counts else top_k
+        with stage_timer('search', self.store_label):
+            D, I = self._search_index(queries, fetch_k, compiled)
         results = []
-        for idx in I[0]:
-            if idx < len(self.doc_ids):
-                results.append({"doc_id": self.doc_ids[idx], "text": self.doc_texts[idx]})
+        for distances, vector_ids in zip(D, I):
+            matches = []
+            seen = set()
+            for distance, vector_id in zip(distances, vector_ids):
+                # 结果不足top_k时FAISS以-1填充
+                vector_id = int(vector_id)
+                if vector_id not in self.doc_positions or not passes_cutoff(distance, max_distance, min_score):
+                    continue
+                parent, _ = split_vector_id(vector_id)
+                if parent in seen:
+                    continue
+                seen.add(parent)
+                matches.append((float(distance), vector_id))
+                if len(matches) >= top_k:
+                    break
+            results.append(matches)
         return results
     
     def save(self):
@@ -66,238 +744,1106 @@ class FAISSMemoryStore(VectorStore):
         return False
 
 # FAISS磁盘存储实现
-class FAISSDiskStore(VectorStore):
-    def __init__(self, index_path, ids_path, texts_path):
+# 每次写操作先追加到预写日志再修改内存索引，后台线程定期生成快照；
+# 快照文件先写入临时文件，再通过提交标记和原子重命名整体替换，启动时在最近的快照上重放日志。
+# mmap模式下快照中的索引和ID数组以只读内存映射打开，启动耗时与文档数无关，多个进程共享页缓存；
+# 第一次写入时才把索引完整载入内存。read_only模式（隐含mmap）不写日志和快照，用于多worker只读部署
+class FAISSDiskStore(FAISSMemoryStore):
+    store_label = 'disk'
+    
+    def __init__(self, index_path, ids_path, texts_path, wal_path=None, wal_fsync=False,
+                 snapshot_interval=300, snapshot_wal_bytes=64 * 1024 * 1024, mmap=False, read_only=False,
+                 wal=True, **index_options):
+        super().__init__(**index_options)
+        self._set_paths(index_path, ids_path, texts_path)
+        self.doc_texts = MmapTextStore()
+        
+        # 预写日志及快照策略：距上次快照超过snapshot_interval秒或日志超过snapshot_wal_bytes时生成快照。
+        # 不写日志的存储（后台重建的索引）由调用方在写入完成后调用save()
+        self.wal = WriteAheadLog(wal_path or index_path + '.wal', fsync=wal_fsync)
+        self.wal_enabled = wal
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_wal_bytes = snapshot_wal_bytes
+        self.last_snapshot = time.time()
+        # 加载时发生了格式迁移等未写入日志的变化，需要重新生成快照
+        self.snapshot_dirty = False
+        
+        # 写锁同时保证内存索引和日志的写入顺序一致，snapshot_lock保证同一时间只有一个快照
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_thread = None
+        self.stop_event = threading.Event()
+        
+        # mapped表示当前索引和文档位置仍是快照文件的只读映射；词法索引在第一次词法搜索或写入时才加载
+        self.mmap = mmap or read_only
+        self.read_only = read_only
+        self.mapped = False
+        self.lexical_pending = False
+        # 已加载快照的文件签名，用于发现其他进程写入的新快照
+        self.loaded_signature = None
+    
+    def _set_paths(self, index_path, ids_path, texts_path):
         self.index_path = index_path
         self.ids_path = ids_path
-        self.texts_path = texts_path
-        self.index = None
-        self.vector_dimension = None
-        self.doc_ids = []
-        self.doc_texts = []
+        self.commit_path = index_path + '.commit'
+        
+        # 文本保存为二进制文件加偏移数组；旧版本的base64文本文件（.txt）在加载时自动转换
+        base_path, extension = os.path.splitext(texts_path)
+        self.texts_path = base_path + '.bin' if extension == '.txt' else texts_path
+        self.offsets_path = base_path + '.offsets.npy'
+        self.legacy_texts_path = base_path + '.txt'
+        # 词法索引与FAISS索引放在一起，随快照一同提交
+        self.lexical_path = os.path.splitext(index_path)[0] + '.lexical.npz'
+        # 索引的构建参数（索引类型、编码、PCA维度、嵌入模型）和迁移时测得的召回率随快照保存
+        self.meta_path = os.path.splitext(index_path)[0] + '.meta.json'
+        # 文档元数据的列存储
+        self.metadata_path = os.path.splitext(index_path)[0] + '.metadata.npz'
     
-    def add_vector(self, vector, doc_id, text):
-        # 动态初始化索引
-        if self.index is None:
-            self.vector_dimension = len(vector)
-            self.index = faiss.IndexFlatL2(self.vector_dimension)
-            print(f"Initialized FAISS disk index with dimension: {self.vector_dimension}")
+    def snapshot_files(self):
+        return [self.index_path, self.ids_path, self.texts_path, self.offsets_path, self.meta_path, self.lexical_path, self.metadata_path]
+    
+    def snapshot_signature(self):
+        # 快照文件的修改时间和大小；提交进行中时返回None
+        if os.path.exists(self.commit_path) or not os.path.exists(self.index_path):
+            return None
+        return tuple(
+            (os.stat(path).st_mtime_ns, os.stat(path).st_size) if os.path.exists(path) else None
+            for path in self.snapshot_files()
+        )
+    
+    def add_vectors(self, vectors, doc_ids, texts, metadata=None):
+        if len(vectors) == 0:
+            return True
+        if self.read_only:
+            print(f"Error adding vectors: vector store at {self.index_path} is read-only")
+            return False
         
-        self.index.add(np.array([vector]))
-        self.doc_ids.append(doc_id)
-        self.doc_texts.append(text)
-        return True
+        matrix = np.ascontiguousarray(vectors, dtype='float32')
+        if not np.isfinite(matrix).all():
+            print("Error adding vectors: vectors contain NaN or infinite values")
+            return False
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        texts = list(texts)
+        if metadata:
+            # 日志只记录本批文档的元数据
+            parents = {split_vector_id(doc_id)[0] for doc_id in doc_ids}
+            metadata = {int(parent): values for parent, values in metadata.items() if int(parent) in parents and values}
+        with self.lock.write_lock():
+            # 写日志前先校验，写不进索引的批次一旦进入WAL，每次加载重放都会失败
+            error = self._check_matrix(matrix)
+            if error:
+                print(f"Error adding vectors: {error}")
+                return False
+            self._ensure_writable()
+            self._log(self.wal.append_add, doc_ids, matrix, texts, metadata)
+            return super().add_vectors(matrix, doc_ids, texts, metadata)
+    
+    def delete_vector(self, doc_id):
+        if self.read_only:
+            print(f"Error deleting vector: vector store at {self.index_path} is read-only")
+            return False
+        
+        doc_id = int(doc_id)
+        with self.lock.write_lock():
+            if doc_id not in self.doc_positions:
+                return False
+            self._ensure_writable()
+            self._log(self.wal.append_delete, [doc_id])
+            return super().delete_vector(doc_id)
+    
+    def _log(self, append, *args):
+        if self.wal_enabled:
+            append(*args)
+        else:
+            self.snapshot_dirty = True
+    
+    def _ensure_writable(self):
+        # 内存映射的索引不能修改，复制为内存中的索引；文档位置转换为可修改的dict
+        if self.mapped:
+            self.index = faiss.deserialize_index(faiss.serialize_index(self.index))
+            self._apply_search_params()
+            if isinstance(self.doc_positions, SortedIdPositions):
+                self.doc_positions = self.doc_positions.to_dict()
+            self.mapped = False
+            print(f"Loaded memory-mapped FAISS index {self.index_path} into memory for writing")
+        self._ensure_lexical()
+    
+    def _ensure_lexical(self):
+        if self.lexical_pending:
+            self.lexical_pending = False
+            if not self._load_lexical() and not self.read_only:
+                self.snapshot_dirty = True
     
-    def search_vectors(self, query_vector, top_k):
+    def search_batch(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
         if self.index is None:
             # 尝试加载索引
             self.load()
-            if self.index is None:
-                return []
-        
-        # 确保查询向量维度与索引一致
-        if len(query_vector) != self.vector_dimension:
-            print(f"Warning: Query vector dimension ({len(query_vector)}) does not match index dimension ({self.vector_dimension})")
-        
-        D, I = self.index.search(np.array([query_vector]), top_k)
-        results = []
-        for idx in I[0]:
-            if idx < len(self.doc_ids):
-                results.append({"doc_id": self.doc_ids[idx], "text": self.doc_texts[idx]})
-        return results
+        return super().search_batch(query_vectors, top_k, max_distance, min_score, filters)
+    
+    def search_lexical(self, query, top_k, filters=None):
+        if self.index is None:
+            self.load()
+        if self.lexical_pending:
+            with self.lock.write_lock():
+                self._ensure_lexical()
+        return super().search_lexical(query, top_k, filters)
+    
+    def index_info(self):
+        info = super().index_info()
+        info["mapped"] = self.mapped
+        info["read_only"] = self.read_only
+        return info
+    
+    def _maybe_compact(self):
+        # 文本中的空位在下一次快照时回收，这里只重建近似索引
+        if self.dead_rows and len(self.dead_rows) >= self.compact_ratio * self.index.ntotal:
+            self.compact()
+    
+    def _compact_texts(self):
+        # 文件中的文本不可原地修改，由save()在写快照时压缩
+        pass
     
     def save(self):
-        try:
-            # 创建目录（如果不存在）
-            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
-            
-            # 保存FAISS索引
-            faiss.write_index(self.index, self.index_path)
-            
-            # 保存文档ID和文本
-            np.save(self.ids_path, np.array(self.doc_ids))
-            
-            # 保存文本内容
-            with open(self.texts_path, 'w', encoding='utf-8') as f:
-                for text in self.doc_texts:
-                    # 使用base64编码来处理换行符等特殊字符
-                    import base64
-                    encoded = base64.b64encode(text.encode('utf-8')).decode('utf-8')
-                    f.write(encoded + '\n')
-            
-            print(f"FAISS index saved to {self.index_path}")
-            print(f"Doc IDs saved to {self.ids_path}")
-            print(f"Doc texts saved to {self.texts_path}")
-            return True
-        except Exception as e:
-            print(f"Error saving FAISS index: {str(e)}")
+        if self.read_only:
+            # 只读实例不写快照，快照由唯一的写入进程生成
             return False
+        with stage_timer('save', self.store_label), self.snapshot_lock:
+            with self.lock.write_lock():
+                if self.index is None:
+                    return False
+                if self.wal.size() == 0 and not self.snapshot_dirty and os.path.exists(self.index_path):
+                    # 上次快照之后没有变化
+                    return True
+                
+                # 保存前重建近似索引，文件中只保留有效向量
+                self.compact()
+                
+                # 持锁期间只复制内存状态并轮转日志，文件写入在锁外进行，不阻塞新的写操作
+                index_bytes = faiss.serialize_index(self.index)
+                # 按doc_id升序写入文档ID和文本，加载时可以直接在映射的ID数组上二分查找
+                live = sorted(self.doc_positions.items())
+                # 锁外写文本时并发的更新和删除会清空tail中的旧文本，这里复制一份
+                texts = self.doc_texts.copy()
+                lexical_arrays = self.lexical.to_arrays() if self.lexical is not None else None
+                metadata_arrays = self.metadata.to_arrays()
+                meta = self._index_meta()
+                self.wal.rotate()
+                self.snapshot_dirty = False
+            
+            try:
+                # 创建目录（如果不存在）
+                os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+                
+                # 保存FAISS索引
+                with open(self.index_path + '.tmp', 'wb') as f:
+                    index_bytes.tofile(f)
+                    os.fsync(f.fileno())
+                
+                # 保存文档ID，第i个ID对应第i条文本
+                with open(self.ids_path + '.tmp', 'wb') as f:
+                    np.save(f, np.array([doc_id for doc_id, _ in live], dtype='int64'))
+                    os.fsync(f.fileno())
+                
+                # 只写入有效文档的文本，顺带回收空位
+                MmapTextStore.write(
+                    self.texts_path + '.tmp',
+                    self.offsets_path + '.tmp',
+                    (texts[position] for _, position in live)
+                )
+                
+                with open(self.meta_path + '.tmp', 'w', encoding='utf-8') as f:
+                    json.dump(meta, f, ensure_ascii=False)
+                    os.fsync(f.fileno())
+                
+                MetadataTable.write(self.metadata_path + '.tmp', metadata_arrays)
+                paths = [self.index_path, self.ids_path, self.texts_path, self.offsets_path, self.meta_path, self.metadata_path]
+                if lexical_arrays is not None:
+                    LexicalIndex.write(self.lexical_path + '.tmp', lexical_arrays)
+                    paths.append(self.lexical_path)
+                self._commit_files(paths)
+                # 快照已包含轮转出去的日志内容
+                self.wal.discard_rotated()
+                self.last_snapshot = time.time()
+                self._reopen_texts(live)
+                
+                print(f"FAISS index saved to {self.index_path}")
+                print(f"Doc IDs saved to {self.ids_path}")
+                print(f"Doc texts saved to {self.texts_path}")
+                return True
+            except Exception as e:
+                print(f"Error saving FAISS index: {str(e)}")
+                count_error(self.store_label, 'save')
+                return False
+    
+    def _reopen_texts(self, snapshot_live):
+        # 切换到新写入的文本文件；快照期间新写入的文档仍从旧存储中取出追加到tail
+        snapshot_positions = {position: i for i, (_, position) in enumerate(snapshot_live)}
+        with self.lock.write_lock():
+            old_texts = self.doc_texts
+            new_texts = MmapTextStore(self.texts_path, self.offsets_path)
+            new_positions = {}
+            for doc_id, position in self.doc_positions.items():
+                snapshot_position = snapshot_positions.get(position)
+                if snapshot_position is not None:
+                    new_positions[doc_id] = snapshot_position
+                else:
+                    new_positions[doc_id] = len(new_texts)
+                    new_texts.append(old_texts[position])
+            self.doc_texts = new_texts
+            self.doc_positions = new_positions
+            self.dead_count = len(new_texts) - len(new_positions)
+        # 旧的映射在Linux下重命名后仍然有效，这里无需关闭，交给垃圾回收
+    
+    def _commit_files(self, paths):
+        # 先写提交标记，再逐个重命名；中途崩溃时启动会根据标记继续完成重命名
+        with open(self.commit_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(paths, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(self.commit_path + '.tmp', self.commit_path)
+        self._finish_commit()
+    
+    def _finish_commit(self):
+        if not os.path.exists(self.commit_path):
+            return
+        with open(self.commit_path, 'r', encoding='utf-8') as f:
+            paths = json.load(f)
+        for path in paths:
+            if os.path.exists(path + '.tmp'):
+                os.replace(path + '.tmp', path)
+        os.remove(self.commit_path)
     
     def load(self):
+        with stage_timer('load', self.store_label), self.lock.write_lock():
+            if self.read_only:
+                # 快照提交和日志由写入进程负责，只读实例只加载最近一次完整的快照
+                if os.path.exists(self.commit_path):
+                    print(f"Warning: snapshot commit in progress at {self.index_path}, loading the previous files")
+                if self.wal.size():
+                    print(f"Warning: {self.wal.size()} bytes of WAL at {self.wal.path} are not applied in read-only mode")
+                return self._load_snapshot()
+            
+            # 完成上次中断的快照提交
+            self._finish_commit()
+            loaded = self._load_snapshot()
+            replayed = self._replay_wal()
+            if replayed:
+                print(f"Replayed {replayed} WAL records from {self.wal.path}")
+            return loaded or replayed > 0
+    
+    def _replay_wal(self):
+        replayed = 0
+        for path, offset, op, (doc_ids, vectors, texts, metadata) in self.wal.records():
+            # 直接调用内存实现，重放时不再写日志；无法应用的记录跳过，不影响其余记录和索引加载
+            self._ensure_writable()
+            applied = True
+            try:
+                if op == OP_ADD:
+                    applied = FAISSMemoryStore.add_vectors(self, vectors, doc_ids, texts, metadata)
+                elif op == OP_DELETE:
+                    for doc_id in doc_ids:
+                        FAISSMemoryStore.delete_vector(self, doc_id)
+            except Exception as e:
+                print(f"Error replaying WAL record: {str(e)}")
+                applied = False
+            if not applied:
+                print(f"Skipping WAL record in {path} at offset {offset}")
+                continue
+            replayed += 1
+        return replayed
+    
+    def _load_snapshot(self):
         try:
+            # 旧版本的base64文本文件先流式转换为二进制文本文件
+            if not os.path.exists(self.texts_path) and os.path.exists(self.legacy_texts_path):
+                self._migrate_legacy_texts()
+            
             # 检查文件是否存在
             if not os.path.exists(self.index_path) or not os.path.exists(self.ids_path) or not os.path.exists(self.texts_path):
                 print(f"Index files not found at {self.index_path}")
                 return False
             
-            # 加载FAISS索引
-            self.index = faiss.read_index(self.index_path)
-            self.vector_dimension = self.index.d
+            # 先记录签名再读取文件，读取期间其他进程提交的新快照在下一次检查时仍会被发现
+            signature = self.snapshot_signature()
+            
+            # 加载FAISS索引；mmap模式下向量编码直接映射文件，不复制到内存。
+            # 旧版本faiss没有IO_FLAG_MMAP_IFC，退化为整体读入内存
+            if self.mmap and hasattr(faiss, 'IO_FLAG_MMAP_IFC'):
+                index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP_IFC | faiss.IO_FLAG_READ_ONLY)
+            else:
+                if self.mmap:
+                    print(f"Warning: faiss {faiss.__version__} cannot memory-map {self.index_path}, reading it into memory")
+                index = faiss.read_index(self.index_path)
             
             # 加载文档ID
-            self.doc_ids = np.load(self.ids_path).tolist()
+            doc_ids = np.load(self.ids_path, mmap_mode='r' if self.mmap else None)
             
-            # 加载文本内容
-            self.doc_texts = []
-            with open(self.texts_path, 'r', encoding='utf-8') as f:
-                for line in f:
-                    # 解码base64字符串
-                    import base64
-                    text = base64.b64decode(line.strip()).decode('utf-8')
-                    self.doc_texts.append(text)
+            # 以内存映射方式打开文本，搜索时只解码命中的文本
+            doc_texts = MmapTextStore(self.texts_path, self.offsets_path)
+            
+            # 旧版本索引是按行号对应doc_ids的IndexFlatL2，转换为以doc_id为ID的索引
+            mapped = self.mmap
+            if not isinstance(index, faiss.IndexIDMap2):
+                index = self._migrate_legacy_index(index, doc_ids.tolist())
+                self.snapshot_dirty = True
+                mapped = False
+            
+            self.index = index
+            self.mapped = mapped
+            self.loaded_signature = signature
+            self.vector_dimension = index.d
+            self.dead_rows = set()
+            self.dead_selector = None
+            self._load_meta()
+            self._load_metadata()
+            self._apply_search_params()
+            self.doc_texts = doc_texts
+            if self.mmap and (len(doc_ids) < 2 or bool(np.all(doc_ids[1:] > doc_ids[:-1]))):
+                self.doc_positions = SortedIdPositions(doc_ids)
+            else:
+                # 旧版本的快照按写入顺序保存，重复的doc_id以最后一次写入为准；下一次快照按doc_id排序
+                self.doc_positions = {int(doc_id): i for i, doc_id in enumerate(doc_ids.tolist())}
+                if self.mmap:
+                    self.snapshot_dirty = True
+            self.dead_count = len(doc_texts) - len(self.doc_positions)
+            if self.dead_count:
+                self.snapshot_dirty = True
+            if self.lexical is not None:
+                if self.mmap:
+                    self.lexical_pending = True
+                elif not self._load_lexical():
+                    self.snapshot_dirty = True
+            self.chunk_counts = {}
+            for vector_id in doc_ids[(doc_ids >> CHUNK_ID_SHIFT) > 0].tolist():
+                doc_id, chunk_no = split_vector_id(vector_id)
+                self.chunk_counts[doc_id] = max(self.chunk_counts.get(doc_id, 1), chunk_no + 1)
+            # 只读实例不迁移索引，由写入进程迁移并生成快照
+            if not self.read_only and self._maybe_train():
+                self.snapshot_dirty = True
             
             print(f"FAISS index loaded from {self.index_path}")
-            print(f"Loaded {len(self.doc_ids)} documents")
+            print(f"Loaded {len(self.doc_positions)} documents")
             return True
         except Exception as e:
             print(f"Error loading FAISS index: {str(e)}")
+            count_error(self.store_label, 'load')
+            return False
+    
+    def _index_meta(self):
+        approximate = self.is_approximate()
+        return {
+            "index_type": self.index_type if approximate else 'flat',
+            "encoding": self.encoding if approximate else 'float32',
+            "pca_dim": self.pca_dim if approximate else 0,
+            "dimension": self.vector_dimension,
+            "embedding_model": self.embedding_model,
+            "last_recall": self.last_recall
+        }
+    
+    def _load_meta(self):
+        # 已迁移的索引中的向量已经按保存时的参数变换和编码，以文件中记录的参数为准；
+        # 仍是flat索引时沿用当前配置，达到阈值后按新配置迁移
+        if not os.path.exists(self.meta_path):
+            return
+        try:
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Error loading index metadata: {str(e)}")
+            return
+        self.embedding_model = meta.get('embedding_model')
+        if not self.is_approximate():
+            return
+        for key in ('index_type', 'encoding', 'pca_dim'):
+            if key in meta and meta[key] != getattr(self, key):
+                print(f"Warning: {key}={getattr(self, key)} differs from the saved index ({meta[key]}), using the saved value")
+                setattr(self, key, meta[key])
+        self.last_recall = meta.get('last_recall')
+    
+    def _load_metadata(self):
+        # 旧版本的快照没有元数据文件，文档在下次写入时带上元数据
+        self.metadata = MetadataTable()
+        self.filter_cache = {}
+        if not os.path.exists(self.metadata_path):
+            return
+        try:
+            self.metadata.load(self.metadata_path)
+        except Exception as e:
+            print(f"Error loading document metadata: {str(e)}")
+            self.metadata = MetadataTable()
+    
+    def _load_lexical(self):
+        # 词法索引文件缺失或与快照不一致时（如从旧版本升级），用快照中的文本重建
+        self.lexical = LexicalIndex()
+        if os.path.exists(self.lexical_path):
+            try:
+                self.lexical.load(self.lexical_path)
+                if len(self.lexical) == len(self.doc_positions):
+                    return True
+            except Exception as e:
+                print(f"Error loading lexical index: {str(e)}")
+            self.lexical = LexicalIndex()
+        
+        for doc_id, position in self.doc_positions.items():
+            self.lexical.add(doc_id, self.doc_texts[position])
+        print(f"Rebuilt lexical index for {len(self.lexical)} documents")
+        return False
+    
+    def _migrate_legacy_texts(self):
+        import base64
+        
+        def decode_lines():
+            with open(self.legacy_texts_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    # 解码base64字符串
+                    yield base64.b64decode(line.strip()).decode('utf-8')
+        
+        count = MmapTextStore.write(self.texts_path + '.tmp', self.offsets_path + '.tmp', decode_lines())
+        self._commit_files([self.texts_path, self.offsets_path])
+        print(f"Converted {count} legacy doc texts from {self.legacy_texts_path} to {self.texts_path}")
+    
+    def _migrate_legacy_index(self, legacy_index, doc_ids):
+        vectors = legacy_index.reconstruct_n(0, legacy_index.ntotal)
+        last = {int(doc_id): i for i, doc_id in enumerate(doc_ids)}
+        rows = sorted(last.values())
+        
+        index = faiss.IndexIDMap2(faiss.IndexFlatL2(legacy_index.d))
+        if rows:
+            index.add_with_ids(vectors[rows], np.array([int(doc_ids[i]) for i in rows], dtype='int64'))
+        print(f"Migrated legacy FAISS index with {legacy_index.ntotal} rows to {len(rows)} documents")
+        return index
+    
+    def replace_snapshot(self, staged):
+        # 用另一个磁盘存储（后台重建的索引）已保存的快照替换本存储的快照文件，之后由staged在本存储的路径上继续工作。
+        # 调用方需保证两者都已保存且不再有写入：本存储的日志为空，崩溃后不会在新快照上重放旧的记录
+        self.stop_background_snapshots()
+        with self.snapshot_lock, self.lock.write_lock():
+            paths, stale = self._stage_replacement(staged)
+            self._commit_files(paths)
+            self._finish_replacement(stale)
+        staged.relocate(self.index_path, self.ids_path, self.texts_path, self.wal.path)
+        print(f"Replaced snapshot at {self.index_path}")
+    
+    def _stage_replacement(self, staged):
+        # 把staged的快照文件移动为本存储快照文件的临时文件，返回待提交的路径和新快照中没有的旧文件
+        if self.wal.size():
+            raise RuntimeError(f"WAL at {self.wal.path} is not empty, save the store before replacing its snapshot")
+        paths = []
+        stale = []
+        for source, target in zip(staged.snapshot_files(), self.snapshot_files()):
+            if os.path.exists(source):
+                os.replace(source, target + '.tmp')
+                paths.append(target)
+            elif os.path.exists(target):
+                stale.append(target)
+        return paths, stale
+    
+    def _finish_replacement(self, stale):
+        # 新快照中没有的文件（如未启用词法索引）不能与新快照混用
+        for path in stale:
+            os.remove(path)
+        # 旧存储只保留给进行中的搜索，不再写入
+        self.read_only = True
+    
+    def relocate(self, index_path, ids_path, texts_path, wal_path=None):
+        # 快照文件已移动到新路径，之后的日志和快照写到新路径；已打开的内存映射在重命名后仍然有效
+        with self.snapshot_lock, self.lock.write_lock():
+            old_wal = self.wal
+            old_wal.close()
+            for path in (old_wal.path, old_wal.rotated_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._set_paths(index_path, ids_path, texts_path)
+            self.wal = WriteAheadLog(wal_path or index_path + '.wal', fsync=old_wal.fsync)
+            self.wal_enabled = True
+            self.loaded_signature = self.snapshot_signature()
+    
+    def remove_files(self):
+        # 删除快照文件和日志，用于放弃未完成的后台重建
+        self.stop_background_snapshots()
+        for path in self.snapshot_files() + [self.commit_path, self.wal.path, self.wal.rotated_path]:
+            for candidate in (path, path + '.tmp'):
+                if os.path.exists(candidate):
+                    os.remove(candidate)
+    
+    def start_background_snapshots(self):
+        if self.snapshot_thread is not None or self.snapshot_interval <= 0:
+            return
+        self.stop_event.clear()
+        self.snapshot_thread = threading.Thread(target=self._snapshot_loop, name='faiss-snapshot', daemon=True)
+        self.snapshot_thread.start()
+    
+    def stop_background_snapshots(self):
+        if self.snapshot_thread is None:
+            return
+        self.stop_event.set()
+        self.snapshot_thread.join()
+        self.snapshot_thread = None
+    
+    def _snapshot_loop(self):
+        while not self.stop_event.wait(min(5, self.snapshot_interval)):
+            wal_size = self.wal.size()
+            if wal_size == 0:
+                continue
+            if wal_size >= self.snapshot_wal_bytes or time.time() - self.last_snapshot >= self.snapshot_interval:
+                self.save()
+
+# 分片FAISS存储：按父文档ID取模把向量分到N个子存储（内存或磁盘存储，磁盘分片各自有索引、文本和日志文件），
+# 同一文档的全部分块在同一分片中。搜索在有界线程池中并行搜索各分片，每个线程限制FAISS的OpenMP线程数，
+# 避免与服务线程池争抢CPU；各分片按距离排序的结果用堆合并出top-k后，只取回最终结果的文本。
+# 快照按分片分别生成，没有变化的分片不会重写
+class ShardedFAISSStore(VectorStore):
+    def __init__(self, shards, search_threads=0, omp_threads=0, unsharded=None):
+        self.shards = shards
+        self.store_label = shards[0].store_label
+        cpus = os.cpu_count() or 1
+        self.search_threads = search_threads or min(len(shards), cpus)
+        # 每个搜索线程中FAISS使用的OpenMP线程数，默认把CPU平均分给各搜索线程
+        self.omp_threads = omp_threads or max(1, cpus // self.search_threads)
+        self.executor = ThreadPoolExecutor(
+            max_workers=self.search_threads,
+            thread_name_prefix='faiss-shard',
+            initializer=faiss.omp_set_num_threads,
+            initargs=(self.omp_threads,)
+        )
+        # 创建未分片的磁盘存储，用于首次加载时把旧的快照导入各分片
+        self.unsharded = unsharded
+    
+    @property
+    def index_path(self):
+        return getattr(self.shards[0], 'index_path', None)
+    
+    @property
+    def vector_dimension(self):
+        return next((shard.vector_dimension for shard in self.shards if shard.vector_dimension), None)
+    
+    @property
+    def embedding_model(self):
+        return next((shard.embedding_model for shard in self.shards if shard.embedding_model), None)
+    
+    @embedding_model.setter
+    def embedding_model(self, model):
+        for shard in self.shards:
+            shard.embedding_model = model
+    
+    @property
+    def read_only(self):
+        return getattr(self.shards[0], 'read_only', False)
+    
+    @property
+    def generation(self):
+        return sum(shard.generation for shard in self.shards)
+    
+    def _shard_number(self, vector_id):
+        return split_vector_id(int(vector_id))[0] % len(self.shards)
+    
+    def _group(self, vector_ids):
+        # 按所属分片分组，返回{分片序号: [在输入中的位置]}
+        groups = {}
+        for i, vector_id in enumerate(vector_ids):
+            groups.setdefault(self._shard_number(vector_id), []).append(i)
+        return groups
+    
+    def _map(self, function, items):
+        # 各分片在复制的请求上下文中执行，阶段耗时（Server-Timing）按最慢的分片计入当前请求
+        context = contextvars.copy_context()
+        futures = [self.executor.submit(context.copy().run, run_timed, function, item) for item in items]
+        results = [future.result() for future in futures]
+        merge_parallel_timings([timings for _, timings in results])
+        return [result for result, _ in results]
+    
+    def add_vector(self, vector, doc_id, text):
+        return self.add_vectors(np.array([vector]), [doc_id], [text])
+    
+    def add_vectors(self, vectors, doc_ids, texts, metadata=None):
+        if len(vectors) == 0:
+            return True
+        matrix = np.ascontiguousarray(vectors, dtype='float32')
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+        texts = list(texts)
+        
+        def add(group):
+            # 各分片只使用自己文档的元数据
+            number, rows = group
+            return self.shards[number].add_vectors(matrix[rows], [doc_ids[i] for i in rows], [texts[i] for i in rows], metadata)
+        return all(self._map(add, self._group(doc_ids).items()))
+    
+    def delete_vector(self, doc_id):
+        return self.shards[self._shard_number(doc_id)].delete_vector(doc_id)
+    
+    def count(self):
+        return sum(shard.count() for shard in self.shards)
+    
+    def doc_ids(self):
+        return [vector_id for shard in self.shards for vector_id in shard.doc_ids()]
+    
+    def get_metadata(self, doc_ids):
+        doc_ids = list(doc_ids)
+        metadata = {}
+        for number, rows in self._group(doc_ids).items():
+            metadata.update(self.shards[number].get_metadata([doc_ids[i] for i in rows]))
+        return metadata
+    
+    def get_texts(self, doc_ids):
+        doc_ids = list(doc_ids)
+        texts = {}
+        for number, rows in self._group(doc_ids).items():
+            texts.update(self.shards[number].get_texts([doc_ids[i] for i in rows]))
+        return texts
+    
+    def search_vectors(self, query_vector, top_k, max_distance=None, min_score=None):
+        return self.search_batch([query_vector], top_k, max_distance, min_score)[0]
+    
+    def search_batch(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
+        queries = np.ascontiguousarray(query_vectors, dtype='float32')
+        # 过滤条件在各分片中分别编译和缓存
+        per_shard = self._map(lambda shard: shard.search_matches(queries, top_k, max_distance, min_score, filters), self.shards)
+        # 各分片的结果已按距离升序排列，同一文档只在一个分片中，直接归并出前top_k个
+        merged = [
+            list(itertools.islice(heapq.merge(*(matches[i] for matches in per_shard)), top_k))
+            for i in range(len(queries))
+        ]
+        with stage_timer('hydrate', self.store_label):
+            texts = self.get_texts({vector_id for matches in merged for _, vector_id in matches})
+        # 搜索与取回之间被删除的文档不返回
+        return [
+            [make_hit(distance, vector_id, texts[vector_id]) for distance, vector_id in matches if vector_id in texts]
+            for matches in merged
+        ]
+    
+    def search_lexical(self, query, top_k, filters=None):
+        # BM25的idf按分片各自统计，文档随机分布在各分片时与整体统计接近
+        per_shard = self._map(lambda shard: shard.search_lexical(query, top_k, filters), self.shards)
+        return heapq.nlargest(top_k, itertools.chain.from_iterable(per_shard), key=lambda hit: hit['score'])
+    
+    def evaluate_recall(self, k=10, num_queries=100):
+        per_shard_queries = -(-num_queries // len(self.shards))
+        results = self._map(lambda shard: shard.evaluate_recall(k=k, num_queries=per_shard_queries), self.shards)
+        measured = [result for result in results if result['recall'] is not None]
+        total = sum(result['num_queries'] for result in measured)
+        if total:
+            recall = sum(result['recall'] * result['num_queries'] for result in measured) / total
+        else:
+            recall = 1.0 if measured else None
+        return dict(results[0], num_queries=total, recall=recall, shards=len(self.shards))
+    
+    def check_self_retrieval(self, num_queries=20, k=10):
+        # 各分片抽取的文档在整个分片存储中搜索，同时检查合并结果
+        per_shard_queries = -(-num_queries // len(self.shards))
+        samples = [shard.sample_vectors(per_shard_queries) for shard in self.shards]
+        sample = [vector_id for ids, _ in samples for vector_id in ids]
+        if not sample:
+            return {"num_queries": 0, "hits": 0, "hit_rate": None}
+        queries = np.vstack([vectors for ids, vectors in samples if ids])
+        
+        hits = 0
+        for vector_id, results in zip(sample, self.search_batch(queries, k)):
+            doc_id, _ = split_vector_id(vector_id)
+            hits += any(hit['doc_id'] == doc_id for hit in results)
+        return {"num_queries": len(sample), "hits": hits, "hit_rate": hits / len(sample)}
+    
+    def index_info(self):
+        infos = self._map(lambda shard: shard.index_info(), self.shards)
+        # 索引类型和参数各分片相同，文档数等按分片求和
+        info = dict(infos[0])
+        for key in ('documents', 'chunks', 'vectors', 'stale_vectors', 'metadata_documents'):
+            info[key] = sum(shard_info[key] for shard_info in infos)
+        info["metadata_fields"] = {}
+        for shard_info in infos:
+            for field, values in shard_info['metadata_fields'].items():
+                info["metadata_fields"][field] = max(values, info["metadata_fields"].get(field, 0))
+        info["dimension"] = self.vector_dimension
+        info["embedding_model"] = self.embedding_model
+        info["active_index"] = ','.join(sorted({shard_info['active_index'] for shard_info in infos}))
+        info["last_recall"] = next((shard_info['last_recall'] for shard_info in infos if shard_info['last_recall']), None)
+        info["shards"] = [
+            {key: shard_info[key] for key in ('active_index', 'documents', 'vectors', 'stale_vectors')}
+            for shard_info in infos
+        ]
+        info["search_threads"] = self.search_threads
+        info["omp_threads"] = self.omp_threads
+        return info
+    
+    def save(self):
+        # 依次保存各分片（退出时线程池已关闭）；空分片没有快照，没有变化的分片直接返回
+        saved = [shard.save() for shard in self.shards]
+        return any(saved) and all(ok or shard.index is None for ok, shard in zip(saved, self.shards))
+    
+    def load(self):
+        if not hasattr(self.shards[0], 'commit_path'):
             return False
+        if not self.read_only:
+            # 替换全部分片的快照时只写分片0的提交标记，先完成它
+            self.shards[0]._finish_commit()
+        loaded = any(self._map(lambda shard: shard.load(), self.shards))
+        if not loaded and self.unsharded is not None and not self.read_only:
+            loaded = self._import_unsharded()
+        return loaded
+    
+    def _import_unsharded(self):
+        # 从未分片的快照（和日志）导入：原文件保留不动，导入后立即为各分片生成快照
+        source = self.unsharded()
+        if not os.path.exists(source.index_path) and not source.wal.size():
+            return False
+        if not source.load():
+            return False
+        vector_ids, vectors = source.export_vectors()
+        # 同一文档的分块按序号写入，分块跨批次时不会被当作旧版本删除
+        order = sorted(range(len(vector_ids)), key=lambda i: split_vector_id(int(vector_ids[i])))
+        for start in range(0, len(order), 4096):
+            rows = order[start:start + 4096]
+            batch = [int(vector_ids[i]) for i in rows]
+            texts = source.get_texts(batch)
+            metadata = source.get_metadata({split_vector_id(vector_id)[0] for vector_id in batch})
+            self.add_vectors(vectors[rows], batch, [texts[vector_id] for vector_id in batch], metadata)
+        self.embedding_model = source.embedding_model
+        self.save()
+        print(f"Imported {len(order)} vectors from {source.index_path} into {len(self.shards)} shards")
+        return True
+    
+    def start_background_snapshots(self):
+        for shard in self.shards:
+            shard.start_background_snapshots()
+    
+    def stop_background_snapshots(self):
+        for shard in self.shards:
+            shard.stop_background_snapshots()
+    
+    def snapshot_files(self):
+        return [path for shard in self.shards for path in shard.snapshot_files()]
+    
+    def snapshot_signature(self):
+        if any(os.path.exists(shard.commit_path) for shard in self.shards):
+            return None
+        signatures = tuple(shard.snapshot_signature() for shard in self.shards)
+        return None if all(signature is None for signature in signatures) else signatures
+    
+    @property
+    def loaded_signature(self):
+        signatures = tuple(shard.loaded_signature for shard in self.shards)
+        return None if all(signature is None for signature in signatures) else signatures
+    
+    def replace_snapshot(self, staged):
+        # 全部分片的新文件用分片0的一个提交标记一起提交，崩溃后不会出现新旧分片混用
+        self.stop_background_snapshots()
+        with contextlib.ExitStack() as stack:
+            for shard in self.shards:
+                stack.enter_context(shard.snapshot_lock)
+                stack.enter_context(shard.lock.write_lock())
+            for shard in self.shards:
+                if shard.wal.size():
+                    raise RuntimeError(f"WAL at {shard.wal.path} is not empty, save the store before replacing its snapshot")
+            staged_files = [shard._stage_replacement(staged_shard) for shard, staged_shard in zip(self.shards, staged.shards)]
+            self.shards[0]._commit_files([path for paths, _ in staged_files for path in paths])
+            for shard, (_, stale) in zip(self.shards, staged_files):
+                shard._finish_replacement(stale)
+        for shard, staged_shard in zip(self.shards, staged.shards):
+            staged_shard.relocate(shard.index_path, shard.ids_path, shard.texts_path, shard.wal.path)
+        print(f"Replaced snapshots of {len(self.shards)} shards at {self.index_path}")
+    
+    def remove_files(self):
+        for shard in self.shards:
+            shard.remove_files()
+
+# 分片的文件名：data/faiss_index.index -> data/faiss_index.shard0.index
+def shard_paths(options, number):
+    options = dict(options)
+    defaults = {'index_path': 'data/faiss_index.index', 'ids_path': 'data/doc_ids.npy', 'texts_path': 'data/doc_texts.bin'}
+    for key, default in defaults.items():
+        base, extension = os.path.splitext(options.get(key) or default)
+        options[key] = f"{base}.shard{number}{extension}"
+    if options.get('wal_path'):
+        base, extension = os.path.splitext(options['wal_path'])
+        options['wal_path'] = f"{base}.shard{number}{extension}"
+    return options
 
 # Milvus存储实现（可选）
+# 写入先进入缓冲区，攒够insert_batch行或第一条缓冲超过flush_interval秒后整批删除旧分块并插入，
+# 大批量导入不再逐条请求；向量索引在导入后第一次查询时创建一次，之后的查询复用已加载的集合。
+# 集合不存在时按配置的维度或第一批向量的维度创建
 class MilvusStore(VectorStore):
+    store_label = 'milvus'
+    # 与旧版本一致的IVF_FLAT索引参数
+    INDEX_PARAMS = {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 128}}
+    SEARCH_PARAMS = {"metric_type": "L2", "params": {"nprobe": 10}}
+    
     def __init__(self, **kwargs):
         try:
-            from pymilvus import connections, Collection, CollectionSchema, FieldSchema, DataType
+            from pymilvus import connections, utility, Collection, CollectionSchema, FieldSchema, DataType
             self.pymilvus_available = True
             self.connections = connections
+            self.utility = utility
             self.Collection = Collection
             self.CollectionSchema = CollectionSchema
             self.FieldSchema = FieldSchema
             self.DataType = DataType
             
-            # Milvus配置
+            # Milvus配置；设置uri时优先使用（如Milvus Lite的本地文件路径），否则连接host:port
             self.host = kwargs.get('host', 'localhost')
             self.port = kwargs.get('port', 19530)
+            self.uri = kwargs.get('uri') or None
             self.collection_name = kwargs.get('collection_name', 'vectors')
             self.collection = None
+            self.vector_dimension = int(kwargs.get('dimension') or 0) or None
+            # 旧版本创建的集合没有parent_id字段，只能按向量ID删除文档的第0块
+            self.has_parent_field = False
+            # 集合是否已建索引并加载，加载后不再重复检查
+            self.loaded = False
+            
+            # 写入缓冲：按父文档保存待插入的分块，同一文档再次写入时整体替换；insert_batch为0表示直接写入
+            self.insert_batch = int(kwargs.get('insert_batch', 1000))
+            self.flush_interval = float(kwargs.get('flush_interval', 1.0))
+            self.pending = {}
+            self.pending_rows = 0
+            self.flush_timer = None
+            # lock保护缓冲区；flush_lock保证写入Milvus的删除和插入按顺序执行
+            self.lock = threading.Lock()
+            self.flush_lock = threading.Lock()
             
             # 连接Milvus
             self._connect()
-            # 创建集合（如果不存在）
-            self._create_collection_if_not_exists()
+            # 打开已有的集合，或在维度已知时创建集合
+            self._open_collection()
         except ImportError:
             print("pymilvus library not found. Please install it with 'pip install pymilvus'")
             self.pymilvus_available = False
     
     def _connect(self):
         if self.pymilvus_available:
-            self.connections.connect("default", host=self.host, port=self.port)
-            print(f"Connected to Milvus at {self.host}:{self.port}")
+            if self.uri:
+                self.connections.connect("default", uri=self.uri)
+                print(f"Connected to Milvus at {self.uri}")
+            else:
+                self.connections.connect("default", host=self.host, port=self.port)
+                print(f"Connected to Milvus at {self.host}:{self.port}")
     
-    def _create_collection_if_not_exists(self):
-        if not self.pymilvus_available:
-            return
-        
+    def _open_collection(self):
         try:
-            # 定义字段
-            fields = [
-                self.FieldSchema(name="id", dtype=self.DataType.INT64, is_primary=True, auto_id=False),
-                self.FieldSchema(name="vector", dtype=self.DataType.FLOAT_VECTOR, dim=768),  # 默认使用768维
-                self.FieldSchema(name="text", dtype=self.DataType.VARCHAR, max_length=65535)
-            ]
-            
-            # 创建schema
-            schema = self.CollectionSchema(fields, "Vector search collection")
-            
-            # 创建集合（如果不存在）
-            if self.collection_name not in self.connections.get_connection_addr("default").list_collections():
-                self.collection = self.Collection(self.collection_name, schema)
-                print(f"Created Milvus collection: {self.collection_name}")
-            else:
+            if self.utility.has_collection(self.collection_name):
                 self.collection = self.Collection(self.collection_name)
-                print(f"Loaded Milvus collection: {self.collection_name}")
+                self.has_parent_field = any(field.name == 'parent_id' for field in self.collection.schema.fields)
+                self.vector_dimension = next(
+                    int(field.params['dim']) for field in self.collection.schema.fields if field.name == 'vector'
+                )
+                print(f"Loaded Milvus collection: {self.collection_name} (dimension {self.vector_dimension})")
+            elif self.vector_dimension:
+                self._create_collection(self.vector_dimension)
         except Exception as e:
-            print(f"Error creating Milvus collection: {str(e)}")
+            print(f"Error opening Milvus collection: {str(e)}")
+    
+    def _create_collection(self, dimension):
+        # 定义字段
+        fields = [
+            self.FieldSchema(name="id", dtype=self.DataType.INT64, is_primary=True, auto_id=False),
+            self.FieldSchema(name="vector", dtype=self.DataType.FLOAT_VECTOR, dim=dimension),
+            self.FieldSchema(name="text", dtype=self.DataType.VARCHAR, max_length=65535),
+            # 分块所属的父文档ID，用于按文档删除全部分块
+            self.FieldSchema(name="parent_id", dtype=self.DataType.INT64)
+        ]
+        schema = self.CollectionSchema(fields, "Vector search collection")
+        self.collection = self.Collection(self.collection_name, schema)
+        self.has_parent_field = True
+        self.vector_dimension = dimension
+        print(f"Created Milvus collection: {self.collection_name} (dimension {dimension})")
     
     def add_vector(self, vector, doc_id, text):
-        if not self.pymilvus_available or self.collection is None:
+        return self.add_vectors(np.array([vector]), [doc_id], [text])
+    
+    def _delete_expr(self, doc_ids):
+        ids = ', '.join(str(int(doc_id)) for doc_id in doc_ids)
+        if self.has_parent_field:
+            return f"parent_id in [{ids}]"
+        return f"id in [{ids}]"
+    
+    def add_vectors(self, vectors, doc_ids, texts, metadata=None):
+        # 集合的schema中没有元数据字段，元数据不写入Milvus
+        if not self.pymilvus_available:
             return False
         
-        try:
-            # 准备数据
-            entities = [
-                [doc_id],  # id
-                [vector.tolist()],  # vector
-                [text[:65535]]  # text (截断超长文本)
-            ]
+        # 按父文档分组放入缓冲区，替换该文档尚未写入的旧版本
+        rows = {}
+        for vector, doc_id, text in zip(vectors, doc_ids, texts):
+            doc_id = int(doc_id)
+            rows.setdefault(split_vector_id(doc_id)[0], []).append(
+                (doc_id, np.asarray(vector, dtype='float32').tolist(), text[:65535])
+            )
+        with self.lock:
+            if self.vector_dimension is None and rows:
+                # 集合在第一次写出缓冲区时按该维度创建
+                self.vector_dimension = len(next(iter(rows.values()))[0][1])
+            for parent, chunks in rows.items():
+                previous = self.pending.pop(parent, None)
+                self.pending_rows += len(chunks) - (len(previous) if previous else 0)
+                self.pending[parent] = chunks
+            self.generation += 1
+            full = self.pending_rows >= self.insert_batch
+            if not full and self.flush_timer is None and self.flush_interval > 0:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+        if full:
+            return self.flush()
+        return True
+    
+    def flush(self):
+        # 把缓冲区中的分块写入Milvus：一次删除这些文档的旧分块，再一次插入全部新分块
+        with self.flush_lock:
+            with self.lock:
+                pending = self.pending
+                self.pending = {}
+                self.pending_rows = 0
+                if self.flush_timer is not None:
+                    self.flush_timer.cancel()
+                    self.flush_timer = None
+            if not pending:
+                return True
             
-            # 插入数据
-            self.collection.insert(entities)
-            # 创建索引（如果不存在）
-            if not self.collection.has_index('vector'):
-                index_params = {"index_type": "IVF_FLAT", "metric_type": "L2", "params": {"nlist": 128}}
-                self.collection.create_index("vector", index_params)
+            rows = [row for chunks in pending.values() for row in chunks]
+            try:
+                with stage_timer('insert', 'milvus'):
+                    if self.collection is None:
+                        self._create_collection(self.vector_dimension)
+                    else:
+                        self.collection.delete(self._delete_expr(list(pending)))
+                    # 按列组织数据，一次插入整批实体
+                    entities = [[row[0] for row in rows], [row[1] for row in rows], [row[2] for row in rows]]
+                    if self.has_parent_field:
+                        entities.append([split_vector_id(row[0])[0] for row in rows])
+                    self.collection.insert(entities)
+                # 另一线程正在写出缓冲区时，搜索可能看不到刚确认的写入，插入完成后再递增一次代数
+                self.generation += 1
+                return True
+            except Exception as e:
+                print(f"Error adding {len(rows)} vectors to Milvus: {str(e)}")
+                count_error('milvus', 'add')
+                self._restore_pending(pending)
+                return False
+    
+    def _restore_pending(self, pending):
+        # 写出失败时把已确认的分块放回缓冲区，等待下次写出重试；写出期间又写入的新版本优先
+        with self.lock:
+            for parent, chunks in pending.items():
+                if parent not in self.pending:
+                    self.pending[parent] = chunks
+                    self.pending_rows += len(chunks)
+            if self.flush_timer is None and self.flush_interval > 0:
+                self.flush_timer = threading.Timer(self.flush_interval, self.flush)
+                self.flush_timer.daemon = True
+                self.flush_timer.start()
+    
+    def _ensure_loaded(self):
+        # 查询前写入缓冲区，使已确认的写入立即可查；写出失败时报错，不返回缺少这些写入的结果。
+        # 第一次查询时建立索引并加载集合
+        if self.pending_rows and not self.flush():
+            raise RuntimeError("failed to flush buffered rows to Milvus")
+        if self.loaded or self.collection is None:
+            return self.collection is not None
+        with self.flush_lock:
+            if not self.loaded:
+                if not self.collection.has_index():
+                    self.collection.create_index("vector", self.INDEX_PARAMS)
+                    print(f"Built index on Milvus collection: {self.collection_name}")
                 self.collection.load()
+                self.loaded = True
+        return True
+    
+    def delete_vector(self, doc_id):
+        if not self.pymilvus_available:
+            return False
+        
+        try:
+            # 与缓冲区的写入按顺序执行，删除不会被之后写入的旧分块覆盖
+            with self.flush_lock:
+                with self.lock:
+                    previous = self.pending.pop(int(doc_id), None)
+                    self.pending_rows -= len(previous) if previous else 0
+                if self.collection is not None:
+                    self.collection.delete(self._delete_expr([doc_id]))
+                # 删除生效后才递增代数，删除期间的搜索结果不会以新代数缓存
+                self.generation += 1
             return True
         except Exception as e:
-            print(f"Error adding vector to Milvus: {str(e)}")
+            print(f"Error deleting vector from Milvus: {str(e)}")
+            count_error('milvus', 'delete')
             return False
     
-    def search_vectors(self, query_vector, top_k):
-        if not self.pymilvus_available or self.collection is None:
-            return []
+    def get_texts(self, doc_ids):
+        if not self.pymilvus_available or not doc_ids:
+            return {}
         
         try:
-            # 确保集合已加载
-            if not self.collection.is_loaded:
-                self.collection.load()
-            
-            # 搜索参数
-            search_params = {"metric_type": "L2", "params": {"nprobe": 10}}
+            if not self._ensure_loaded():
+                return {}
+            with stage_timer('hydrate', 'milvus'):
+                rows = self.collection.query(
+                    expr=f"id in [{', '.join(str(int(doc_id)) for doc_id in doc_ids)}]",
+                    output_fields=["id", "text"]
+                )
+            return {int(row["id"]): row["text"] for row in rows}
+        except Exception as e:
+            print(f"Error querying texts from Milvus: {str(e)}")
+            count_error('milvus', 'hydrate')
+            return {}
+    
+    def search_vectors(self, query_vector, top_k, max_distance=None, min_score=None):
+        return self.search_batch([query_vector], top_k, max_distance, min_score)[0]
+    
+    def search_batch(self, query_vectors, top_k, max_distance=None, min_score=None, filters=None):
+        if filters is not None:
+            raise ValueError("Metadata filters are not supported by the milvus store")
+        if not self.pymilvus_available:
+            return [[] for _ in query_vectors]
+        
+        try:
+            if not self._ensure_loaded():
+                return [[] for _ in query_vectors]
             
-            # 执行搜索
-            results = self.collection.search(
-                data=[query_vector.tolist()],
-                anns_field="vector",
-                param=search_params,
-                limit=top_k,
-                expr=None,
-                output_fields=["id", "text"]
-            )
+            # 执行搜索，多条查询一次请求；文本随搜索结果一并返回
+            with stage_timer('search', 'milvus'):
+                results = self.collection.search(
+                    data=[np.asarray(query_vector, dtype='float32').tolist() for query_vector in query_vectors],
+                    anns_field="vector",
+                    param=self.SEARCH_PARAMS,
+                    limit=top_k * CHUNK_OVERSAMPLE,
+                    expr=None,
+                    output_fields=["id", "text"]
+                )
             
             # 处理搜索结果
             search_results = []
             for hits in results:
+                query_results = []
                 for hit in hits:
-                    search_results.append({
-                        "doc_id": hit.entity.get("id"),
-                        "text": hit.entity.get("text")
+                    if not passes_cutoff(hit.distance, max_distance, min_score):
+                        continue
+                    doc_id, chunk_no = split_vector_id(hit.entity.get("id"))
+                    query_results.append({
+                        "doc_id": doc_id,
+                        "chunk": chunk_no,
+                        "text": hit.entity.get("text"),
+                        "distance": float(hit.distance),
+                        "score": distance_to_score(hit.distance)
                     })
+                search_results.append(collapse_chunks(query_results, top_k))
             return search_results
         except Exception as e:
             print(f"Error searching vectors in Milvus: {str(e)}")
-            return []
+            count_error('milvus', 'search')
+            return [[] for _ in query_vectors]
     
     def save(self):
         if not self.pymilvus_available:
             return False
         
-        try:
-            # Milvus数据自动持久化
-            print("Milvus data is automatically persisted")
-            return True
-        except Exception as e:
-            print(f"Error saving Milvus data: {str(e)}")
-            return False
+        # Milvus数据自动持久化，只需写入缓冲区中的分块
+        return self.flush()
     
     def load(self):
         if not self.pymilvus_available:
             return False
         
         try:
-            # Milvus数据自动加载
-            if self.collection is not None and not self.collection.is_loaded:
-                self.collection.load()
+            # 建立索引（如果尚未建立）并加载集合
+            self._ensure_loaded()
             print("Milvus data is automatically loaded")
             return True
         except Exception as e:
@@ -306,13 +1852,53 @@ class MilvusStore(VectorStore):
 
 # 工厂方法创建向量存储实例
 def create_vector_store(store_type='memory', **kwargs):
+    if store_type in ('memory', 'disk'):
+        # FAISS存储的压缩比例和索引类型参数
+        index_options = {
+            'compact_ratio': float(kwargs.get('compact_ratio', 0.2)),
+            'index_type': kwargs.get('index_type', 'flat'),
+            'nlist': int(kwargs.get('nlist', 100)),
+            'nprobe': int(kwargs.get('nprobe', 10)),
+            'ef_search': int(kwargs.get('ef_search', 64)),
+            'hnsw_m': int(kwargs.get('hnsw_m', 32)),
+            'pq_m': int(kwargs.get('pq_m', 16)),
+            'train_threshold': int(kwargs.get('train_threshold', 10000)),
+            'lexical': bool(kwargs.get('lexical', True)),
+            'encoding': kwargs.get('encoding', 'float32'),
+            'pca_dim': int(kwargs.get('pca_dim', 0))
+        }
+    
+    shards = int(kwargs.get('shards') or 1)
+    if store_type in ('memory', 'disk') and shards > 1:
+        # 各分片达到训练阈值的对应比例后分别迁移，整体仍在约train_threshold个文档时迁移
+        shard_options = dict(kwargs, shards=1, train_threshold=max(1, index_options['train_threshold'] // shards))
+        unsharded = None
+        if store_type == 'disk':
+            unsharded = lambda: create_vector_store('disk', **dict(kwargs, shards=1))
+        return ShardedFAISSStore(
+            [create_vector_store(store_type, **shard_paths(shard_options, number)) for number in range(shards)],
+            search_threads=int(kwargs.get('shard_threads') or 0),
+            omp_threads=int(kwargs.get('shard_omp_threads') or 0),
+            unsharded=unsharded
+        )
+    
     if store_type == 'memory':
-        return FAISSMemoryStore()
+        return FAISSMemoryStore(**index_options)
     elif store_type == 'disk':
         index_path = kwargs.get('index_path', 'data/faiss_index.index')
         ids_path = kwargs.get('ids_path', 'data/doc_ids.npy')
-        texts_path = kwargs.get('texts_path', 'data/doc_texts.txt')
-        return FAISSDiskStore(index_path, ids_path, texts_path)
+        texts_path = kwargs.get('texts_path', 'data/doc_texts.bin')
+        return FAISSDiskStore(
+            index_path, ids_path, texts_path,
+            wal_path=kwargs.get('wal_path'),
+            wal_fsync=bool(kwargs.get('wal_fsync', False)),
+            snapshot_interval=float(kwargs.get('snapshot_interval', 300)),
+            snapshot_wal_bytes=int(kwargs.get('snapshot_wal_bytes', 64 * 1024 * 1024)),
+            mmap=bool(kwargs.get('mmap', False)),
+            read_only=bool(kwargs.get('read_only', False)),
+            wal=bool(kwargs.get('wal', True)),
+            **index_options
+        )
     elif store_type == 'milvus':
         return MilvusStore(**kwargs)
     else:
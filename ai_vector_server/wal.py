@@ -0,0 +1,141 @@
+import json
+import os
+import struct
+import zlib
+import numpy as np
+
+# 预写日志（WAL）操作类型
+OP_ADD = 1
+OP_DELETE = 2
+
+# 记录头：负载长度、CRC32校验值、操作类型
+_HEADER = struct.Struct('<IIB')
+_COUNTS = struct.Struct('<II')
+
+# 追加写入的预写日志，每次写操作只记录变化的部分。
+# 快照开始时当前日志被轮转为 .old 段，快照提交成功后再删除，
+# 启动时先重放 .old 段再重放当前日志。记录都是按doc_id的覆盖写入和删除，重复重放结果不变
+class WriteAheadLog:
+    def __init__(self, path, fsync=False):
+        self.path = path
+        self.rotated_path = path + '.old'
+        self.fsync = fsync
+        self.file = None
+
+    def _open(self):
+        if self.file is None:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            self.file = open(self.path, 'ab')
+        return self.file
+
+    def _append(self, op, payload):
+        f = self._open()
+        crc = zlib.crc32(payload, zlib.crc32(bytes([op])))
+        f.write(_HEADER.pack(len(payload), crc, op))
+        f.write(payload)
+        f.flush()
+        if self.fsync:
+            os.fsync(f.fileno())
+
+    def append_add(self, doc_ids, matrix, texts, metadata=None):
+        encoded = [text.encode('utf-8') for text in texts]
+        parts = [
+            _COUNTS.pack(len(doc_ids), matrix.shape[1]),
+            np.asarray(doc_ids, dtype='<i8').tobytes(),
+            np.ascontiguousarray(matrix, dtype='<f4').tobytes(),
+            np.array([len(e) for e in encoded], dtype='<u4').tobytes()
+        ]
+        # 文档元数据以JSON追加在文本之后，没有元数据的记录与旧格式相同
+        if metadata:
+            encoded.append(json.dumps([[doc_id, values] for doc_id, values in metadata.items()], ensure_ascii=False).encode('utf-8'))
+        self._append(OP_ADD, b''.join(parts + encoded))
+
+    def append_delete(self, doc_ids):
+        payload = _COUNTS.pack(len(doc_ids), 0) + np.asarray(doc_ids, dtype='<i8').tobytes()
+        self._append(OP_DELETE, payload)
+
+    def size(self):
+        total = 0
+        for path in (self.rotated_path, self.path):
+            if os.path.exists(path):
+                total += os.path.getsize(path)
+        return total
+
+    def rotate(self):
+        # 关闭当前日志并转为 .old 段，之后的写操作进入新日志
+        self.close()
+        if not os.path.exists(self.path):
+            return
+        if os.path.exists(self.rotated_path):
+            # 上一次快照未完成，把当前日志接到旧段后面
+            with open(self.rotated_path, 'ab') as dst, open(self.path, 'rb') as src:
+                while True:
+                    block = src.read(1 << 20)
+                    if not block:
+                        break
+                    dst.write(block)
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+
+    def discard_rotated(self):
+        if os.path.exists(self.rotated_path):
+            os.remove(self.rotated_path)
+
+    def records(self):
+        # 依次返回(文件路径, 记录偏移, 操作, 记录内容)
+        for path in (self.rotated_path, self.path):
+            if os.path.exists(path):
+                yield from self._read(path)
+
+    def _read(self, path):
+        with open(path, 'rb') as f:
+            offset = 0
+            while True:
+                header = f.read(_HEADER.size)
+                if not header:
+                    return
+                valid = len(header) == _HEADER.size
+                if valid:
+                    length, crc, op = _HEADER.unpack(header)
+                    payload = f.read(length)
+                    valid = len(payload) == length and zlib.crc32(payload, zlib.crc32(bytes([op]))) == crc
+                if not valid:
+                    # 进程崩溃时写了一半的记录，截断后继续追加
+                    print(f"Truncating torn WAL record in {path} at offset {offset}")
+                    break
+                start = offset
+                offset += _HEADER.size + length
+                yield path, start, op, self._decode(op, payload)
+
+        self.close()
+        os.truncate(path, offset)
+
+    @staticmethod
+    def _decode(op, payload):
+        n, dim = _COUNTS.unpack_from(payload)
+        pos = _COUNTS.size
+        doc_ids = np.frombuffer(payload, dtype='<i8', count=n, offset=pos).tolist()
+        pos += 8 * n
+        if op == OP_DELETE:
+            return doc_ids, None, None, None
+
+        vectors = np.frombuffer(payload, dtype='<f4', count=n * dim, offset=pos).reshape(n, dim)
+        pos += 4 * n * dim
+        lengths = np.frombuffer(payload, dtype='<u4', count=n, offset=pos).tolist()
+        pos += 4 * n
+        texts = []
+        for length in lengths:
+            texts.append(payload[pos:pos + length].decode('utf-8'))
+            pos += length
+        metadata = None
+        if pos < len(payload):
+            metadata = {int(doc_id): values for doc_id, values in json.loads(payload[pos:].decode('utf-8'))}
+        return doc_ids, vectors, texts, metadata
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
@@ -12,10 +12,17 @@ class AIController extends Controller
     public function ask(Request $request)
     {
         $question = $request->input('question');
+        $category = $request->input('category');
 
+        // 可选的相关性分数下限，过滤与问题无关的知识，避免污染提示词；
+        // 可选的搜索模式，hybrid 对服务名、城市等短关键词问题效果更好；
+        // 指定分类时只在该分类的知识中搜索
         $search = Http::post(env('EMBEDDING_API_URL') . '/search', [
             'text' => $question,
-            'top_k' => 5
+            'top_k' => 5,
+            'min_score' => env('VECTOR_SEARCH_MIN_SCORE') ?: null,
+            'mode' => env('VECTOR_SEARCH_MODE') ?: null,
+            'filter' => $category ? ['category' => $category] : null
         ]);
 
         $related = $search->json()['results'] ?? [];
@@ -42,7 +49,9 @@ class AIController extends Controller
         AIChatLog::create([
             'user_id' => $userId,
             'question' => $question,
-            'answer' => $answer
+            'answer' => $answer,
+            // 向量服务开启 METRICS_TIMING_HEADERS 时返回的各阶段耗时
+            'search_timing' => $search->header('Server-Timing') ?: null
         ]);
 
         return ['question' => $question, 'answer' => $answer, 'context_used' => $related];
@@ -112,7 +121,8 @@ class AIController extends Controller
         // 添加到向量存储 - 修复URL格式错误
         $vectorResponse = Http::post(env('EMBEDDING_API_URL') . '/add-doc', [
             'doc_id' => $knowledge->id,
-            'text' => $knowledgeData['content']
+            'text' => $knowledgeData['content'],
+            'metadata' => ['category' => $knowledge->category]
         ]);
 
         if ($vectorResponse->failed()) {
@@ -127,7 +137,8 @@ class AIController extends Controller
                     CURLOPT_POST => true,
                     CURLOPT_POSTFIELDS => json_encode([
                         'doc_id' => $knowledge->id,
-                        'text' => $knowledgeData['content']
+                        'text' => $knowledgeData['content'],
+                        'metadata' => ['category' => $knowledge->category]
                     ]),
                     CURLOPT_HTTPHEADER => [
                         'Content-Type: application/json'
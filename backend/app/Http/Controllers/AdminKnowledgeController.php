@@ -19,7 +19,8 @@ class AdminKnowledgeController extends Controller
 
         Http::post(env('EMBEDDING_API_URL') . '/add-doc', [
             'doc_id' => $knowledge->id,
-            'text'   => $knowledge->content
+            'text'   => $knowledge->content,
+            'metadata' => ['category' => $knowledge->category]
         ]);
 
         return response()->json(['status' => 'ok', 'id' => $knowledge->id]);
@@ -33,7 +34,8 @@ class AdminKnowledgeController extends Controller
         // 更新向量数据库
         Http::post(env('EMBEDDING_API_URL') . '/update-doc', [
             'doc_id' => $knowledge->id,
-            'text'   => $knowledge->content
+            'text'   => $knowledge->content,
+            'metadata' => ['category' => $knowledge->category]
         ]);
         
         return response()->json(['status' => 'ok']);
@@ -51,4 +53,46 @@ class AdminKnowledgeController extends Controller
         
         return response()->json(['status' => 'ok']);
     }
+    
+    public function reindex()
+    {
+        $count = 0;
+        $failed = [];
+        
+        // 分批批量写入向量数据库，避免逐条请求；写入失败的批次记录ID范围，继续写入后续批次
+        Knowledge::chunkById(500, function ($items) use (&$count, &$failed) {
+            try {
+                $response = Http::post(env('EMBEDDING_API_URL') . '/add-docs', [
+                    'docs' => $items->map(function ($knowledge) {
+                        return [
+                            'doc_id' => $knowledge->id,
+                            'text'   => $knowledge->content,
+                            'metadata' => ['category' => $knowledge->category]
+                        ];
+                    })->values()->all()
+                ]);
+                $ok = !$response->failed() && $response->json('status') === 'ok';
+                $message = $ok ? null : ($response->json('message') ?: 'HTTP ' . $response->status());
+            } catch (\Exception $e) {
+                $ok = false;
+                $message = $e->getMessage();
+            }
+            
+            if ($ok) {
+                $count += $items->count();
+            } else {
+                $failed[] = [
+                    'from' => $items->first()->id,
+                    'to' => $items->last()->id,
+                    'message' => $message
+                ];
+            }
+        });
+        
+        if ($failed) {
+            return response()->json(['status' => 'error', 'message' => '部分知识写入向量数据库失败', 'count' => $count, 'failed' => $failed], 500);
+        }
+        
+        return response()->json(['status' => 'ok', 'count' => $count]);
+    }
 }
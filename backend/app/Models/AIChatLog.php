@@ -7,5 +7,5 @@ use Illuminate\Database\Eloquent\Model;
 class AIChatLog extends Model
 {
     protected $table = 'ai_chat_logs';
-    protected $fillable = ['user_id','question','answer'];
+    protected $fillable = ['user_id','question','answer','search_timing'];
 }
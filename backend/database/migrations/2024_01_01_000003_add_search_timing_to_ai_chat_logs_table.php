@@ -0,0 +1,29 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+return new class extends Migration
+{
+    /**
+     * 运行数据库迁移
+     */
+    public function up(): void
+    {
+        // 记录向量服务返回的各阶段耗时（Server-Timing头），用于排查回答慢的原因
+        Schema::table('ai_chat_logs', function (Blueprint $table) {
+            $table->string('search_timing')->nullable()->after('answer'); // 如 embed;dur=120.5, search;dur=3.2, total;dur=125.0
+        });
+    }
+
+    /**
+     * 回滚数据库迁移
+     */
+    public function down(): void
+    {
+        Schema::table('ai_chat_logs', function (Blueprint $table) {
+            $table->dropColumn('search_timing');
+        });
+    }
+};
@@ -18,6 +18,7 @@ Route::middleware('auth:sanctum')->group(function () {
     Route::post('/admin/knowledge', [AdminKnowledgeController::class, 'store']);
     Route::post('/admin/knowledge/update', [AdminKnowledgeController::class, 'update']);
     Route::post('/admin/knowledge/delete', [AdminKnowledgeController::class, 'delete']);
+    Route::post('/admin/knowledge/reindex', [AdminKnowledgeController::class, 'reindex']);
     
     // 用户相关路由
     Route::get('/user', [UserController::class, 'getUserInfo']);